@@ -0,0 +1,170 @@
+"""
+Event-driven asyncio dispatcher for the call center
+
+Every employee runs as a worker coroutine waiting on the asyncio.Queue of
+its level. A request submitted to the AsyncCallCenter is put on the queue
+of its severity and picked up by the longest waiting worker of that level.
+When a worker is done it either completes the request or escalates it, in
+which case the request goes straight onto the queue of the next level.
+The worker then goes back to its queue, so it is re-dispatched at once.
+
+The work itself is a coroutine `work(employee, request)` returning True to
+escalate; the default one sleeps for a random handle time. If it raises,
+the request's future gets the exception and the employee takes the next
+request.
+"""
+
+from __future__ import annotations
+import asyncio
+import contextlib
+import os
+import random
+import time
+from typing import Awaitable, Callable, Dict, List
+from employee import IEmployee, Fresher, Lead, Manager
+from request import IRequest, Call, Status
+from levels import EmployeeLevel
+
+Work = Callable[[IEmployee, IRequest], Awaitable[bool]]
+
+
+def random_work(
+    handle_time: float = 0.002, escalation_rate: float = 0.1, seed: int = 0
+) -> Work:
+    rng = random.Random(seed)
+
+    async def work(employee: IEmployee, request: IRequest) -> bool:
+        await asyncio.sleep(rng.expovariate(1 / handle_time))
+        return rng.random() < escalation_rate
+
+    return work
+
+
+class AsyncCallCenter:
+    def __init__(self, work: Work = None, quiet: bool = False):
+        self.work = work or random_work()
+        # IEmployee prints on every call, too much with thousands of calls
+        self.quiet = quiet
+        self.queues: Dict[EmployeeLevel, asyncio.Queue] = {
+            level: asyncio.Queue() for level in EmployeeLevel
+        }
+        self.employees: List[IEmployee] = []
+        self.completed = 0
+        self.escalated = 0
+        self.failed = 0
+        self._workers: List[asyncio.Task] = []
+        self._results: Dict[IRequest, asyncio.Future] = {}
+        self._devnull = open(os.devnull, "w") if quiet else None
+
+    def _output(self):
+        if self.quiet:
+            return contextlib.redirect_stdout(self._devnull)
+        return contextlib.nullcontext()
+
+    def add_employee(self, employee: IEmployee) -> None:
+        self.employees.append(employee)
+        self._workers.append(asyncio.create_task(self._run(employee)))
+
+    def submit(self, request: IRequest) -> asyncio.Future:
+        """
+        Queue a request. The future resolves with the request once it is
+        completed, at whatever level.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._results[request] = future
+        self.queues[request.severity].put_nowait(request)
+        return future
+
+    async def _run(self, employee: IEmployee) -> None:
+        queue = self.queues[employee.level]
+        while True:
+            request = await queue.get()
+            with self._output():
+                employee.take_call(request)
+            try:
+                escalate = await self.work(employee, request)
+            except Exception as e:
+                # free the employee, the caller learns about it from the future
+                employee.request = None
+                employee.available = True
+                request.status = Status.Open
+                self.failed += 1
+                self._results.pop(request).set_exception(e)
+                continue
+            with self._output():
+                if escalate and employee.level != EmployeeLevel.Manager:
+                    employee.escalate()
+                    self.escalated += 1
+                    self.queues[request.severity].put_nowait(request)
+                else:
+                    employee.handle_request()
+                    self.completed += 1
+                    self._results.pop(request).set_result(request)
+
+    @property
+    def in_progress(self) -> int:
+        return len(self._results)
+
+    async def close(self) -> None:
+        """
+        Stop the workers. Requests still waiting stay unresolved.
+        """
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        if self._devnull is not None:
+            self._devnull.close()
+
+
+async def run(calls: int = 20_000, freshers: int = 200, leads: int = 40, managers: int = 5):
+    center = AsyncCallCenter(random_work(handle_time=0.01), quiet=True)
+    for i in range(freshers):
+        center.add_employee(Fresher(f"f{i}"))
+    for i in range(leads):
+        center.add_employee(Lead(f"l{i}"))
+    for i in range(managers):
+        center.add_employee(Manager(f"m{i}"))
+
+    rng = random.Random(1)
+    severities = [EmployeeLevel.Fresher] * 8 + [EmployeeLevel.Lead] * 2
+    start = time.perf_counter()
+    futures = [
+        center.submit(Call(i, f"customer{i}", rng.choice(severities)))
+        for i in range(calls)
+    ]
+    await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{calls} concurrent calls handled by {len(center.employees)} employees "
+        f"in {elapsed:.2f}s ({calls / elapsed:,.0f} calls/s), "
+        f"{center.escalated} escalations"
+    )
+    await center.close()
+
+    # work that fails for some calls: the others are still handled
+    async def flaky(employee: IEmployee, request: IRequest) -> bool:
+        await asyncio.sleep(0)
+        if request.id % 3 == 0:
+            raise Exception(f"line dropped on call {request.id}")
+        return False
+
+    center = AsyncCallCenter(flaky, quiet=True)
+    center.add_employee(Fresher("f0"))
+    center.add_employee(Fresher("f1"))
+    futures = [center.submit(Call(i, f"customer{i}", EmployeeLevel.Fresher)) for i in range(9)]
+    results = await asyncio.gather(*futures, return_exceptions=True)
+    errors = sum(isinstance(result, Exception) for result in results)
+    print(
+        f"flaky work: {center.completed} completed, {errors} failed, "
+        f"{center.in_progress} in progress"
+    )
+    await center.close()
+
+
+def main():
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,281 @@
-from typing import List
-from collections import deque
-from employee import Fresher, Lead, Manager
+from __future__ import annotations
+import time
+from typing import Callable, Dict, List, Optional
+from collections import OrderedDict, deque
+from employee import IEmployee, Fresher, Lead, Manager
 from request import IRequest, Status, Call
 from levels import EmployeeLevel
 
 
+class CallCenterListener:
+    """
+    Observer of CallCenter events, e.g. metrics.CallCenterMetrics.
+
+    Every hook is a no-op by default so listeners only override the events
+    they care about. Times are in seconds of the CallCenter clock.
+    """
+
+    def on_employee_added(self, employee: IEmployee) -> None:
+        pass
+
+    def on_employee_removed(self, employee: IEmployee) -> None:
+        pass
+
+    def on_queued(self, request: IRequest, depth: int, requeued: bool) -> None:
+        pass
+
+    def on_dispatched(
+        self, employee: IEmployee, request: IRequest, waited: float, depth: int
+    ) -> None:
+        pass
+
+    def on_completed(
+        self, employee: IEmployee, request: IRequest, handle_time: float
+    ) -> None:
+        pass
+
+    def on_escalated(
+        self, employee: IEmployee, request: IRequest, handle_time: float
+    ) -> None:
+        pass
+
+    def on_abandoned(self, request: IRequest, depth: int) -> None:
+        pass
+
+    def on_stolen(self, request: IRequest, depth: int) -> None:
+        """
+        A waiting request was taken by another site, see federation.Site
+        """
+        pass
+
+
 class CallCenter:
-    def __init__(self, manager: Manager):
-        self.manager: List[manager] = [manager]
+    """
+    Requests are matched with employees of the level of their severity.
+
+    Free employees are kept per level (longest idle first) and waiting
+    requests per severity (FIFO by default), so a request is dispatched in
+    O(1) the moment it arrives or an employee of its level becomes free.
+
+    `queue_factory` creates the waiting queue of each severity: anything
+    with append / popleft / len / iter, e.g. scheduler.SLAQueue instead of
+    the default FIFO deque.
+    """
+
+    def __init__(
+        self,
+        manager: Manager,
+        queue_factory: Callable[[], deque] = deque,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.clock = clock
+        self.manager: Manager = manager
+        self.managers: List[Manager] = [manager]
         self.freshers: List[Fresher] = []
         self.leads: List[Lead] = []
-        self.request_queue: deque[IRequest] = deque()
+        self.free: Dict[EmployeeLevel, OrderedDict[IEmployee, None]] = {
+            level: OrderedDict() for level in EmployeeLevel
+        }
+        self.waiting: Dict[EmployeeLevel, deque[IRequest]] = {
+            level: queue_factory() for level in EmployeeLevel
+        }
+        # abandoned requests still sitting in the waiting queues, skipped
+        # when they reach the front
+        self.abandoned: Dict[EmployeeLevel, int] = {level: 0 for level in EmployeeLevel}
+        # nothing is reported, nor start times kept, while there are no listeners
+        self.listeners: List[CallCenterListener] = []
+        self._started: Dict[IEmployee, float] = {}
+        self._add_employee(manager)
+
+    @property
+    def request_queue(self) -> List[IRequest]:
+        """
+        Waiting requests, by severity then queue order
+        """
+        return [
+            r
+            for level in EmployeeLevel
+            for r in self.waiting[level]
+            if r.status != Status.Abandoned
+        ]
+
+    def queue_depth(self, severity: EmployeeLevel) -> int:
+        return len(self.waiting[severity]) - self.abandoned[severity]
+
+    @property
+    def employees(self) -> List[IEmployee]:
+        return self.freshers + self.leads + self.managers
+
+    def add_listener(self, listener: CallCenterListener) -> None:
+        self.listeners.append(listener)
+        for employee in self.employees:
+            listener.on_employee_added(employee)
+
+    def remove_listener(self, listener: CallCenterListener) -> None:
+        self.listeners.remove(listener)
+        if not self.listeners:
+            self._started.clear()
+
+    def _add_employee(self, employee: IEmployee) -> None:
+        employee.call_center = self
+        for listener in self.listeners:
+            listener.on_employee_added(employee)
+        if employee.available:
+            self.release(employee)
 
     def add_fresher(self, fresher: Fresher) -> None:
         self.freshers.append(fresher)
+        self._add_employee(fresher)
 
     def add_lead(self, lead: Lead) -> None:
-        self.lead.append(lead)
+        self.leads.append(lead)
+        self._add_employee(lead)
+
+    def add_manager(self, manager: Manager) -> None:
+        self.managers.append(manager)
+        self._add_employee(manager)
 
     def change_manager(self, manager: Manager) -> None:
+        old = self.manager
+        old.call_center = None
+        self._remove_free(old)
+        for listener in self.listeners:
+            listener.on_employee_removed(old)
+        self.managers[self.managers.index(old)] = manager
         self.manager = manager
+        self._add_employee(manager)
 
-    def queue_request(self, request: IRequest):
-        self.request_queue.append(request)
-
-    def assign_request(self) -> None:
-        if not self.request_queue:
+    def queue_request(self, request: IRequest) -> None:
+        requeued = request.queued_at is not None
+        request.queued_at = self.clock()
+        employee = self._take_free(request)
+        if employee is not None:
+            if self.listeners:
+                depth = self.queue_depth(request.severity) + 1
+                for listener in self.listeners:
+                    listener.on_queued(request, depth, requeued)
+            self._dispatch(employee, request)
             return
+        self._wait(request)
+        if self.listeners:
+            depth = self.queue_depth(request.severity)
+            for listener in self.listeners:
+                listener.on_queued(request, depth, requeued)
+
+    def completed(self, employee: IEmployee, request: IRequest) -> None:
+        """
+        Called by an employee who handled their request
+        """
+        if self.listeners:
+            now = self.clock()
+            handle_time = now - self._started.pop(employee, now)
+            for listener in self.listeners:
+                listener.on_completed(employee, request, handle_time)
+        self.release(employee)
+
+    def escalated(self, employee: IEmployee, request: IRequest) -> None:
+        """
+        Called by an employee who escalated their request: queue it at its
+        new severity and give the employee the next call
+        """
+        if self.listeners:
+            now = self.clock()
+            handle_time = now - self._started.pop(employee, now)
+            for listener in self.listeners:
+                listener.on_escalated(employee, request, handle_time)
+        self.queue_request(request)
+        self.release(employee)
+
+    def abandon(self, request: IRequest) -> None:
+        """
+        The customer of a waiting request hung up. The request is left in
+        its queue and dropped when it reaches the front.
+        """
+        if request.status != Status.Open:
+            raise Exception(f"Request {request.id} is not waiting")
+        request.status = Status.Abandoned
+        request.waited += self.clock() - request.queued_at
+        self.abandoned[request.severity] += 1
+        if self.listeners:
+            depth = self.queue_depth(request.severity)
+            for listener in self.listeners:
+                listener.on_abandoned(request, depth)
+
+    def _next_request(self, level: EmployeeLevel) -> IRequest:
+        waiting = self.waiting[level]
+        request = waiting.popleft()
+        while request.status == Status.Abandoned:
+            self.abandoned[level] -= 1
+            request = waiting.popleft()
+        return request
 
-        request = self.request_queue.popleft()
+    def _dispatch(self, employee: IEmployee, request: IRequest) -> None:
+        now = self.clock()
+        waited = now - request.queued_at
+        request.waited += waited
+        if self.listeners:
+            self._started[employee] = now
+            depth = self.queue_depth(request.severity)
+            for listener in self.listeners:
+                listener.on_dispatched(employee, request, waited, depth)
+        employee.take_call(request)
 
-        employee_pool = self.freshers
-        if request.severity == EmployeeLevel.Lead:
-            employee_pool = self.leads
-        elif request.severity == EmployeeLevel.Manager:
-            employee_pool = self.manager
+    # free pool and waiting queues, overridden by other routing schemes
 
-        for e in employee_pool:
-            if e.available:
-                e.take_call(request)
-                break
+    def _take_free(self, request: IRequest) -> Optional[IEmployee]:
+        """
+        Remove and return a free employee who can take `request`
+        """
+        free = self.free[request.severity]
+        if free:
+            return free.popitem(last=False)[0]
+        return None
 
-        # re-queue request if not taken by anyone
-        if request.status == Status.Open:
-            print("No one is available to take request. Request re-queued")
-            self.queue_request(request)
+    def _add_free(self, employee: IEmployee) -> None:
+        self.free[employee.level][employee] = None
+
+    def _remove_free(self, employee: IEmployee) -> None:
+        self.free[employee.level].pop(employee, None)
+
+    def _wait(self, request: IRequest) -> None:
+        self.waiting[request.severity].append(request)
+
+    def _next_request_for(self, employee: IEmployee) -> Optional[IRequest]:
+        """
+        Remove and return the next waiting request `employee` can take
+        """
+        if self.queue_depth(employee.level):
+            return self._next_request(employee.level)
+        return None
+
+    def release(self, employee: IEmployee) -> None:
+        """
+        Called when an employee is free: hand them the oldest waiting
+        request of their level, or mark them free
+        """
+        request = self._next_request_for(employee)
+        if request is not None:
+            self._dispatch(employee, request)
+        else:
+            self._add_free(employee)
+
+    def assign_request(self) -> int:
+        """
+        Dispatch waiting requests to free employees. Requests are matched
+        on arrival and on release already, so this only has work to do if
+        employees were made available from outside the CallCenter.
+        Returns the number of requests assigned.
+        """
+        assigned = 0
+        for level in EmployeeLevel:
+            for employee in list(self.free[level]):
+                request = self._next_request_for(employee)
+                if request is None:
+                    continue
+                self._remove_free(employee)
+                self._dispatch(employee, request)
+                assigned += 1
+        return assigned
 
 
 if __name__ == "__main__":
@@ -58,4 +289,21 @@ if __name__ == "__main__":
 
     print(center.request_queue)
 
-    center.assign_request()
+    # the call waits for a lead, who takes it as soon as they join
+    lead = Lead("l1")
+    center.add_lead(lead)
+    print(center.request_queue, lead.request.id)
+
+    # the fresher is busy, the second fresher call waits
+    fresher = center.freshers[0]
+    center.queue_request(Call(2, "customer2", EmployeeLevel.Fresher))
+    center.queue_request(Call(3, "customer3", EmployeeLevel.Fresher))
+    print([r.id for r in center.request_queue])
+
+    # escalating frees the fresher, who picks up call 3 right away
+    escalated = fresher.escalate()
+    print(escalated.severity, fresher.request.id, [r.id for r in center.request_queue])
+
+    # the lead finishes call 1 and takes the escalated call 2
+    lead.handle_request()
+    print(lead.request.id, center.request_queue)
@@ -1,20 +1,28 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 from request import IRequest, Status, Call
 from levels import EmployeeLevel
 
+if TYPE_CHECKING:
+    from call_center import CallCenter
+
 
 class IEmployee(ABC):
     def __init__(
         self,
         level: EmployeeLevel,
         name: str,
+        skills: int = 0,
     ):
         self.name = name
+        # bitset of skills.Skills
+        self.skills = skills
         self.available: bool = True
         self.level: EmployeeLevel = level
         self.request: IRequest = None
+        # set by CallCenter, told when the employee is free again
+        self.call_center: Optional[CallCenter] = None
 
     def handle_request(self) -> Optional[IRequest]:
         """
@@ -31,6 +39,9 @@ class IEmployee(ABC):
         self.request.status = Status.Complete
         req = self.request
         self.request = None
+        self.available = True
+        if self.call_center is not None:
+            self.call_center.completed(self, req)
         return req
 
     def take_call(self, request: IRequest) -> None:
@@ -45,45 +56,57 @@ class IEmployee(ABC):
 
         self.request = request
         self.request.status = Status.InWork
+        self.available = False
         print(f"Request taken by {self.level}: {self.name}")
 
+    def _escalate_to(self, level: EmployeeLevel) -> Optional[IRequest]:
+        """
+        Reopen the current request at `level`. When the employee works for
+        a CallCenter the request is queued there and the employee picks up
+        the next waiting call.
+        """
+        if not self.request:
+            return None
+
+        request = self.request
+        request.severity = level
+        request.status = Status.Open
+        self.request = None
+        self.available = True
+        if self.call_center is not None:
+            self.call_center.escalated(self, request)
+        return request
+
     @abstractmethod
     def escalate(self) -> Optional[IRequest]:
         pass
 
 
 class Fresher(IEmployee):
-    def __init__(self, name: str):
-        super().__init__(EmployeeLevel.Fresher, name)
+    def __init__(self, name: str, skills: int = 0):
+        super().__init__(EmployeeLevel.Fresher, name, skills)
 
-    def escalate(self, request: IRequest) -> Optional[IRequest]:
+    def escalate(self) -> Optional[IRequest]:
         """
         Freshers can only escalate to Leads
         """
-        if not self.request:
-            return None
-
-        request.level = EmployeeLevel.Lead
-        request.status = Status.Open
-        return request
+        return self._escalate_to(EmployeeLevel.Lead)
 
 
 class Lead(IEmployee):
-    def __init__(self, name: str):
-        super().__init__(EmployeeLevel.Lead, name)
+    def __init__(self, name: str, skills: int = 0):
+        super().__init__(EmployeeLevel.Lead, name, skills)
 
-    def escalate(self, request: IRequest) -> Optional[IRequest]:
+    def escalate(self) -> Optional[IRequest]:
         """
-        Freshers can only escalate to Managers
+        Leads can only escalate to Managers
         """
-        request.level = EmployeeLevel.Manager
-        request.status = Status.Open
-        return request
+        return self._escalate_to(EmployeeLevel.Manager)
 
 
 class Manager(IEmployee):
-    def __init__(self, name: str):
-        super().__init__(EmployeeLevel.Manager, name)
+    def __init__(self, name: str, skills: int = 0):
+        super().__init__(EmployeeLevel.Manager, name, skills)
 
     def escalate(self) -> Optional[IRequest]:
         raise Exception("Manager cannot escalate requests.")
@@ -0,0 +1,221 @@
+"""
+Multi-site call center with cross-site work stealing
+
+A Federation links several Site instances (CallCenter subclasses, one per
+physical call center). Sites dispatch their own requests as usual and only
+coordinate when one of them has idle employees while another one has
+requests waiting at the same severity:
+- an employee who becomes free with nothing waiting at their own site
+  steals the oldest waiting request they can take from the most loaded site
+- a request that has to wait at a busy site is stolen right away by a site
+  that has a free employee who can take it
+
+Only queues at least `steal_threshold` deep are stolen from, so sites that
+are barely busy keep their own calls. The coordination is a scan of the
+sites' free pools / queue depths, O(number of sites) per steal attempt.
+
+Sites pick the employee and the request through their routing hooks
+(_take_free / _next_request_for), so skill routing applies across sites,
+and the victim's listeners get on_stolen for every request taken away.
+"""
+
+from __future__ import annotations
+import contextlib
+import heapq
+import itertools
+import os
+import random
+from typing import Dict, List, Optional, Tuple
+from call_center import CallCenter
+from employee import IEmployee, Fresher, Lead, Manager
+from request import IRequest, Status, Call
+from levels import EmployeeLevel
+from metrics import CallCenterMetrics
+from simulator import percentile
+
+
+class Site(CallCenter):
+    def __init__(self, name: str, manager: Manager, **kwargs):
+        self.name = name
+        self.federation: Optional[Federation] = None
+        # requests this site took from other sites
+        self.stolen = 0
+        super().__init__(manager, **kwargs)
+
+    def steal(self, employee: IEmployee) -> Optional[IRequest]:
+        """
+        Give away the oldest waiting request `employee`, of another site,
+        can take, if any
+        """
+        request = self._next_request_for(employee)
+        if request is not None and self.listeners:
+            depth = self.queue_depth(request.severity)
+            for listener in self.listeners:
+                listener.on_stolen(request, depth)
+        return request
+
+    def queue_request(self, request: IRequest) -> None:
+        super().queue_request(request)
+        if self.federation is not None and request.status == Status.Open:
+            self.federation.offer(self, request)
+
+    def release(self, employee: IEmployee) -> None:
+        if self.federation is not None and not self.queue_depth(employee.level):
+            request = self.federation.steal_for(self, employee)
+            if request is not None:
+                self.stolen += 1
+                self._dispatch(employee, request)
+                return
+        super().release(employee)
+
+    def __repr__(self) -> str:
+        return self.name
+
+
+class Federation:
+    def __init__(self, sites: List[Site] = None, steal_threshold: int = 1):
+        self.sites: List[Site] = []
+        self.steal_threshold = steal_threshold
+        for site in sites or []:
+            self.add_site(site)
+
+    def add_site(self, site: Site) -> None:
+        site.federation = self
+        self.sites.append(site)
+
+    def remove_site(self, site: Site) -> None:
+        site.federation = None
+        self.sites.remove(site)
+
+    def steal_for(self, thief: Site, employee: IEmployee) -> Optional[IRequest]:
+        """
+        Oldest waiting request `employee` can take at the most loaded other
+        site
+        """
+        victim, deepest = None, self.steal_threshold - 1
+        for site in self.sites:
+            depth = site.queue_depth(employee.level)
+            if site is not thief and depth > deepest:
+                victim, deepest = site, depth
+        if victim is None:
+            return None
+        return victim.steal(employee)
+
+    def offer(self, busy: Site, request: IRequest) -> None:
+        """
+        `request` has to wait at `busy`: let a site with a free employee who
+        can take it take a request from `busy`
+        """
+        if busy.queue_depth(request.severity) < self.steal_threshold:
+            return
+        for site in self.sites:
+            if site is busy:
+                continue
+            employee = site._take_free(request)
+            if employee is None:
+                continue
+            # `request` is waiting at `busy`, so there is one for employee
+            site.stolen += 1
+            site._dispatch(employee, busy.steal(employee))
+            return
+
+    def queue_depth(self, level: EmployeeLevel) -> int:
+        return sum(site.queue_depth(level) for site in self.sites)
+
+
+def simulate(
+    federated: bool,
+    arrival_rates: List[float] = (480, 330, 190),
+    freshers: int = 25,
+    leads: int = 6,
+    days: float = 3,
+    seed: int = 0,
+) -> Tuple[List[float], List[Site]]:
+    """
+    Sites with the same staffing and skewed traffic (calls per hour). The
+    random draws are made per request, so both modes see the same calls.
+    Returns the total wait of every completed request and the sites, each
+    with a CallCenterMetrics listener.
+    """
+    rng = random.Random(seed)
+    now = 0.0
+    events: List[Tuple[float, int, int, object]] = []
+    order = itertools.count()
+    mean_handle = {EmployeeLevel.Fresher: 180, EmployeeLevel.Lead: 300, EmployeeLevel.Manager: 600}
+    escalation = {EmployeeLevel.Fresher: 0.1, EmployeeLevel.Lead: 0.05, EmployeeLevel.Manager: 0.0}
+    plans: Dict[IRequest, Dict[EmployeeLevel, Tuple[float, bool]]] = {}
+
+    class SimSite(Site):
+        def _dispatch(self, employee: IEmployee, request: IRequest) -> None:
+            super()._dispatch(employee, request)
+            handle_time = plans[request][employee.level][0]
+            heapq.heappush(events, (now + handle_time, next(order), 1, employee))
+
+    sites = []
+    for s in range(len(arrival_rates)):
+        site = SimSite(f"site{s}", Manager(f"m{s}"), clock=lambda: now)
+        for i in range(freshers):
+            site.add_fresher(Fresher(f"f{s}.{i}"))
+        for i in range(leads):
+            site.add_lead(Lead(f"l{s}.{i}"))
+        site.metrics = CallCenterMetrics(clock=lambda: now)
+        site.add_listener(site.metrics)
+        sites.append(site)
+    if federated:
+        Federation(sites)
+
+    for s, rate in enumerate(arrival_rates):
+        heapq.heappush(events, (rng.expovariate(rate / 3600), next(order), 0, s))
+    waits: List[float] = []
+    ids = itertools.count()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        while events:
+            now, _, kind, payload = heapq.heappop(events)
+            if now > days * 86400:
+                break
+            if kind == 0:
+                s = payload
+                request = Call(next(ids), "customer", EmployeeLevel.Fresher)
+                plans[request] = {
+                    level: (
+                        rng.expovariate(1 / mean_handle[level]),
+                        rng.random() < escalation[level],
+                    )
+                    for level in EmployeeLevel
+                }
+                sites[s].queue_request(request)
+                heapq.heappush(
+                    events, (now + rng.expovariate(arrival_rates[s] / 3600), next(order), 0, s)
+                )
+            else:
+                employee = payload
+                request = employee.request
+                if plans[request][employee.level][1]:
+                    employee.escalate()
+                else:
+                    employee.handle_request()
+                    del plans[request]
+                    waits.append(request.waited)
+    return waits, sites
+
+
+def main():
+    for federated in (False, True):
+        waits, sites = simulate(federated)
+        stolen = {site.name: site.stolen for site in sites}
+        print(
+            f"{'federated ' if federated else 'independent'}: {len(waits):,} calls, "
+            f"mean wait {sum(waits) / len(waits):7.1f}s, p95 {percentile(waits, 95):7.1f}s, "
+            f"p99 {percentile(waits, 99):7.1f}s, stolen {stolen}"
+        )
+    # the victims' listeners saw their requests leave
+    in_sync = all(
+        site.metrics.levels[level].queue_depth == site.queue_depth(level)
+        for site in sites
+        for level in EmployeeLevel
+    )
+    print(f"queue depth metrics match the queues: {in_sync}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""
+Metrics for CallCenter events
+
+CallCenterMetrics is a CallCenterListener that keeps, per severity / level:
+- current and maximum queue depth
+- time-in-queue and handle-time histograms
+- queued, re-queued, escalated, completed, abandoned and stolen counters
+- busy time, for employee utilization
+
+Recording is one lookup of the level's LevelMetrics and a few attribute
+updates per event: percentiles, means and utilization are only computed
+by snapshot(). CallCenter does no extra work at all while no listener is
+attached.
+
+PeriodicExporter pushes snapshots to a sink from a background thread.
+"""
+
+from __future__ import annotations
+import contextlib
+import io
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional
+from call_center import CallCenter, CallCenterListener
+from employee import IEmployee, Manager
+from request import IRequest
+from levels import EmployeeLevel
+
+
+class DurationHistogram:
+    """
+    Histogram with exponential buckets from 10ms to ~1 day (upper bounds in seconds)
+    """
+
+    BOUNDS: List[float] = [0.01 * 2**i for i in range(24)]
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.buckets[bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, pct: float) -> float:
+        """
+        Upper bound of the bucket holding the given percentile, in seconds
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * pct / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else float("inf")
+        return float("inf")
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class LevelMetrics:
+    """
+    Counters and histograms of one severity / level
+    """
+
+    def __init__(self):
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.wait = DurationHistogram()
+        self.handle = DurationHistogram()
+        self.busy = 0.0
+        self.queued = 0
+        self.requeued = 0
+        self.escalated = 0
+        self.completed = 0
+        self.abandoned = 0
+        self.stolen = 0
+
+    def escalation_rate(self) -> float:
+        handled = self.completed + self.escalated
+        return self.escalated / handled if handled else 0.0
+
+
+class CallCenterMetrics(CallCenterListener):
+    """
+    `clock` must be the clock of the CallCenter, it is only read for
+    snapshots (utilization)
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        # recording takes no lock: readers copy values, which is atomic
+        # under the GIL, and tolerate a counter being one event behind
+        self.staff: Dict[EmployeeLevel, int] = {level: 0 for level in EmployeeLevel}
+        self.reset()
+
+    def reset(self) -> None:
+        self.started = self.clock()
+        self.levels: Dict[EmployeeLevel, LevelMetrics] = {
+            level: LevelMetrics() for level in EmployeeLevel
+        }
+
+    def on_employee_added(self, employee: IEmployee) -> None:
+        self.staff[employee.level] += 1
+
+    def on_employee_removed(self, employee: IEmployee) -> None:
+        self.staff[employee.level] -= 1
+
+    def on_queued(self, request: IRequest, depth: int, requeued: bool) -> None:
+        stats = self.levels[request.severity]
+        stats.queued += 1
+        if requeued:
+            stats.requeued += 1
+        # the only event making a queue longer
+        stats.queue_depth = depth
+        if depth > stats.max_queue_depth:
+            stats.max_queue_depth = depth
+
+    def on_dispatched(
+        self, employee: IEmployee, request: IRequest, waited: float, depth: int
+    ) -> None:
+        stats = self.levels[employee.level]
+        stats.wait.record(waited)
+        stats.queue_depth = depth
+
+    def on_completed(
+        self, employee: IEmployee, request: IRequest, handle_time: float
+    ) -> None:
+        stats = self.levels[employee.level]
+        stats.completed += 1
+        stats.handle.record(handle_time)
+        stats.busy += handle_time
+
+    def on_escalated(
+        self, employee: IEmployee, request: IRequest, handle_time: float
+    ) -> None:
+        stats = self.levels[employee.level]
+        stats.escalated += 1
+        stats.handle.record(handle_time)
+        stats.busy += handle_time
+
+    def on_abandoned(self, request: IRequest, depth: int) -> None:
+        stats = self.levels[request.severity]
+        stats.abandoned += 1
+        stats.queue_depth = depth
+
+    def on_stolen(self, request: IRequest, depth: int) -> None:
+        stats = self.levels[request.severity]
+        stats.stolen += 1
+        stats.queue_depth = depth
+
+    def utilization(self, level: EmployeeLevel) -> float:
+        """
+        Share of the time employees of `level` spent on finished calls
+        since the last reset
+        """
+        elapsed = self.clock() - self.started
+        staff = self.staff[level]
+        return self.levels[level].busy / (staff * elapsed) if staff and elapsed > 0 else 0.0
+
+    def escalation_rate(self, level: EmployeeLevel) -> float:
+        return self.levels[level].escalation_rate()
+
+    def snapshot(self) -> Dict[str, dict]:
+        """
+        Counters, histogram summaries (seconds) and utilization per level
+        """
+        snapshot = {}
+        for level, stats in self.levels.items():
+            snapshot[level.name] = {
+                "queue_depth": stats.queue_depth,
+                "max_queue_depth": stats.max_queue_depth,
+                "queued": stats.queued,
+                "requeued": stats.requeued,
+                "completed": stats.completed,
+                "escalated": stats.escalated,
+                "abandoned": stats.abandoned,
+                "stolen": stats.stolen,
+                "escalation_rate": stats.escalation_rate(),
+                "utilization": self.utilization(level),
+                "wait_mean": stats.wait.mean(),
+                "wait_p50": stats.wait.percentile(50),
+                "wait_p95": stats.wait.percentile(95),
+                "handle_mean": stats.handle.mean(),
+                "handle_p95": stats.handle.percentile(95),
+            }
+        return snapshot
+
+
+def print_snapshot(snapshot: Dict[str, dict]) -> None:
+    for level, stats in snapshot.items():
+        print(
+            f"{level:<8} depth={stats['queue_depth']:<4} max={stats['max_queue_depth']:<4} "
+            f"done={stats['completed']:<7} escalated={stats['escalation_rate']:5.1%} "
+            f"requeued={stats['requeued']:<6} abandoned={stats['abandoned']:<5} "
+            f"util={stats['utilization']:6.1%} "
+            f"wait mean={stats['wait_mean']:.1f}s p95<={stats['wait_p95']:.1f}s "
+            f"handle mean={stats['handle_mean']:.0f}s"
+        )
+
+
+class PeriodicExporter:
+    """
+    Calls `sink` with a metrics snapshot every `interval` seconds
+    """
+
+    def __init__(
+        self,
+        metrics: CallCenterMetrics,
+        interval: float = 10.0,
+        sink: Callable[[Dict[str, dict]], None] = print_snapshot,
+    ):
+        self.metrics = metrics
+        self.interval = interval
+        self.sink = sink
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            raise Exception("exporter already started")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        # flush what happened since the last export
+        self.sink(self.metrics.snapshot())
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sink(self.metrics.snapshot())
+
+
+def main():
+    # only the demo needs the simulator
+    from simulator import CallCenterModel, CallCenterSimulator, Exponential
+
+    model = CallCenterModel(
+        arrival_rates={EmployeeLevel.Fresher: 900, EmployeeLevel.Lead: 200},
+        handle_times={
+            EmployeeLevel.Fresher: Exponential(180),
+            EmployeeLevel.Lead: Exponential(300),
+            EmployeeLevel.Manager: Exponential(600),
+        },
+        escalation={EmployeeLevel.Fresher: 0.1, EmployeeLevel.Lead: 0.05},
+        staffing={EmployeeLevel.Fresher: 50, EmployeeLevel.Lead: 28, EmployeeLevel.Manager: 5},
+        patience=Exponential(300),
+    )
+    simulator = CallCenterSimulator(model)
+    metrics = CallCenterMetrics(clock=lambda: simulator.now)
+
+    # the exporter reads live snapshots while the simulation runs
+    snapshots = []
+    exporter = PeriodicExporter(metrics, interval=0.5, sink=snapshots.append)
+    exporter.start()
+    report = simulator.run(days=3, listeners=[metrics])
+    exporter.stop()
+    print(f"{len(snapshots)} snapshots exported, last one:")
+    print_snapshot(snapshots[-1])
+
+    # cost of the metrics on dispatch
+    baseline = CallCenterSimulator(model).run(days=3)
+    calls = sum(report.arrived.values())
+    overhead = (report.elapsed - baseline.elapsed) / calls
+    print(
+        f"simulation took {report.elapsed:.2f}s with metrics, {baseline.elapsed:.2f}s "
+        f"without: {overhead * 1e6:.1f}us per call"
+    )
+
+    # replacing the manager keeps the staff count
+    with contextlib.redirect_stdout(io.StringIO()):
+        center = CallCenter(Manager("m0"))
+        metrics = CallCenterMetrics()
+        center.add_listener(metrics)
+        center.change_manager(Manager("m1"))
+    print("managers after change_manager:", metrics.staff[EmployeeLevel.Manager])
+
+
+if __name__ == "__main__":
+    main()
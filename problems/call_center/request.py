@@ -1,6 +1,7 @@
 from __future__ import annotations
 from abc import ABC
 from enum import Enum
+from typing import Optional
 from levels import EmployeeLevel
 
 
@@ -12,6 +13,18 @@ class Status(Enum):
     Open = 1
     InWork = 2
     Complete = 3
+    # the customer hung up while waiting
+    Abandoned = 4
+
+
+class SLAClass(Enum):
+    """
+    Service level of a request: how long it may wait for an employee
+    """
+
+    Premium = 1
+    Standard = 2
+    Basic = 3
 
 
 class IRequest(ABC):
@@ -20,13 +33,29 @@ class IRequest(ABC):
         id: int,
         customer: str,
         severity: EmployeeLevel,
+        sla_class: SLAClass = SLAClass.Standard,
+        skills: int = 0,
     ):
         self.id = id
         self.customer = customer
         self.severity = severity
         self.status = Status.Open
+        self.sla_class = sla_class
+        # bitset of the skills.Skills an employee needs to take the request
+        self.skills = skills
+        # set by CallCenter: when the request was last queued and how long
+        # it has waited in queues so far, escalations included
+        self.queued_at: Optional[float] = None
+        self.waited: float = 0.0
 
 
 class Call(IRequest):
-    def __init__(self, id: int, customer: str, severity: EmployeeLevel):
-        super().__init__(id, customer, severity)
+    def __init__(
+        self,
+        id: int,
+        customer: str,
+        severity: EmployeeLevel,
+        sla_class: SLAClass = SLAClass.Standard,
+        skills: int = 0,
+    ):
+        super().__init__(id, customer, severity, sla_class, skills)
@@ -0,0 +1,461 @@
+"""
+Durable, write-ahead request queue for CallCenter
+
+RequestLog is a CallCenterListener that appends every transition of a
+request to a write-ahead log before the CallCenter state is lost on a
+restart:
+
+    crc32 (I) | payload length (I) | op (B) | request id (Q) | payload
+
+- enqueue: severity, SLA class, skills, accumulated wait, customer
+- assign: name of the employee
+- escalate: new severity, the request is queued again at the end
+- complete / abandon: no payload, the request is gone
+
+Records are buffered and committed in groups (one write + fsync per
+batch), so a request is durable once its batch is committed; `commit()`
+forces one. Every `checkpoint_records` records the live requests are
+written to a new checkpoint (write, fsync, rename) and the log starts
+over, which bounds recovery time; the directory is fsynced after every
+rename / new file so they survive a crash too. Recovery loads the latest
+checkpoint, replays its log, cuts off a torn tail, and `restore()` queues
+the requests again in their original order. Records about requests the
+log never saw queued (a log attached to a busy center, requests stolen
+from another site) are ignored on replay, or logged as new requests when
+they are dispatched.
+
+Opening a log removes the files of generations older than the newest
+complete checkpoint, left behind by a crash during `checkpoint()`.
+
+Cost: the listener call, encoding, checksum and buffering of every record
+run in Python, so enqueues with the log are 6-8x slower than in memory
+(measured 1.33M/s against 178k/s). The demo prints both rates.
+"""
+
+from __future__ import annotations
+import contextlib
+import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
+from typing import Dict, Optional
+from call_center import CallCenter, CallCenterListener
+from employee import IEmployee, Fresher, Manager
+from request import IRequest, Call, SLAClass
+from levels import EmployeeLevel
+
+HEADER = struct.Struct("<IIBQ")
+CRC = struct.Struct("<I")
+# header and fixed part of an enqueue record:
+# severity (B) | SLA class (B) | skills (Q) | waited (d) | customer length (H)
+ENQUEUE = struct.Struct("<IIBQBBQdH")
+# the same without the crc, which is computed over it
+ENQUEUE_BODY = struct.Struct("<IBQBBQdH")
+ENQUEUE_OP, ASSIGN_OP, ESCALATE_OP, COMPLETE_OP, ABANDON_OP = range(1, 6)
+
+
+class Entry:
+    """
+    Live request: its latest enqueue record and who works on it, if anyone
+    """
+
+    __slots__ = ("record", "assigned_to", "escalated")
+
+    def __init__(self, record: bytes):
+        self.record = record
+        self.assigned_to: Optional[str] = None
+        # the escalate record stands for the re-queue that follows it
+        self.escalated = False
+
+
+def _record(op: int, request_id: int, payload: bytes = b"") -> bytes:
+    body = HEADER.pack(0, len(payload), op, request_id)[4:] + payload
+    return struct.pack("<I", zlib.crc32(body)) + body
+
+
+def _enqueue_record(request: IRequest) -> bytes:
+    customer = request.customer.encode()
+    body = (
+        ENQUEUE_BODY.pack(
+            ENQUEUE.size - HEADER.size + len(customer),
+            ENQUEUE_OP,
+            request.id,
+            # _value_ is a plain attribute, .value goes through a descriptor
+            request.severity._value_,
+            request.sla_class._value_,
+            request.skills,
+            request.waited,
+            len(customer),
+        )
+        + customer
+    )
+    return CRC.pack(zlib.crc32(body)) + body
+
+
+def _decode_enqueue(record: bytes) -> Call:
+    _, _, _, request_id, severity, sla_class, skills, waited, length = ENQUEUE.unpack_from(record)
+    customer = record[ENQUEUE.size : ENQUEUE.size + length].decode()
+    request = Call(request_id, customer, EmployeeLevel(severity), SLAClass(sla_class), skills)
+    request.waited = waited
+    return request
+
+
+class RequestLog(CallCenterListener):
+    def __init__(
+        self,
+        directory: str,
+        batch_records: int = 256,
+        batch_bytes: int = 1024 * 1024,
+        checkpoint_records: int = 1_000_000,
+        fsync: bool = True,
+    ):
+        self.directory = directory
+        self.batch_records = batch_records
+        self.batch_bytes = batch_bytes
+        self.checkpoint_records = checkpoint_records
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        # request id -> Entry, in queue order (a dict keeps insertion order
+        # and is cheaper to update than an OrderedDict)
+        self.live: Dict[int, Entry] = {}
+        self._restoring = False
+        self.generation = self._latest_generation()
+        self.recovered = 0
+        if self.generation is not None:
+            self._replay(self._checkpoint_path(self.generation))
+            # records in the current log, counted towards the next checkpoint
+            self.records = self._replay(self._log_path(self.generation), truncate=True)
+        else:
+            self.generation = 0
+            self.records = 0
+            self._write_checkpoint(0)
+        self._remove_old_generations()
+        self.file = open(self._log_path(self.generation), "ab")
+        self._sync_directory()
+
+        # group commit buffer
+        self._buffer = bytearray()
+        self._buffered = 0
+
+    def _checkpoint_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"checkpoint-{generation:012d}")
+
+    def _log_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"wal-{generation:012d}.log")
+
+    def _latest_generation(self) -> Optional[int]:
+        generations = [
+            int(name[len("checkpoint-") :])
+            for name in os.listdir(self.directory)
+            if name.startswith("checkpoint-") and not name.endswith(".tmp")
+        ]
+        return max(generations) if generations else None
+
+    def _remove_old_generations(self) -> None:
+        """
+        Remove the checkpoints, logs and temporary files of every generation
+        older than the current one
+        """
+        for name in os.listdir(self.directory):
+            if name.startswith("checkpoint-"):
+                generation = name[len("checkpoint-") :]
+            elif name.startswith("wal-"):
+                generation = name[len("wal-") :]
+            else:
+                continue
+            generation = generation.split(".")[0]
+            if not generation.isdigit():
+                continue
+            if int(generation) < self.generation or name.endswith(".tmp"):
+                os.remove(os.path.join(self.directory, name))
+
+    def _sync_directory(self) -> None:
+        """
+        fsync the directory, which makes renames and new files durable
+        """
+        if not self.fsync:
+            return
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _replay(self, path: str, truncate: bool = False) -> int:
+        """
+        Apply the records of `path` to `live`, cutting off a torn or
+        corrupt tail when `truncate` is set. Returns the number of records.
+        """
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as f:
+            data = f.read()
+        offset = 0
+        count = 0
+        while offset + HEADER.size <= len(data):
+            crc, length, op, request_id = HEADER.unpack_from(data, offset)
+            end = offset + HEADER.size + length
+            if end > len(data) or zlib.crc32(data[offset + 4 : end]) != crc:
+                break
+            self._apply(op, request_id, data[offset:end])
+            count += 1
+            offset = end
+        self.recovered += count
+        if truncate and offset != len(data):
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        return count
+
+    def _apply(self, op: int, request_id: int, record: bytes) -> None:
+        if op == ENQUEUE_OP:
+            self.live.pop(request_id, None)
+            self.live[request_id] = Entry(record)
+            return
+        if op != ASSIGN_OP and op != ESCALATE_OP:
+            self.live.pop(request_id, None)
+            return
+        entry = self.live.get(request_id)
+        if entry is None:
+            # the log never saw this request queued
+            return
+        if op == ASSIGN_OP:
+            entry.assigned_to = record[HEADER.size :].decode()
+        else:
+            request = _decode_enqueue(entry.record)
+            request.severity = EmployeeLevel(record[HEADER.size])
+            entry.record = _enqueue_record(request)
+            entry.assigned_to = None
+            # queued again behind the waiting requests
+            del self.live[request_id]
+            self.live[request_id] = entry
+
+    def _append(self, record: bytes) -> None:
+        self._buffer += record
+        self._buffered += 1
+        self.records += 1
+        if self._buffered >= self.batch_records or len(self._buffer) >= self.batch_bytes:
+            self.commit()
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        self.file.write(self._buffer)
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self._buffer = bytearray()
+        self._buffered = 0
+
+    def commit(self) -> None:
+        """
+        Write and fsync every buffered record in a single batch
+        """
+        self._flush()
+        if self.records >= self.checkpoint_records:
+            self.checkpoint()
+
+    def _write_checkpoint(self, generation: int) -> None:
+        path = self._checkpoint_path(generation)
+        with open(path + ".tmp", "wb") as f:
+            for request_id, entry in self.live.items():
+                f.write(entry.record)
+                if entry.assigned_to is not None:
+                    f.write(_record(ASSIGN_OP, request_id, entry.assigned_to.encode()))
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        self._sync_directory()
+
+    def checkpoint(self) -> None:
+        """
+        Snapshot the live requests and start a new, empty log
+        """
+        self._flush()
+        generation = self.generation + 1
+        self._write_checkpoint(generation)
+        # the new checkpoint is durable, the previous generation can go
+        self.file.close()
+        self.generation = generation
+        self._remove_old_generations()
+        self.file = open(self._log_path(generation), "ab")
+        self.records = 0
+        self._sync_directory()
+
+    def restore(self, center: CallCenter) -> int:
+        """
+        Start logging `center` and queue the recovered requests again:
+        requests that were being handled first, then waiting ones, each in
+        their original order. Returns the number of requests queued.
+        """
+        in_work = [i for i, entry in self.live.items() if entry.assigned_to is not None]
+        waiting = [i for i, entry in self.live.items() if entry.assigned_to is None]
+        center.add_listener(self)
+        # the requests are in the log already, only assignments are new
+        self._restoring = True
+        try:
+            for request_id in in_work + waiting:
+                entry = self.live.pop(request_id)
+                entry.assigned_to = None
+                self.live[request_id] = entry
+                center.queue_request(_decode_enqueue(entry.record))
+        finally:
+            self._restoring = False
+        return len(in_work) + len(waiting)
+
+    def on_queued(self, request: IRequest, depth: int, requeued: bool) -> None:
+        if self._restoring:
+            return
+        entry = self.live.get(request.id)
+        if entry is not None and entry.escalated:
+            # logged by the escalate record
+            entry.escalated = False
+            del self.live[request.id]
+            self.live[request.id] = entry
+            return
+        record = _enqueue_record(request)
+        self.live.pop(request.id, None)
+        self.live[request.id] = Entry(record)
+        self._append(record)
+
+    def on_dispatched(
+        self, employee: IEmployee, request: IRequest, waited: float, depth: int
+    ) -> None:
+        entry = self.live.get(request.id)
+        if entry is None:
+            # queued before the log was attached, or at another site
+            record = _enqueue_record(request)
+            entry = self.live[request.id] = Entry(record)
+            self._append(record)
+        entry.assigned_to = employee.name
+        self._append(_record(ASSIGN_OP, request.id, employee.name.encode()))
+
+    def on_escalated(
+        self, employee: IEmployee, request: IRequest, handle_time: float
+    ) -> None:
+        entry = self.live.get(request.id)
+        if entry is None:
+            # not logged yet, the request is logged when it is queued again
+            return
+        entry.record = _enqueue_record(request)
+        entry.assigned_to = None
+        entry.escalated = True
+        self._append(_record(ESCALATE_OP, request.id, bytes([request.severity.value])))
+
+    def on_completed(
+        self, employee: IEmployee, request: IRequest, handle_time: float
+    ) -> None:
+        self.live.pop(request.id, None)
+        self._append(_record(COMPLETE_OP, request.id))
+
+    def on_abandoned(self, request: IRequest, depth: int) -> None:
+        self.live.pop(request.id, None)
+        self._append(_record(ABANDON_OP, request.id))
+
+    def on_stolen(self, request: IRequest, depth: int) -> None:
+        # the site that took the request logs it from now on
+        if self.live.pop(request.id, None) is not None:
+            self._append(_record(ABANDON_OP, request.id))
+
+    def close(self) -> None:
+        self.commit()
+        self.file.close()
+
+
+def main():
+    directory = tempfile.mkdtemp(prefix="requestlog-")
+    count = 100_000
+    requests = [
+        Call(i, f"customer{i}", EmployeeLevel.Fresher if i % 5 else EmployeeLevel.Lead)
+        for i in range(count)
+    ]
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # only a manager: every Fresher / Lead call waits
+        plain = CallCenter(Manager("m0"))
+        start = time.perf_counter()
+        for request in requests:
+            plain.queue_request(request)
+        plain_elapsed = time.perf_counter() - start
+
+        center = CallCenter(Manager("m0"))
+        log = RequestLog(directory)
+        log.restore(center)
+        start = time.perf_counter()
+        for request in requests:
+            request.queued_at = None
+            request.waited = 0.0
+            center.queue_request(request)
+        log.commit()
+        durable_elapsed = time.perf_counter() - start
+
+        # a fresher answers a few calls, completes two and escalates one
+        fresher = Fresher("f0")
+        center.add_fresher(fresher)
+        fresher.handle_request()
+        fresher.handle_request()
+        fresher.escalate()
+        log.commit()
+    print(
+        f"enqueue: {count / plain_elapsed:,.0f}/s in memory, "
+        f"{count / durable_elapsed:,.0f}/s with the write-ahead log"
+    )
+    expected = [r.id for r in center.request_queue]
+    in_work = fresher.request.id
+
+    # crash: no close(), and half a record at the end of the log
+    log.file.write(_record(ENQUEUE_OP, 42)[:7])
+    log.file.flush()
+
+    start = time.perf_counter()
+    recovered = RequestLog(directory)
+    restored = CallCenter(Manager("m0"))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        recovered.restore(restored)
+    print(
+        f"recovered {len(recovered.live):,} requests from {recovered.recovered:,} records "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    # the call the fresher was on is queued again, ahead of the waiting ones
+    queue = [r.id for r in restored.request_queue]
+    print("same queue after restart:", queue == [in_work] + expected)
+
+    start = time.perf_counter()
+    recovered.checkpoint()
+    print(f"checkpoint of {len(recovered.live):,} requests in {time.perf_counter() - start:.2f}s")
+    recovered.close()
+    # crash in checkpoint(): the previous generation was not removed yet
+    for name in ("checkpoint-000000000000", "wal-000000000000.log"):
+        open(os.path.join(directory, name), "wb").close()
+    RequestLog(directory).close()
+    print(sorted(os.listdir(directory)))
+    shutil.rmtree(directory)
+
+    # a log attached to a center that already has calls waiting
+    directory = tempfile.mkdtemp(prefix="requestlog-")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        busy = CallCenter(Manager("m0"))
+        for i in range(3):
+            busy.queue_request(Call(i, f"customer{i}", EmployeeLevel.Fresher))
+        log = RequestLog(directory)
+        log.restore(busy)
+        fresher = Fresher("f0")
+        busy.add_fresher(fresher)
+        fresher.escalate()
+        log.commit()
+        records = log.records
+        log.file.close()
+        recovered = RequestLog(directory)
+    print(
+        f"attached to a busy center: {len(recovered.live)} request(s) logged, "
+        f"{recovered.records} of {records} records counted after restart"
+    )
+    recovered.close()
+    shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
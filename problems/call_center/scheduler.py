@@ -0,0 +1,229 @@
+"""
+SLA-aware waiting queues for CallCenter
+
+SLAQueue is a drop-in replacement for the FIFO deque of each severity
+(`CallCenter(manager, queue_factory=SLAQueue)`). Requests are kept in a
+heap ordered by deadline:
+
+    deadline = virtual arrival + target wait of the request's SLAClass
+
+The virtual arrival is the time the request was queued minus the time it
+has already spent waiting (`IRequest.waited`), so an escalated request
+keeps its accumulated wait instead of starting over at the back of the
+next level's queue.
+
+Aging: a request whose total wait (from its virtual arrival) reaches
+`max_age` is served before every younger one, oldest virtual arrival
+first. Below that age requests are served by deadline. The deadline order
+moves wait from Premium to Basic requests, and without aging that raises
+the tail wait of each severity; the default max_age is set relative to the
+SLA targets (3x the Premium target for Freshers, the Standard target
+above), so Premium calls mostly meet their target while the tails stay
+close to FIFO. Levels missing from `max_age` (all of them with
+`max_age={}`) have no aging.
+"""
+
+from __future__ import annotations
+import contextlib
+import heapq
+import io
+import itertools
+import random
+import time
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Tuple
+from call_center import CallCenter
+from employee import IEmployee, Fresher, Lead, Manager
+from request import IRequest, Call, SLAClass
+from levels import EmployeeLevel
+
+# target wait in seconds
+DEFAULT_TARGETS: Dict[SLAClass, float] = {
+    SLAClass.Premium: 30.0,
+    SLAClass.Standard: 120.0,
+    SLAClass.Basic: 600.0,
+}
+
+# total wait in seconds after which a request is served in arrival order
+DEFAULT_MAX_AGE: Dict[EmployeeLevel, float] = {
+    EmployeeLevel.Fresher: 3 * DEFAULT_TARGETS[SLAClass.Premium],
+    EmployeeLevel.Lead: DEFAULT_TARGETS[SLAClass.Standard],
+    EmployeeLevel.Manager: DEFAULT_TARGETS[SLAClass.Standard],
+}
+
+
+class SLAQueue:
+    def __init__(
+        self,
+        targets: Dict[SLAClass, float] = None,
+        max_age: Dict[EmployeeLevel, float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.targets = targets or DEFAULT_TARGETS
+        self.max_age = DEFAULT_MAX_AGE if max_age is None else max_age
+        # must be the clock of the CallCenter that sets queued_at
+        self.clock = clock
+        # entries are [deadline, order, request, taken], in both heaps;
+        # taken entries are skipped when they reach the top of the other one
+        self._heap: List[list] = []
+        self._by_arrival: List[Tuple[float, int, list]] = []
+        self._len = 0
+        # tie breaker: FIFO among equal deadlines
+        self._order = itertools.count()
+
+    def deadline(self, request: IRequest) -> float:
+        arrival = request.queued_at - request.waited
+        return arrival + self.targets[request.sla_class]
+
+    def append(self, request: IRequest) -> None:
+        arrival = request.queued_at - request.waited
+        entry = [arrival + self.targets[request.sla_class], next(self._order), request, False]
+        heapq.heappush(self._heap, entry)
+        if self.max_age:
+            heapq.heappush(self._by_arrival, (arrival, entry[1], entry))
+        self._len += 1
+
+    def _next(self, pop: bool) -> list:
+        by_arrival = self._by_arrival
+        while by_arrival and by_arrival[0][2][3]:
+            heapq.heappop(by_arrival)
+        if by_arrival:
+            arrival, _, entry = by_arrival[0]
+            max_age = self.max_age.get(entry[2].severity)
+            if max_age is not None and self.clock() - arrival >= max_age:
+                if pop:
+                    heapq.heappop(by_arrival)
+                return entry
+        heap = self._heap
+        while heap[0][3]:
+            heapq.heappop(heap)
+        return heapq.heappop(heap) if pop else heap[0]
+
+    def popleft(self) -> IRequest:
+        if not self._len:
+            raise IndexError("pop from an empty SLAQueue")
+        entry = self._next(pop=True)
+        entry[3] = True
+        self._len -= 1
+        return entry[2]
+
+    def peek(self) -> IRequest:
+        if not self._len:
+            raise IndexError("peek at an empty SLAQueue")
+        return self._next(pop=False)[2]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[IRequest]:
+        return (entry[2] for entry in sorted(self._heap) if not entry[3])
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def compare(
+    queue_factory: Callable[[Callable[[], float]], deque],
+    seconds: float = 5 * 86400,
+    seed: int = 0,
+) -> Dict[str, List[float]]:
+    """
+    Small discrete-event run of a CallCenter, returns the total wait of
+    completed requests by original severity and by SLA class. Handle times
+    and escalations are drawn per request, so every queue_factory sees the
+    same workload. `queue_factory` is called with the simulated clock.
+    """
+    rng = random.Random(seed)
+    clock = _Clock()
+    events: List[Tuple[float, int, str, object]] = []
+    order = itertools.count()
+    mean_handle = {EmployeeLevel.Fresher: 60, EmployeeLevel.Lead: 120, EmployeeLevel.Manager: 120}
+    escalation = {EmployeeLevel.Fresher: 0.1, EmployeeLevel.Lead: 0.02, EmployeeLevel.Manager: 0.0}
+    # request -> level -> (handle time, escalates)
+    plans: Dict[IRequest, Dict[EmployeeLevel, Tuple[float, bool]]] = {}
+
+    class Center(CallCenter):
+        def _dispatch(self, employee: IEmployee, request: IRequest) -> None:
+            super()._dispatch(employee, request)
+            handle_time, _ = plans[request][employee.level]
+            heapq.heappush(events, (clock.now + handle_time, next(order), "done", employee))
+
+    center = Center(Manager("m0"), queue_factory=lambda: queue_factory(clock), clock=clock)
+    for i in range(16):
+        center.add_fresher(Fresher(f"f{i}"))
+    for i in range(11):
+        center.add_lead(Lead(f"l{i}"))
+
+    waits: Dict[str, List[float]] = {}
+    original: Dict[IRequest, EmployeeLevel] = {}
+    heapq.heappush(events, (0.0, next(order), "arrival", None))
+    ids = itertools.count()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while events:
+            now, _, kind, employee = heapq.heappop(events)
+            if now > seconds:
+                break
+            clock.now = now
+            if kind == "arrival":
+                severity = EmployeeLevel.Fresher if rng.random() < 0.8 else EmployeeLevel.Lead
+                sla = rng.choices(list(SLAClass), weights=[1, 3, 1])[0]
+                request = Call(next(ids), "customer", severity, sla)
+                plans[request] = {
+                    level: (
+                        rng.expovariate(1 / mean_handle[level]),
+                        rng.random() < escalation[level],
+                    )
+                    for level in EmployeeLevel
+                }
+                original[request] = severity
+                center.queue_request(request)
+                heapq.heappush(events, (now + rng.expovariate(0.3), next(order), "arrival", None))
+                continue
+            request = employee.request
+            if plans[request][employee.level][1]:
+                employee.escalate()
+                continue
+            employee.handle_request()
+            del plans[request]
+            waits.setdefault(original.pop(request).name, []).append(request.waited)
+            waits.setdefault(request.sla_class.name, []).append(request.waited)
+    return waits
+
+
+def main():
+    runs = [
+        compare(lambda clock: deque()),
+        compare(lambda clock: SLAQueue(max_age={}, clock=clock)),
+        compare(lambda clock: SLAQueue(clock=clock)),
+    ]
+    print(
+        f"{'p95 wait (s)':<12} {'FIFO':>8} {'deadline':>9} {'+aging':>8}"
+        "   within target FIFO / deadline / +aging"
+    )
+    for key in [level.name for level in EmployeeLevel] + [c.name for c in SLAClass]:
+        if key not in runs[0]:
+            continue
+        line = f"{key:<12} " + " ".join(
+            f"{percentile(waits[key], 95):{width}.1f}" for waits, width in zip(runs, (8, 9, 8))
+        )
+        if key in SLAClass.__members__:
+            target = DEFAULT_TARGETS[SLAClass[key]]
+            met = [sum(w <= target for w in waits[key]) / len(waits[key]) for waits in runs]
+            line += "   " + " / ".join(f"{m:6.1%}" for m in met)
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
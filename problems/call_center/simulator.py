@@ -0,0 +1,402 @@
+"""
+Discrete-event simulation of a CallCenter with Erlang-C staffing analysis
+
+A CallCenterModel describes the traffic: Poisson arrivals per severity,
+handle-time distributions and escalation probabilities per employee level,
+an optional patience distribution (customers hang up after waiting that
+long for a first answer) and the staffing per level.
+
+CallCenterSimulator drives the real CallCenter / IEmployee / IRequest
+classes with a simulated clock and reports wait percentiles, abandonment
+and utilization per level. The same numbers are computed with Erlang C
+(M/M/c per level, escalations added to the next level's arrivals, no
+abandonment) so the simulation can be checked against the formula, and
+`recommend_staffing` finds the minimum headcount meeting a service level.
+
+Times are in seconds, arrival rates in calls per hour.
+"""
+
+from __future__ import annotations
+import contextlib
+import heapq
+import itertools
+import math
+import os
+import random
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+from call_center import CallCenter
+from employee import IEmployee, Fresher, Lead, Manager
+from request import IRequest, Status, Call
+from levels import EmployeeLevel
+
+SECONDS_PER_DAY = 24 * 3600
+
+
+class Exponential:
+    def __init__(self, mean: float):
+        self.mean = mean
+
+    def __call__(self, rng: random.Random) -> float:
+        return rng.expovariate(1 / self.mean)
+
+
+class LogNormal:
+    """
+    Log-normal distribution parameterized by its median, for handle times
+    with a long tail
+    """
+
+    def __init__(self, median: float, sigma: float):
+        self.mu = math.log(median)
+        self.sigma = sigma
+        self.mean = median * math.exp(sigma * sigma / 2)
+
+    def __call__(self, rng: random.Random) -> float:
+        return rng.lognormvariate(self.mu, self.sigma)
+
+
+class Uniform:
+    def __init__(self, low: float, high: float):
+        self.low = low
+        self.high = high
+        self.mean = (low + high) / 2
+
+    def __call__(self, rng: random.Random) -> float:
+        return rng.uniform(self.low, self.high)
+
+
+class CallCenterModel:
+    def __init__(
+        self,
+        arrival_rates: Dict[EmployeeLevel, float],
+        handle_times: Dict[EmployeeLevel, Callable[[random.Random], float]],
+        escalation: Dict[EmployeeLevel, float],
+        staffing: Dict[EmployeeLevel, int],
+        patience: Callable[[random.Random], float] = None,
+    ):
+        self.arrival_rates = arrival_rates
+        self.handle_times = handle_times
+        self.escalation = escalation
+        self.staffing = staffing
+        self.patience = patience
+
+    def with_staffing(self, staffing: Dict[EmployeeLevel, int]) -> CallCenterModel:
+        return CallCenterModel(
+            self.arrival_rates, self.handle_times, self.escalation, staffing, self.patience
+        )
+
+    def level_rates(self) -> Dict[EmployeeLevel, float]:
+        """
+        Calls per hour reaching each level, escalations included
+        """
+        rates: Dict[EmployeeLevel, float] = {}
+        escalated = 0.0
+        for level in EmployeeLevel:
+            rates[level] = self.arrival_rates.get(level, 0.0) + escalated
+            escalated = rates[level] * self.escalation.get(level, 0.0)
+        return rates
+
+
+def erlang_c(agents: int, load: float) -> float:
+    """
+    Probability that a call has to wait, `load` in Erlangs
+    """
+    if load <= 0:
+        return 0.0
+    if load >= agents:
+        return 1.0
+    # Erlang B by recurrence, then Erlang C from it
+    b = 1.0
+    for k in range(1, agents + 1):
+        b = load * b / (k + load * b)
+    return agents * b / (agents - load * (1 - b))
+
+
+class ErlangC:
+    """
+    M/M/c approximation of one level
+    """
+
+    def __init__(self, agents: int, rate_per_hour: float, mean_handle: float):
+        self.agents = agents
+        self.rate = rate_per_hour / 3600
+        self.mean_handle = mean_handle
+        self.load = self.rate * mean_handle
+        self.p_wait = erlang_c(agents, self.load)
+
+    @property
+    def stable(self) -> bool:
+        return self.load < self.agents
+
+    @property
+    def utilization(self) -> float:
+        return min(1.0, self.load / self.agents) if self.agents else 1.0
+
+    def mean_wait(self) -> float:
+        if not self.stable:
+            return math.inf
+        return self.p_wait * self.mean_handle / (self.agents - self.load)
+
+    def service_level(self, target: float) -> float:
+        """
+        Probability of being answered within `target` seconds
+        """
+        if not self.stable:
+            return 0.0
+        return 1 - self.p_wait * math.exp(
+            -(self.agents - self.load) * target / self.mean_handle
+        )
+
+
+def erlang(model: CallCenterModel) -> Dict[EmployeeLevel, ErlangC]:
+    rates = model.level_rates()
+    return {
+        level: ErlangC(model.staffing.get(level, 0), rates[level], model.handle_times[level].mean)
+        for level in EmployeeLevel
+    }
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class SimulationReport:
+    def __init__(self, model: CallCenterModel, seconds: float, elapsed: float):
+        self.model = model
+        self.seconds = seconds
+        # wall clock time the run took
+        self.elapsed = elapsed
+        # wait of every dispatch, by the level it was waiting for
+        self.level_waits: Dict[EmployeeLevel, List[float]] = {l: [] for l in EmployeeLevel}
+        # total wait of completed requests, by original severity
+        self.total_waits: Dict[EmployeeLevel, List[float]] = {l: [] for l in EmployeeLevel}
+        self.arrived: Dict[EmployeeLevel, int] = {l: 0 for l in EmployeeLevel}
+        self.abandoned: Dict[EmployeeLevel, int] = {l: 0 for l in EmployeeLevel}
+        # abandons by the level the request was waiting for
+        self.level_abandoned: Dict[EmployeeLevel, int] = {l: 0 for l in EmployeeLevel}
+        self.escalated: Dict[EmployeeLevel, int] = {l: 0 for l in EmployeeLevel}
+        self.busy: Dict[EmployeeLevel, float] = {l: 0.0 for l in EmployeeLevel}
+
+    def utilization(self, level: EmployeeLevel) -> float:
+        staff = self.model.staffing.get(level, 0)
+        return self.busy[level] / (staff * self.seconds) if staff else 0.0
+
+    def abandonment(self, severity: EmployeeLevel) -> float:
+        arrived = self.arrived[severity]
+        return self.abandoned[severity] / arrived if arrived else 0.0
+
+    def service_level(self, level: EmployeeLevel, target: float) -> float:
+        """
+        Share of the calls reaching `level` answered within `target`
+        seconds, calls abandoned while waiting for `level` count as misses
+        """
+        waits = self.level_waits[level]
+        calls = len(waits) + self.level_abandoned[level]
+        if not calls:
+            return 1.0
+        return sum(w <= target for w in waits) / calls
+
+    def __str__(self) -> str:
+        days = self.seconds / SECONDS_PER_DAY
+        lines = [
+            f"{days:.0f} days simulated in {self.elapsed:.1f}s, "
+            f"{sum(self.arrived.values()):,} calls"
+        ]
+        for level in EmployeeLevel:
+            waits = self.level_waits[level]
+            lines.append(
+                f"  {level.name:<8} staff={self.model.staffing.get(level, 0):<3} "
+                f"util={self.utilization(level):6.1%} "
+                f"wait p50={percentile(waits, 50):6.1f}s p95={percentile(waits, 95):6.1f}s "
+                f"p99={percentile(waits, 99):6.1f}s "
+                f"abandoned={self.abandonment(level):5.1%} "
+                f"escalated={self.escalated[level]:,}"
+            )
+        return "\n".join(lines)
+
+
+class CallCenterSimulator:
+    def __init__(self, model: CallCenterModel, queue_factory=deque, seed: int = 0):
+        self.model = model
+        self.queue_factory = queue_factory
+        self.seed = seed
+        # simulated time of the event being processed
+        self.now = 0.0
+
+    def run(self, days: float = 30, listeners=()) -> SimulationReport:
+        model = self.model
+        rng = random.Random(self.seed)
+        now = 0.0
+        events: List[Tuple[float, int, int, object]] = []
+        order = itertools.count()
+        ARRIVAL, DONE, ABANDON = 0, 1, 2
+
+        def push(at: float, kind: int, payload) -> None:
+            heapq.heappush(events, (at, next(order), kind, payload))
+
+        seconds = days * SECONDS_PER_DAY
+        report = SimulationReport(model, seconds, 0.0)
+        original: Dict[IRequest, EmployeeLevel] = {}
+        answered = set()
+
+        class Center(CallCenter):
+            def _dispatch(self, employee: IEmployee, request: IRequest) -> None:
+                report.level_waits[employee.level].append(now - request.queued_at)
+                super()._dispatch(employee, request)
+                answered.add(request)
+                handle_time = model.handle_times[employee.level](rng)
+                # only the part of the call inside the simulated period
+                report.busy[employee.level] += max(0.0, min(handle_time, seconds - now))
+                push(now + handle_time, DONE, employee)
+
+        center = Center(Manager("m0"), queue_factory=self.queue_factory, clock=lambda: now)
+        for i in range(1, model.staffing.get(EmployeeLevel.Manager, 1)):
+            center.add_manager(Manager(f"m{i}"))
+        for i in range(model.staffing.get(EmployeeLevel.Fresher, 0)):
+            center.add_fresher(Fresher(f"f{i}"))
+        for i in range(model.staffing.get(EmployeeLevel.Lead, 0)):
+            center.add_lead(Lead(f"l{i}"))
+        for listener in listeners:
+            center.add_listener(listener)
+
+        for level, rate in model.arrival_rates.items():
+            if rate > 0:
+                push(rng.expovariate(rate / 3600), ARRIVAL, level)
+
+        ids = itertools.count()
+        start = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            while events:
+                now, _, kind, payload = heapq.heappop(events)
+                if now > seconds:
+                    break
+                self.now = now
+                if kind == ARRIVAL:
+                    level = payload
+                    request = Call(next(ids), "customer", level)
+                    original[request] = level
+                    report.arrived[level] += 1
+                    center.queue_request(request)
+                    if model.patience is not None and request not in answered:
+                        push(now + model.patience(rng), ABANDON, request)
+                    push(now + rng.expovariate(model.arrival_rates[level] / 3600), ARRIVAL, level)
+                elif kind == DONE:
+                    employee = payload
+                    request = employee.request
+                    if rng.random() < model.escalation.get(employee.level, 0.0):
+                        report.escalated[employee.level] += 1
+                        employee.escalate()
+                        continue
+                    employee.handle_request()
+                    answered.discard(request)
+                    report.total_waits[original.pop(request)].append(request.waited)
+                else:
+                    request = payload
+                    if request not in answered and request.status == Status.Open:
+                        center.abandon(request)
+                        report.abandoned[original.pop(request)] += 1
+                        report.level_abandoned[request.severity] += 1
+        report.elapsed = time.perf_counter() - start
+        return report
+
+
+def compare_erlang(report: SimulationReport, target: float) -> str:
+    lines = [f"{'level':<8} {'mean wait sim/erlang':>22} {f'P(wait<={target:g}s) sim/erlang':>28}"]
+    for level, approx in erlang(report.model).items():
+        waits = report.level_waits[level]
+        mean = sum(waits) / len(waits) if waits else 0.0
+        lines.append(
+            f"{level.name:<8} {mean:10.1f} / {approx.mean_wait():<9.1f} "
+            f"{report.service_level(level, target):14.1%} / {approx.service_level(target):.1%}"
+        )
+    return "\n".join(lines)
+
+
+def recommend_staffing(
+    model: CallCenterModel,
+    target: float = 20.0,
+    service_level: float = 0.8,
+    days: float = 7,
+    max_rounds: int = 10,
+) -> Tuple[Dict[EmployeeLevel, int], Optional[SimulationReport]]:
+    """
+    Minimum headcount per level so that `service_level` of the calls reaching
+    each level are answered within `target` seconds, abandoned calls count
+    as misses. Starts from Erlang C, then adds staff where the simulation
+    (non-exponential handle times) misses the goal, and finally removes
+    staff level by level while the goal is still met. Raises if the goal is
+    still missed after `max_rounds` rounds of adding staff.
+    """
+    rates = model.level_rates()
+    staffing: Dict[EmployeeLevel, int] = {}
+    for level in EmployeeLevel:
+        mean = model.handle_times[level].mean
+        agents = 1
+        while ErlangC(agents, rates[level], mean).service_level(target) < service_level:
+            agents += 1
+        staffing[level] = agents
+
+    def missing(report: SimulationReport) -> List[EmployeeLevel]:
+        return [
+            level
+            for level in EmployeeLevel
+            if report.service_level(level, target) < service_level
+        ]
+
+    report = None
+    for _ in range(max_rounds):
+        report = CallCenterSimulator(model.with_staffing(staffing)).run(days)
+        if not missing(report):
+            break
+        for level in missing(report):
+            staffing[level] += 1
+    else:
+        levels = ", ".join(level.name for level in missing(report))
+        raise Exception(
+            f"{levels} below {service_level:.0%} within {target:g}s "
+            f"after {max_rounds} rounds, staffing {staffing}"
+        )
+
+    for level in EmployeeLevel:
+        while staffing[level] > 1:
+            fewer = dict(staffing)
+            fewer[level] -= 1
+            candidate = CallCenterSimulator(model.with_staffing(fewer)).run(days)
+            if missing(candidate):
+                break
+            staffing, report = fewer, candidate
+    return staffing, report
+
+
+def main():
+    model = CallCenterModel(
+        arrival_rates={EmployeeLevel.Fresher: 900, EmployeeLevel.Lead: 200},
+        handle_times={
+            EmployeeLevel.Fresher: Exponential(180),
+            EmployeeLevel.Lead: Exponential(300),
+            EmployeeLevel.Manager: Exponential(600),
+        },
+        escalation={EmployeeLevel.Fresher: 0.1, EmployeeLevel.Lead: 0.05},
+        staffing={EmployeeLevel.Fresher: 48, EmployeeLevel.Lead: 25, EmployeeLevel.Manager: 5},
+    )
+    report = CallCenterSimulator(model).run(days=30)
+    print(report)
+    print(compare_erlang(report, target=20))
+
+    # customers hang up, handle times have a long tail
+    model.patience = Exponential(120)
+    model.handle_times[EmployeeLevel.Fresher] = LogNormal(120, 0.9)
+    print(CallCenterSimulator(model).run(days=30))
+
+    staffing, report = recommend_staffing(model, target=20, service_level=0.8)
+    print("recommended staffing for 80% within 20s:", {l.name: n for l, n in staffing.items()})
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Skill-based routing for CallCenter
+
+Skills (language, product line, region...) are encoded as bits of an int:
+an employee has a skill mask, a request requires one, and an employee can
+take a request when `request.skills & ~employee.skills == 0`.
+
+SkillCallCenter indexes its free employees by (level, exact skill mask) and
+its waiting requests by (level, required mask). A lookup never scans
+employees, only the distinct masks in use, through cached candidate lists:
+- a request goes to the free employee with the fewest extra skills among
+  the masks that cover it (generalists stay free for harder calls), longest
+  idle first
+- a free employee takes the oldest waiting request among the masks it
+  covers
+
+The candidate lists only change when a mask is seen for the first time, so
+in steady state both lookups cost O(distinct masks that match), whatever
+the number of employees.
+"""
+
+from __future__ import annotations
+import contextlib
+import os
+import random
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from call_center import CallCenter, CallCenterListener
+from employee import IEmployee, Fresher, Manager
+from request import IRequest, Status, Call
+from levels import EmployeeLevel
+
+
+class Skills:
+    """
+    Registry of skill names <-> bits
+    """
+
+    def __init__(self, names: List[str] = ()):
+        self.bits: Dict[str, int] = {}
+        for name in names:
+            self.bit(name)
+
+    def bit(self, name: str) -> int:
+        bit = self.bits.get(name)
+        if bit is None:
+            bit = self.bits[name] = 1 << len(self.bits)
+        return bit
+
+    def mask(self, *names: str) -> int:
+        mask = 0
+        for name in names:
+            mask |= self.bit(name)
+        return mask
+
+    def names(self, mask: int) -> List[str]:
+        return [name for name, bit in self.bits.items() if mask & bit]
+
+
+def covers(employee_skills: int, required: int) -> bool:
+    return required & ~employee_skills == 0
+
+
+class SkillCallCenter(CallCenter):
+    """
+    CallCenter routing on skills within each level. Waiting requests of the
+    same required mask are FIFO.
+    """
+
+    def __init__(self, manager: Manager, clock: Callable[[], float] = time.monotonic):
+        levels = list(EmployeeLevel)
+        # level -> employee mask -> free employees, longest idle first
+        self.free_by_mask: Dict[EmployeeLevel, Dict[int, OrderedDict]] = {l: {} for l in levels}
+        # level -> required mask -> waiting requests
+        self.waiting_by_mask: Dict[EmployeeLevel, Dict[int, deque]] = {l: {} for l in levels}
+        self.waiting_count: Dict[EmployeeLevel, int] = {l: 0 for l in levels}
+        # candidate caches, rebuilt when a new mask shows up at a level
+        self._supersets: Dict[Tuple[EmployeeLevel, int], List[int]] = {}
+        self._subsets: Dict[Tuple[EmployeeLevel, int], List[int]] = {}
+        super().__init__(manager, clock=clock)
+
+    @property
+    def request_queue(self) -> List[IRequest]:
+        waiting = [
+            r
+            for level in EmployeeLevel
+            for queue in self.waiting_by_mask[level].values()
+            for r in queue
+            if r.status != Status.Abandoned
+        ]
+        return sorted(waiting, key=lambda r: (r.severity.value, r.queued_at))
+
+    def queue_depth(self, severity: EmployeeLevel) -> int:
+        return self.waiting_count[severity] - self.abandoned[severity]
+
+    def free_count(self, level: EmployeeLevel) -> int:
+        return sum(len(pool) for pool in self.free_by_mask[level].values())
+
+    def _candidates(self, level: EmployeeLevel, required: int) -> List[int]:
+        """
+        Employee masks at `level` that cover `required`, fewest skills first
+        """
+        key = (level, required)
+        masks = self._supersets.get(key)
+        if masks is None:
+            masks = [m for m in self.free_by_mask[level] if covers(m, required)]
+            masks.sort(key=lambda m: bin(m).count("1"))
+            self._supersets[key] = masks
+        return masks
+
+    def _coverable(self, level: EmployeeLevel, skills: int) -> List[int]:
+        """
+        Required masks at `level` that an employee with `skills` covers
+        """
+        key = (level, skills)
+        masks = self._subsets.get(key)
+        if masks is None:
+            masks = [m for m in self.waiting_by_mask[level] if covers(skills, m)]
+            self._subsets[key] = masks
+        return masks
+
+    def _take_free(self, request: IRequest) -> Optional[IEmployee]:
+        pools = self.free_by_mask[request.severity]
+        for mask in self._candidates(request.severity, request.skills):
+            pool = pools[mask]
+            if pool:
+                return pool.popitem(last=False)[0]
+        return None
+
+    def _add_free(self, employee: IEmployee) -> None:
+        pools = self.free_by_mask[employee.level]
+        pool = pools.get(employee.skills)
+        if pool is None:
+            pool = pools[employee.skills] = OrderedDict()
+            self._supersets = {k: v for k, v in self._supersets.items() if k[0] != employee.level}
+        pool[employee] = None
+
+    def _remove_free(self, employee: IEmployee) -> None:
+        pool = self.free_by_mask[employee.level].get(employee.skills)
+        if pool is not None:
+            pool.pop(employee, None)
+
+    def _wait(self, request: IRequest) -> None:
+        queues = self.waiting_by_mask[request.severity]
+        queue = queues.get(request.skills)
+        if queue is None:
+            queue = queues[request.skills] = deque()
+            self._subsets = {k: v for k, v in self._subsets.items() if k[0] != request.severity}
+        queue.append(request)
+        self.waiting_count[request.severity] += 1
+
+    def _next_request_for(self, employee: IEmployee) -> Optional[IRequest]:
+        level = employee.level
+        if not self.queue_depth(level):
+            return None
+        queues = self.waiting_by_mask[level]
+        best: Optional[deque] = None
+        for mask in self._coverable(level, employee.skills):
+            queue = queues[mask]
+            # drop abandoned requests at the front
+            while queue and queue[0].status == Status.Abandoned:
+                queue.popleft()
+                self.waiting_count[level] -= 1
+                self.abandoned[level] -= 1
+            if queue and (best is None or queue[0].queued_at < best[0].queued_at):
+                best = queue
+        if best is None:
+            return None
+        self.waiting_count[level] -= 1
+        return best.popleft()
+
+    def assign_request(self) -> int:
+        assigned = 0
+        for level in EmployeeLevel:
+            for pool in list(self.free_by_mask[level].values()):
+                for employee in list(pool):
+                    request = self._next_request_for(employee)
+                    if request is None:
+                        continue
+                    self._remove_free(employee)
+                    self._dispatch(employee, request)
+                    assigned += 1
+        return assigned
+
+
+def scan_for_free(employees: List[IEmployee], busy: Set[IEmployee], required: int):
+    """
+    Reference routing: scan every employee for a free one with the skills
+    """
+    best = None
+    for employee in employees:
+        if employee not in busy and covers(employee.skills, required):
+            if best is None or bin(employee.skills).count("1") < bin(best.skills).count("1"):
+                best = employee
+    return best
+
+
+def main():
+    rng = random.Random(0)
+    languages = ["en", "es", "fr", "de", "pt", "it", "ja", "zh"]
+    products = [f"product{i}" for i in range(16)]
+    regions = [f"region{i}" for i in range(12)]
+    skills = Skills(languages + products + regions)
+
+    # agents are trained by team, each team has a skill profile
+    teams = [
+        skills.mask(
+            "en",
+            *rng.sample(languages[1:], rng.randint(0, 1)),
+            *rng.sample(products, rng.randint(2, 4)),
+            rng.choice(regions),
+        )
+        for _ in range(60)
+    ]
+
+    def request_skills() -> int:
+        # a language, a product and sometimes a region some team covers
+        team = skills.names(rng.choice(teams))
+        mask = skills.mask(
+            rng.choice([s for s in team if s in languages]),
+            rng.choice([s for s in team if s in products]),
+        )
+        if rng.random() < 0.3:
+            mask |= skills.mask(*(s for s in team if s in regions))
+        return mask
+
+    center = SkillCallCenter(Manager("m0", skills.mask(*languages)))
+    agents = [Fresher(f"f{i}", rng.choice(teams)) for i in range(5_000)]
+    busy: deque[IEmployee] = deque()
+
+    class Busy(CallCenterListener):
+        def on_dispatched(self, employee, request, waited, depth) -> None:
+            busy.append(employee)
+
+    center.add_listener(Busy())
+    requests = [
+        Call(i, "customer", EmployeeLevel.Fresher, skills=request_skills())
+        for i in range(100_000)
+    ]
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for agent in agents:
+            center.add_fresher(agent)
+        # one call in, and one call done once most agents are busy
+        start = time.perf_counter()
+        for request in requests:
+            center.queue_request(request)
+            if len(busy) > 4_000:
+                busy.popleft().handle_request()
+        elapsed = time.perf_counter() - start
+
+    masks = len(center.free_by_mask[EmployeeLevel.Fresher])
+    print(f"{len(skills.bits)} skills, {len(agents)} agents, {masks} distinct agent masks")
+    print(
+        f"skill index: {elapsed / len(requests) * 1e6:.1f}us per call routed and completed, "
+        f"{center.queue_depth(EmployeeLevel.Fresher)} calls waiting"
+    )
+
+    busy_set = set(busy)
+    start = time.perf_counter()
+    for request in requests[:1_000]:
+        scan_for_free(agents, busy_set, request.skills)
+    elapsed = time.perf_counter() - start
+    print(f"scanning the agents: {elapsed / 1_000 * 1e6:.1f}us per lookup")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+from typing import List
 from suit import Suit
 
 
@@ -7,11 +8,26 @@ class Card:
 
     The number must be between 1 and 13 inclusive, enforced
     in the copnstructor
+
+    Cards are also encoded as integers 0-51 (suit * 13 + number - 1), see
+    CARDS / NAMES / NUMBERS / SUITS below. Card.of(code) returns the shared
+    instance for a code instead of allocating a new Card, so cards are
+    read-only: suit and number cannot be changed after construction.
     """
 
+    __slots__ = ("_suit", "_number")
+
     def __init__(self, suit: Suit, number: int):
-        self.suit = suit
-        self.number = Card._set_number(number)
+        self._suit = suit
+        self._number = Card._set_number(number)
+
+    @property
+    def suit(self) -> Suit:
+        return self._suit
+
+    @property
+    def number(self) -> int:
+        return self._number
 
     @staticmethod
     def _set_number(number: int) -> int:
@@ -22,15 +38,33 @@ class Card:
             raise ValueError("Card number must be between 1 and 13 inclusive")
         return number
 
+    @staticmethod
+    def encode(suit: Suit, number: int) -> int:
+        return suit.value * 13 + number - 1
+
+    @staticmethod
+    def of(code: int) -> "Card":
+        """
+        Shared (flyweight) Card for an integer code
+        """
+        return CARDS[code]
+
+    @property
+    def code(self) -> int:
+        return Card.encode(self.suit, self.number)
+
     def __str__(self) -> str:
-        val = str(self.number)
-        if self.number == 1:
-            val = "Ace"
-        elif self.number == 11:
-            val = "Jack"
-        elif self.number == 12:
-            val = "Queen"
-        elif self.number == 13:
-            val = "King"
-
-        return f"{val} of {self.suit}"
+        if 1 <= self.number <= 13:
+            return NAMES[self.code]
+        return f"{self.number} of {self.suit}"
+
+
+_FACES = {1: "Ace", 11: "Jack", 12: "Queen", 13: "King"}
+
+# lookup tables indexed by card code
+SUITS: List[Suit] = [suit for suit in Suit for _ in range(13)]
+NUMBERS = bytes(number for _ in Suit for number in range(1, 14))
+NAMES: List[str] = [
+    f"{_FACES.get(number, number)} of {suit}" for suit in Suit for number in range(1, 14)
+]
+CARDS: List[Card] = [Card(suit, number) for suit in Suit for number in range(1, 14)]
@@ -1,7 +1,9 @@
+import random
+import time
 from random import shuffle
 from abc import ABC, abstractmethod
 from typing import List, Optional
-from card import Card
+from card import Card, CARDS, NAMES
 from suit import Suit
 
 
@@ -46,13 +48,94 @@ class RegularDeck(IDeck):
     @staticmethod
     def _create_deck() -> List[Card]:
         """
-        Returns a List of Cards, one of each number for each Suit
+        Returns a List of Cards, one of each number for each Suit. The
+        Cards are the shared instances of card.CARDS.
+        """
+        return list(CARDS)
+
+
+# the 52 card codes in RegularDeck order
+ORDERED = bytes(range(52))
+
+
+class CompactDeck(IDeck):
+    """
+    Deck of card codes (0-51) in a bytearray, for simulations dealing a
+    lot of cards: no Card is allocated, several decks fit in one shoe, and
+    reset() refills it with a byte copy, which is cheaper than creating a
+    new deck. deal_card returns the shared Card of the code, deal_code the
+    code itself.
+    """
+
+    def __init__(self, decks: int = 1, rng: random.Random = None):
+        self.decks = decks
+        self.rng = rng or random.Random()
+        super().__init__()
+
+    def _create_deck(self) -> bytearray:
+        return bytearray(ORDERED * self.decks)
+
+    def shuffle(self):
+        """
+        Sort the codes by a random float key per position, a uniform
+        shuffle (ties have probability ~2**-53) with the sort and the
+        byte copy in C, about twice as fast as random.shuffle on one deck
+        """
+        draw = self.rng.random
+        self.deck[:] = bytes(sorted(self.deck, key=lambda _: draw()))
+
+    def deal_code(self) -> int:
         """
-        deck = []
-        for suit in Suit:
-            for i in range(1, 14):
-                deck.append(Card(suit, i))
-        return deck
+        Deal the code of the top card, -1 when the deck is empty
+        """
+        return self.deck.pop() if self.deck else -1
+
+    def deal_card(self) -> Optional[Card]:
+        if not self.deck:
+            print("No cards left in the deck")
+            return None
+        return CARDS[self.deck.pop()]
+
+    def reset(self):
+        """
+        Put every card back, in order
+        """
+        self.deck[:] = ORDERED * self.decks
+
+    def __str__(self):
+        return "".join(NAMES[code] + "\n" for code in self.deck)
+
+
+def benchmark(decks: int = 100_000) -> None:
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for _ in range(decks):
+        [Card(suit, number) for suit in Suit for number in range(1, 14)]
+    elapsed = time.perf_counter() - start
+    print(f"52 new Cards: {elapsed / decks * 1e6:.2f}us per deck")
+    for name, factory in (
+        ("RegularDeck", RegularDeck),
+        ("CompactDeck", lambda: CompactDeck(rng=rng)),
+    ):
+        start = time.perf_counter()
+        for _ in range(decks):
+            factory()
+        created = time.perf_counter() - start
+        deck = factory()
+        start = time.perf_counter()
+        for _ in range(decks):
+            deck.shuffle()
+        shuffled = time.perf_counter() - start
+        print(
+            f"{name}: create {created / decks * 1e6:.2f}us, "
+            f"shuffle {shuffled / decks * 1e6:.2f}us per deck"
+        )
+    deck = CompactDeck(rng=rng)
+    start = time.perf_counter()
+    for _ in range(decks):
+        deck.reset()
+    elapsed = time.perf_counter() - start
+    print(f"CompactDeck.reset: {elapsed / decks * 1e6:.2f}us per deck")
 
 
 if __name__ == "__main__":
@@ -64,3 +147,5 @@ if __name__ == "__main__":
 
     for i in range(53):
         print(deck.deal_card())
+
+    benchmark()
@@ -1,5 +1,296 @@
+"""
+BlackJack rules and a Monte Carlo simulator for playing strategies
+
+Rules: dealer stands on all 17s and peeks for blackjack, blackjack pays
+3:2, the player may double on the first two cards (after a split too) and
+split a pair once; split aces get one card each.
+
+A strategy is a policy function called at every player decision:
+
+    policy(total, soft, dealer_up, can_double, pair) -> Action
+
+with `dealer_up` the value of the dealer's up card (1 for an ace) and
+`pair` the value of the paired card when the hand can be split, else 0.
+
+simulate() plays hands from a shoe of card codes (deck.CompactDeck). The
+MonteCarlo runner cuts the work into fixed size batches, each with its own
+RNG stream seeded from (seed, batch), and spreads them over a process
+pool: results only depend on the seed and batch size, not on the number
+of processes. Every strategy plays the same batches, i.e. the same cards
+(common random numbers), so differences between strategies are measured
+with less noise.
+"""
+
+from __future__ import annotations
+import math
+import random
+import time
 from abc import ABC, abstractmethod
-from deck import RegularDeck, IDeck
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Tuple
+from card import NUMBERS
+from deck import RegularDeck, IDeck, CompactDeck
+
+# BlackJack value of each card code, aces count 1
+VALUES = bytes(min(number, 10) for number in NUMBERS)
+
+
+class Action(Enum):
+    Hit = 0
+    Stand = 1
+    Double = 2
+    Split = 3
+
+
+Policy = Callable[[int, bool, int, bool, int], Action]
+
+
+def mimic_dealer(total: int, soft: bool, dealer_up: int, can_double: bool, pair: int) -> Action:
+    """
+    Hit below 17, like the dealer
+    """
+    return Action.Hit if total < 17 else Action.Stand
+
+
+def never_bust(total: int, soft: bool, dealer_up: int, can_double: bool, pair: int) -> Action:
+    """
+    Never risk busting: hit soft hands below 18 and hard hands below 12
+    """
+    if soft:
+        return Action.Hit if total < 18 else Action.Stand
+    return Action.Hit if total < 12 else Action.Stand
+
+
+def basic_strategy(total: int, soft: bool, dealer_up: int, can_double: bool, pair: int) -> Action:
+    """
+    Basic strategy for multiple decks, dealer standing on soft 17
+    """
+    up = 11 if dealer_up == 1 else dealer_up
+    if pair:
+        if (
+            pair in (1, 8)
+            or (pair == 9 and up not in (7, 10, 11))
+            or (pair in (2, 3, 7) and up <= 7)
+            or (pair == 6 and up <= 6)
+            or (pair == 4 and up in (5, 6))
+        ):
+            return Action.Split
+    double = Action.Double if can_double else Action.Hit
+    if soft:
+        if total >= 19:
+            return Action.Stand
+        if total == 18:
+            if 3 <= up <= 6:
+                return Action.Double if can_double else Action.Stand
+            return Action.Stand if up <= 8 else Action.Hit
+        if (
+            (total == 17 and 3 <= up <= 6)
+            or (total >= 15 and 4 <= up <= 6)
+            or (total >= 13 and 5 <= up <= 6)
+        ):
+            return double
+        return Action.Hit
+    if total >= 17:
+        return Action.Stand
+    if total >= 13:
+        return Action.Stand if up <= 6 else Action.Hit
+    if total == 12:
+        return Action.Stand if 4 <= up <= 6 else Action.Hit
+    if (total == 11 and up <= 10) or (total == 10 and up <= 9) or (total == 9 and 3 <= up <= 6):
+        return double
+    return Action.Hit
+
+
+def _best(total: int, aces: bool) -> int:
+    return total + 10 if aces and total <= 11 else total
+
+
+def _play_player(
+    first: int, second: int, dealer_up: int, draw: Callable[[], int], policy: Policy
+) -> Tuple[int, int]:
+    """
+    Play a hand without splitting, returns its final total and bet
+    """
+    total = first + second
+    aces = first == 1 or second == 1
+    can_double = True
+    while True:
+        best = _best(total, aces)
+        if best >= 21:
+            return best, 1
+        action = policy(best, aces and total <= 11, dealer_up, can_double, 0)
+        if action is Action.Stand:
+            return best, 1
+        if action is Action.Split or (action is Action.Double and not can_double):
+            raise Exception(f"{action.name} is not allowed on this hand")
+        card = draw()
+        total += card
+        aces = aces or card == 1
+        if action is Action.Double:
+            return _best(total, aces), 2
+        can_double = False
+
+
+def _play_dealer(up: int, hole: int, draw: Callable[[], int]) -> int:
+    total = up + hole
+    aces = up == 1 or hole == 1
+    while True:
+        best = _best(total, aces)
+        if best >= 17:
+            return best
+        card = draw()
+        total += card
+        aces = aces or card == 1
+
+
+def play_round(draw: Callable[[], int], policy: Policy) -> float:
+    """
+    Play one round drawing card values from `draw`, returns the player's
+    net result in units of the initial bet
+    """
+    first, up, second, hole = draw(), draw(), draw(), draw()
+    player_blackjack = _best(first + second, first == 1 or second == 1) == 21
+    dealer_blackjack = _best(up + hole, up == 1 or hole == 1) == 21
+    if player_blackjack:
+        return 0.0 if dealer_blackjack else 1.5
+    if dealer_blackjack:
+        return -1.0
+
+    hands: List[Tuple[int, int]]
+    pair_best = _best(first + second, first == 1)
+    if first == second and policy(pair_best, first == 1, up, True, first) is Action.Split:
+        if first == 1:
+            hands = [(_best(1 + draw(), True), 1), (_best(1 + draw(), True), 1)]
+        else:
+            hands = [_play_player(first, draw(), up, draw, policy) for _ in range(2)]
+    else:
+        hands = [_play_player(first, second, up, draw, policy)]
+
+    if all(total > 21 for total, _ in hands):
+        return -float(sum(bet for _, bet in hands))
+    dealer = _play_dealer(up, hole, draw)
+    net = 0.0
+    for total, bet in hands:
+        if total > 21 or (dealer <= 21 and total < dealer):
+            net -= bet
+        elif dealer > 21 or total > dealer:
+            net += bet
+    return net
+
+
+def simulate(
+    policy: Policy, hands: int, seed: str, decks: int = 6, penetration: float = 0.75
+) -> Tuple[int, float, float]:
+    """
+    Play `hands` rounds from a shoe of `decks` decks, reshuffled once
+    `penetration` of it is dealt. Returns (hands, sum, sum of squares) of
+    the net results.
+    """
+    shoe = CompactDeck(decks, random.Random(seed))
+    shoe.shuffle()
+    cards = shoe.deck
+    pop = cards.pop
+    cut = int(len(cards) * (1 - penetration))
+
+    def draw() -> int:
+        if not cards:
+            # a long round went through the cut card and the whole shoe
+            shoe.reset()
+            shoe.shuffle()
+        return VALUES[pop()]
+
+    total = squares = 0.0
+    for _ in range(hands):
+        if len(cards) < cut:
+            shoe.reset()
+            shoe.shuffle()
+        net = play_round(draw, policy)
+        total += net
+        squares += net * net
+    return hands, total, squares
+
+
+class StrategyResult:
+    def __init__(self, name: str):
+        self.name = name
+        self.hands = 0
+        self.total = 0.0
+        self.squares = 0.0
+
+    def add(self, hands: int, total: float, squares: float) -> None:
+        self.hands += hands
+        self.total += total
+        self.squares += squares
+
+    @property
+    def ev(self) -> float:
+        """
+        Expected net result per hand, in initial bets
+        """
+        return self.total / self.hands if self.hands else 0.0
+
+    @property
+    def variance(self) -> float:
+        if self.hands < 2:
+            return 0.0
+        return (self.squares - self.hands * self.ev**2) / (self.hands - 1)
+
+    @property
+    def stderr(self) -> float:
+        return math.sqrt(self.variance / self.hands) if self.hands else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.name:<15} {self.hands:>10,} hands  EV {self.ev:+.4f} "
+            f"± {1.96 * self.stderr:.4f}  variance {self.variance:.3f}"
+        )
+
+
+class MonteCarlo:
+    """
+    Runs strategies over `hands` hands each, in batches of `batch_hands`
+    on `processes` processes (in this process when 1). Policies must be
+    module level functions so they can be sent to the workers.
+    """
+
+    def __init__(
+        self,
+        hands: int,
+        batch_hands: int = 50_000,
+        processes: Optional[int] = None,
+        seed: int = 0,
+        decks: int = 6,
+        penetration: float = 0.75,
+    ):
+        self.hands = hands
+        self.batch_hands = batch_hands
+        self.processes = processes
+        self.seed = seed
+        self.decks = decks
+        self.penetration = penetration
+
+    def _batches(self, policy: Policy) -> List[tuple]:
+        batches = []
+        for batch, start in enumerate(range(0, self.hands, self.batch_hands)):
+            hands = min(self.batch_hands, self.hands - start)
+            seed = f"{self.seed}:{batch}"
+            batches.append((policy, hands, seed, self.decks, self.penetration))
+        return batches
+
+    def run(self, policies: List[Policy]) -> Dict[str, StrategyResult]:
+        results = {policy.__name__: StrategyResult(policy.__name__) for policy in policies}
+        jobs = [(policy.__name__, batch) for policy in policies for batch in self._batches(policy)]
+        if self.processes == 1:
+            outcomes = [simulate(*batch) for _, batch in jobs]
+        else:
+            with ProcessPoolExecutor(self.processes) as pool:
+                futures = [pool.submit(simulate, *batch) for _, batch in jobs]
+                outcomes = [future.result() for future in futures]
+        # summed in job order, whatever the order the workers finished in
+        for (name, _), outcome in zip(jobs, outcomes):
+            results[name].add(*outcome)
+        return results
 
 
 class CardGame(ABC):
@@ -12,15 +303,43 @@ class CardGame(ABC):
 
 
 class BlackJack(CardGame):
-    def __init__(self, deck: RegularDeck):
+    def __init__(self, deck: RegularDeck, policy: Policy = basic_strategy):
         self.deck = deck
+        self.policy = policy
 
-    def play_game(self):
-        print("Play game")
+    def _draw(self) -> int:
+        if not self.deck.deck:
+            self.deck.deck = self.deck._create_deck()
+            self.deck.shuffle()
+        card = self.deck.deal_card()
+        print(f"  {card}")
+        return min(card.number, 10)
+
+    def play_game(self) -> float:
+        """
+        Play one round with the policy, returns the player's net result
+        """
+        print("Dealing: player, dealer, player, dealer (hole card), then draws")
+        net = play_round(self._draw, self.policy)
+        print(f"Player {'wins' if net > 0 else 'loses' if net < 0 else 'pushes'} {abs(net)}")
+        return net
 
 
 if __name__ == "__main__":
     deck = RegularDeck()
+    deck.shuffle()
     blackjack = BlackJack(deck)
+    blackjack.play_game()
+
+    strategies = [basic_strategy, mimic_dealer, never_bust]
+    start = time.perf_counter()
+    results = MonteCarlo(hands=300_000, processes=2).run(strategies)
+    elapsed = time.perf_counter() - start
+    for result in results.values():
+        print(result)
+    hands = sum(result.hands for result in results.values())
+    print(f"{hands / elapsed:,.0f} hands/s on 2 processes")
 
-    print(blackjack.deck)
+    # same seed, same numbers on any number of processes
+    again = MonteCarlo(hands=300_000, processes=1).run(strategies)
+    print("reproducible:", all(again[n].total == r.total for n, r in results.items()))
@@ -0,0 +1,320 @@
+"""
+Asyncio fan-out for chat notifications
+
+AsyncNotificationService is a drop-in NotificationService for ChatRoom:
+- notify() only puts the message on the room's bounded fan-out queue,
+  O(1) for the sender whatever the size of the room
+- a fan-out task copies it to one bounded queue per subscriber
+- one worker task per subscriber delivers from its queue, so slow
+  subscribers do not hold up the others
+
+When a subscriber queue is full the OverflowPolicy decides what happens:
+drop the new notification, drop the oldest one, or coalesce it into the
+newest queued notification ("N new messages"). The room queue never drops
+a message: past its size it only coalesces consecutive messages of the
+same sender, so fan-out still skips the right user.
+
+A failing delivery is printed and counted on the subscriber queue, the
+worker goes on with the next notification.
+"""
+
+from __future__ import annotations
+import asyncio
+import contextlib
+import io
+import time
+from collections import deque
+from enum import Enum
+from functools import partial
+from typing import Awaitable, Callable, Dict, Optional
+from online_chat import ChatRoom, NotificationService, User
+
+
+class OverflowPolicy(Enum):
+    """
+    What to do with a notification for a subscriber whose queue is full
+    """
+
+    DropNewest = 0
+    DropOldest = 1
+    Coalesce = 2
+
+
+class Notification:
+    def __init__(self, chat: ChatRoom, sender: User, count: int = 1):
+        self.chat = chat
+        self.sender = sender
+        self.count = count
+
+    def __str__(self) -> str:
+        if self.count == 1:
+            return f"{self.sender.name} sent a message in {self.chat.name}"
+        return f"{self.count} new messages in {self.chat.name}, last from {self.sender.name}"
+
+
+async def append_notification(user: User, notification: Notification) -> None:
+    """
+    Default delivery: store the notification on the user
+    """
+    user.notifications.append(str(notification))
+
+
+class SubscriberQueue:
+    """
+    Bounded queue of a single subscriber
+    """
+
+    def __init__(self, maxsize: int, policy: OverflowPolicy):
+        if maxsize < 1:
+            raise ValueError("queue maxsize must be at least 1")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items: deque[Notification] = deque()
+        self.dropped = 0
+        self.coalesced = 0
+        self.failed = 0
+        self._ready = asyncio.Event()
+        # set when the queue is empty and nothing is being delivered
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def offer(self, notification: Notification) -> None:
+        items = self.items
+        if len(items) < self.maxsize:
+            items.append(notification)
+        elif self.policy == OverflowPolicy.DropNewest:
+            self.dropped += 1
+            return
+        elif self.policy == OverflowPolicy.DropOldest:
+            items.popleft()
+            items.append(notification)
+            self.dropped += 1
+        else:
+            last = items[-1]
+            last.count += notification.count
+            last.sender = notification.sender
+            self.coalesced += 1
+        self.idle.clear()
+        self._ready.set()
+
+    async def get(self) -> Notification:
+        while not self.items:
+            self._ready.clear()
+            await self._ready.wait()
+        return self.items.popleft()
+
+    def done(self) -> None:
+        if not self.items:
+            self.idle.set()
+
+
+class RoomQueue(SubscriberQueue):
+    """
+    Messages of a room waiting to be fanned out. Nothing is dropped: once
+    `maxsize` messages wait, a message is coalesced into the newest one if
+    both come from the same sender, and queued anyway otherwise.
+    """
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize, OverflowPolicy.Coalesce)
+
+    def offer(self, notification: Notification) -> None:
+        items = self.items
+        if len(items) >= self.maxsize and items[-1].sender is notification.sender:
+            items[-1].count += notification.count
+            self.coalesced += 1
+        else:
+            items.append(notification)
+        self.idle.clear()
+        self._ready.set()
+
+
+class AsyncNotificationService(NotificationService):
+    def __init__(
+        self,
+        chat: ChatRoom,
+        maxsize: int = 64,
+        policy: OverflowPolicy = OverflowPolicy.Coalesce,
+        deliver: Callable[[User, Notification], Awaitable[None]] = append_notification,
+        fan_out_batch: int = 512,
+        room_maxsize: int = 1024,
+    ):
+        if maxsize < 1 or room_maxsize < 1:
+            raise ValueError("queue maxsize must be at least 1")
+        super().__init__(chat)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.deliver = deliver
+        # subscribers copied per event before yielding to the loop
+        self.fan_out_batch = fan_out_batch
+        self.queues: Dict[User, SubscriberQueue] = {}
+        self._workers: Dict[User, asyncio.Task] = {}
+        # messages of the room waiting to be fanned out
+        self._events = RoomQueue(room_maxsize)
+        self._fan_out: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def factory(**kwargs) -> Callable[[ChatRoom], AsyncNotificationService]:
+        """
+        Factory to pass to ChatRoom(notification_service=...)
+        """
+        return partial(AsyncNotificationService, **kwargs)
+
+    @property
+    def started(self) -> bool:
+        return self._fan_out is not None
+
+    def start(self) -> None:
+        """
+        Start the fan-out and subscriber tasks. Must run inside an event loop.
+        """
+        if self.started:
+            return
+        self._fan_out = asyncio.create_task(self._run_fan_out())
+        for user in self.subscribers:
+            self._start_worker(user)
+
+    async def close(self) -> None:
+        tasks = list(self._workers.values())
+        if self._fan_out is not None:
+            tasks.append(self._fan_out)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = {}
+        self._fan_out = None
+
+    async def join(self) -> None:
+        """
+        Wait until every notification so far has been delivered. Raises
+        if the service is not started, nothing would deliver them.
+        """
+        if not self.started:
+            raise Exception("notification service not started")
+        await self._events.idle.wait()
+        for queue in list(self.queues.values()):
+            await queue.idle.wait()
+
+    def notify(self, user: User):
+        self._events.offer(Notification(self.chat, user))
+
+    def add_user(self, user: User):
+        if user in self.subscribers:
+            raise Exception(f"{user} already subscribed")
+        self.subscribers.add(user)
+        self.queues[user] = SubscriberQueue(self.maxsize, self.policy)
+        if self.started:
+            self._start_worker(user)
+
+    def remove_user(self, user: User):
+        if user not in self.subscribers:
+            raise Exception(f"{user} not subscribed")
+        self.subscribers.remove(user)
+        queue = self.queues.pop(user)
+        queue.idle.set()
+        worker = self._workers.pop(user, None)
+        if worker is not None:
+            worker.cancel()
+
+    def _start_worker(self, user: User) -> None:
+        self._workers[user] = asyncio.create_task(
+            self._run_worker(user, self.queues[user])
+        )
+
+    async def _run_fan_out(self) -> None:
+        while True:
+            notification: Notification = await self._events.get()
+            try:
+                sender = notification.sender
+                queues = list(self.queues.items())
+                for i, (user, queue) in enumerate(queues, 1):
+                    if user is not sender:
+                        queue.offer(
+                            Notification(notification.chat, sender, notification.count)
+                        )
+                    if i % self.fan_out_batch == 0:
+                        await asyncio.sleep(0)
+            finally:
+                self._events.done()
+
+    async def _run_worker(self, user: User, queue: SubscriberQueue) -> None:
+        while True:
+            notification = await queue.get()
+            try:
+                await self.deliver(user, notification)
+            except Exception as e:
+                queue.failed += 1
+                print(f"Delivery to {user.name} failed: {e!r}")
+            finally:
+                queue.done()
+
+
+async def benchmark(members: int, messages: int = 20) -> None:
+    owner = User("owner")
+    # joining prints a line per member, keep the output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        chat = ChatRoom(
+            "room", owner, notification_service=AsyncNotificationService.factory()
+        )
+        for i in range(members - 1):
+            chat.add_member(User(f"user{i}"))
+    service: AsyncNotificationService = chat.notification_service
+    service.start()
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(messages):
+            chat.send_message(owner, f"message {i}")
+    send = (time.perf_counter() - start) / messages
+
+    await service.join()
+    delivered = time.perf_counter() - start
+    coalesced = sum(q.coalesced for q in service.queues.values())
+    print(
+        f"{members:>6} members: send_message {send * 1e6:6.1f}us, "
+        f"all delivered after {delivered * 1e3:7.1f}ms, {coalesced} coalesced"
+    )
+    await service.close()
+
+
+async def failing_delivery() -> None:
+    async def deliver(user: User, notification: Notification) -> None:
+        if user.name == "broken":
+            raise Exception("connection reset")
+        await append_notification(user, notification)
+
+    owner, broken, other = User("owner"), User("broken"), User("other")
+    with contextlib.redirect_stdout(io.StringIO()):
+        chat = ChatRoom(
+            "room",
+            owner,
+            notification_service=AsyncNotificationService.factory(
+                deliver=deliver, room_maxsize=1
+            ),
+        )
+        chat.add_member(broken)
+        chat.add_member(other)
+    service: AsyncNotificationService = chat.notification_service
+    service.start()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        # the room queue is full after the first message
+        for sender in (owner, other, owner):
+            chat.send_message(sender, "hello")
+        await asyncio.wait_for(service.join(), timeout=5)
+    print(
+        f"join() returned after {service.queues[broken].failed} failed deliveries, "
+        f"other got {len(other.notifications)} notification(s), "
+        f"owner got {len(owner.notifications)}"
+    )
+    await service.close()
+
+
+async def main():
+    for members in (10, 100, 1_000, 10_000):
+        await benchmark(members)
+    await failing_delivery()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,502 @@
+"""
+Asyncio network front end for the online chat
+
+ChatServer serves OnlineChatSingleton, ChatRoom and User over TCP with a
+compact length-prefixed binary protocol. Every frame is
+
+    length (I) | op (B) | request id (I) | field count (H) | fields
+
+where `length` counts the bytes after itself and each field is a UTF-8
+string prefixed by its length (H). Integers travel as decimal strings.
+Answers too large for one frame are split: PARTIAL frames with the same
+request id, then the OK frame with the last fields.
+
+- One asyncio.Protocol per connection and no task per connection, so idle
+  connections only cost a socket and a small object.
+- Pipelining: a client can send any number of requests without waiting;
+  every complete frame in a read is handled in order and answered with the
+  same request id.
+- Batched writes: responses and pushed notifications are appended to the
+  connection's outbox and written with one transport.write per event loop
+  iteration.
+- Notifications for connected users are pushed as EVENT frames, offline
+  users get them in User.notifications. Connections that stop reading while
+  their outbox keeps growing are closed (slow consumers).
+"""
+
+from __future__ import annotations
+import asyncio
+import contextlib
+import os
+import resource
+import struct
+import time
+from enum import IntEnum
+from typing import Dict, List, Optional, Tuple
+from online_chat import ChatRoom, NotificationService, OnlineChatSingleton, User
+
+LENGTH = struct.Struct("!I")
+HEADER = struct.Struct("!BIH")
+FIELD = struct.Struct("!H")
+MAX_FRAME = 1024 * 1024
+MAX_FIELDS = 0xFFFF
+
+
+class Op(IntEnum):
+    # requests
+    Login = 1
+    CreateChat = 2
+    Join = 3
+    Leave = 4
+    Send = 5
+    Mute = 6
+    Unmute = 7
+    History = 8
+    Ping = 9
+    # server to client
+    Ok = 100
+    Error = 101
+    Event = 102
+    Partial = 103
+
+
+def encode_frame(op: int, request_id: int, fields: Tuple[str, ...] = ()) -> bytes:
+    if len(fields) > MAX_FIELDS:
+        raise Exception(f"{len(fields)} fields do not fit in a frame")
+    parts = [HEADER.pack(op, request_id, len(fields))]
+    for field in fields:
+        data = field.encode()
+        if len(data) > 0xFFFF:
+            raise Exception(f"field of {len(data)} bytes is too long")
+        parts.append(FIELD.pack(len(data)))
+        parts.append(data)
+    body = b"".join(parts)
+    return LENGTH.pack(len(body)) + body
+
+
+def encode_reply(request_id: int, fields: Tuple[str, ...] = ()) -> List[bytes]:
+    """
+    Frames answering a request: PARTIAL frames while the fields do not fit
+    in one frame, then the OK frame
+    """
+    frames = []
+    chunk: List[str] = []
+    size = HEADER.size
+    for field in fields:
+        field_size = FIELD.size + len(field.encode())
+        if chunk and (len(chunk) == MAX_FIELDS or size + field_size > MAX_FRAME):
+            frames.append(encode_frame(Op.Partial, request_id, tuple(chunk)))
+            chunk = []
+            size = HEADER.size
+        chunk.append(field)
+        size += field_size
+    frames.append(encode_frame(Op.Ok, request_id, tuple(chunk)))
+    return frames
+
+
+def decode_frames(buffer: bytearray) -> List[Tuple[int, int, List[str]]]:
+    """
+    Remove every complete frame from `buffer` and return them decoded.
+    Raises on a malformed frame.
+    """
+    frames = []
+    offset = 0
+    view = memoryview(buffer)
+    try:
+        while len(buffer) - offset >= LENGTH.size:
+            (length,) = LENGTH.unpack_from(buffer, offset)
+            if length > MAX_FRAME:
+                raise Exception(f"frame of {length} bytes is too large")
+            if length < HEADER.size:
+                raise Exception(f"frame of {length} bytes is too short")
+            end = offset + LENGTH.size + length
+            if end > len(buffer):
+                break
+            pos = offset + LENGTH.size
+            op, request_id, count = HEADER.unpack_from(buffer, pos)
+            pos += HEADER.size
+            fields = []
+            for _ in range(count):
+                if pos + FIELD.size > end:
+                    raise Exception("field runs past the end of the frame")
+                (size,) = FIELD.unpack_from(buffer, pos)
+                pos += FIELD.size
+                if pos + size > end:
+                    raise Exception("field runs past the end of the frame")
+                fields.append(str(view[pos : pos + size], "utf-8"))
+                pos += size
+            if pos != end:
+                raise Exception(f"{end - pos} unexpected bytes at the end of the frame")
+            frames.append((op, request_id, fields))
+            offset = end
+    finally:
+        view.release()
+    del buffer[:offset]
+    return frames
+
+
+class Connection(asyncio.Protocol):
+    def __init__(self, server: ChatServer):
+        self.server = server
+        self.transport: Optional[asyncio.Transport] = None
+        self.buffer = bytearray()
+        self.outbox: List[bytes] = []
+        self.outbox_bytes = 0
+        self.user: Optional[User] = None
+        self._flush_scheduled = False
+        self._paused = False
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+        self.server.connections.add(self)
+
+    def connection_lost(self, exc) -> None:
+        self.server.connections.discard(self)
+        if self.user is not None and self.server.online.get(self.user) is self:
+            del self.server.online[self.user]
+
+    def data_received(self, data: bytes) -> None:
+        self.buffer += data
+        try:
+            frames = decode_frames(self.buffer)
+        except Exception:
+            self.transport.close()
+            return
+        self.server.handle_batch(self, frames)
+
+    def send(self, frame: bytes) -> None:
+        """
+        Queue a frame, written at the end of the current loop iteration
+        """
+        if self.transport.is_closing():
+            return
+        self.outbox.append(frame)
+        self.outbox_bytes += len(frame)
+        if self._paused and self.outbox_bytes > self.server.max_outbox:
+            # the client stopped reading
+            self.transport.abort()
+            return
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self) -> None:
+        self._flush_scheduled = False
+        if self._paused or not self.outbox:
+            return
+        self.transport.write(b"".join(self.outbox))
+        self.outbox.clear()
+        self.outbox_bytes = 0
+
+    def pause_writing(self) -> None:
+        # stop reading requests until the client catches up with the answers
+        self._paused = True
+        self.transport.pause_reading()
+
+    def resume_writing(self) -> None:
+        self._paused = False
+        self.transport.resume_reading()
+        self.flush()
+
+
+class ServerNotificationService(NotificationService):
+    """
+    Pushes notifications to connected subscribers
+    """
+
+    def __init__(self, chat: ChatRoom, server: ChatServer):
+        super().__init__(chat)
+        self.server = server
+
+    def notify(self, user: User):
+        text = f"{user.name} sent a message in {self.chat.name}"
+        frame = None
+        for sub in self.subscribers:
+            if sub is user:
+                continue
+            connection = self.server.online.get(sub)
+            if connection is None:
+                sub.notifications.append(text)
+                continue
+            if frame is None:
+                frame = encode_frame(Op.Event, 0, (self.chat.name, user.name, text))
+            connection.send(frame)
+
+    def add_user(self, user: User):
+        if user in self.subscribers:
+            raise Exception(f"{user} already subscribed")
+        self.subscribers.add(user)
+
+    def remove_user(self, user: User):
+        if user not in self.subscribers:
+            raise Exception(f"{user} not subscribed")
+        self.subscribers.remove(user)
+
+
+class ChatServer:
+    def __init__(
+        self,
+        online_chat: OnlineChatSingleton = None,
+        max_outbox: int = 4 * 1024 * 1024,
+        quiet: bool = True,
+    ):
+        self.online_chat = online_chat or OnlineChatSingleton.get_instance()
+        self.max_outbox = max_outbox
+        # ChatRoom and User print on every change, too slow for a server
+        self.quiet = quiet
+        self.users: Dict[str, User] = {}
+        self.rooms: Dict[str, ChatRoom] = {}
+        self.online: Dict[User, Connection] = {}
+        self.connections = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._devnull = open(os.devnull, "w")
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """
+        Start listening and return the port
+        """
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(
+            lambda: Connection(self), host, port, backlog=4096
+        )
+        return self._server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        self._server.close()
+        for connection in list(self.connections):
+            connection.transport.close()
+        await self._server.wait_closed()
+        self._devnull.close()
+
+    def handle_batch(self, connection: Connection, frames) -> None:
+        if not frames:
+            return
+        stdout = contextlib.redirect_stdout(self._devnull) if self.quiet else contextlib.nullcontext()
+        with stdout:
+            for op, request_id, fields in frames:
+                try:
+                    replies = self.handle(connection, op, request_id, fields)
+                except Exception as e:
+                    replies = [encode_frame(Op.Error, request_id, (str(e),))]
+                for frame in replies:
+                    connection.send(frame)
+
+    def _user(self, connection: Connection) -> User:
+        if connection.user is None:
+            raise Exception("login first")
+        return connection.user
+
+    def _room(self, name: str) -> ChatRoom:
+        room = self.rooms.get(name)
+        if room is None:
+            raise Exception(f"{name} does not exist")
+        return room
+
+    def handle(
+        self, connection: Connection, op: int, request_id: int, fields: List[str]
+    ) -> List[bytes]:
+        """
+        Run a request and return the frames answering it
+        """
+        if op == Op.Send:
+            room, text = fields
+            self._room(room).send_message(self._user(connection), text)
+            return encode_reply(request_id)
+        if op == Op.Login:
+            (name,) = fields
+            if connection.user is not None:
+                raise Exception(f"already logged in as {connection.user.name}")
+            user = self.users.get(name)
+            if user is None:
+                user = self.users[name] = User(name)
+                self.online_chat.create_user(user)
+            if user in self.online:
+                raise Exception(f"{name} is already connected")
+            # build the answer first: if it fails the user is not logged in
+            # and keeps the notifications
+            replies = encode_reply(request_id, tuple(user.notifications))
+            connection.user = user
+            self.online[user] = connection
+            user.notifications.clear()
+            return replies
+        if op == Op.CreateChat:
+            (name,) = fields
+            if name in self.rooms:
+                raise Exception(f"{name} already exists")
+            room = ChatRoom(
+                name,
+                self._user(connection),
+                notification_service=lambda chat: ServerNotificationService(chat, self),
+            )
+            self.rooms[name] = room
+            self.online_chat.create_chat(room)
+            return encode_reply(request_id)
+        if op == Op.Join:
+            self._room(fields[0]).add_member(self._user(connection))
+            return encode_reply(request_id)
+        if op == Op.Leave:
+            self._room(fields[0]).remove_member(self._user(connection))
+            return encode_reply(request_id)
+        if op == Op.Mute:
+            self._user(connection).mute_notifications(self._room(fields[0]))
+            return encode_reply(request_id)
+        if op == Op.Unmute:
+            self._user(connection).unmute_notifications(self._room(fields[0]))
+            return encode_reply(request_id)
+        if op == Op.History:
+            room, limit = fields
+            result = []
+            for _, sender, message in self._room(room).history(limit=int(limit)):
+                result += [sender.name, message]
+            return encode_reply(request_id, tuple(result))
+        if op == Op.Ping:
+            return encode_reply(request_id, tuple(fields))
+        raise Exception(f"Unknown op {op}")
+
+
+class ChatClient:
+    """
+    Pipelining client: request() returns a future right away, requests
+    issued in the same loop iteration are written together
+    """
+
+    def __init__(self):
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self.events: List[Tuple[str, ...]] = []
+        self._pending: Dict[int, asyncio.Future] = {}
+        # fields of PARTIAL frames, per request id
+        self._partial: Dict[int, List[str]] = {}
+        self._next_id = 1
+        self._outbox: List[bytes] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def connect(self, host: str, port: int) -> None:
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self._task = asyncio.create_task(self._read())
+
+    def request(self, op: Op, *fields: str) -> asyncio.Future:
+        request_id = self._next_id
+        self._next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        if not self._outbox:
+            asyncio.get_running_loop().call_soon(self._flush)
+        self._outbox.append(encode_frame(op, request_id, fields))
+        return future
+
+    async def call(self, op: Op, *fields: str) -> Tuple[str, ...]:
+        return await self.request(op, *fields)
+
+    def _flush(self) -> None:
+        self.writer.write(b"".join(self._outbox))
+        self._outbox.clear()
+
+    async def _read(self) -> None:
+        buffer = bytearray()
+        # a malformed frame closes the connection, like on the server
+        with contextlib.suppress(Exception):
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                buffer += data
+                for op, request_id, fields in decode_frames(buffer):
+                    if op == Op.Event:
+                        self.events.append(tuple(fields))
+                        continue
+                    if op == Op.Partial:
+                        self._partial.setdefault(request_id, []).extend(fields)
+                        continue
+                    future = self._pending.pop(request_id)
+                    fields = self._partial.pop(request_id, []) + fields
+                    if op == Op.Error:
+                        future.set_exception(Exception(fields[0]))
+                    else:
+                        future.set_result(tuple(fields))
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("connection closed"))
+        self._pending.clear()
+
+    async def close(self) -> None:
+        self.writer.close()
+        with contextlib.suppress(ConnectionError):
+            await self.writer.wait_closed()
+        await self._task
+
+
+def raise_file_limit() -> int:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        with contextlib.suppress(ValueError, OSError):
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+
+
+async def run(idle: int = 5_000, senders: int = 10, messages: int = 5_000) -> None:
+    server = ChatServer(OnlineChatSingleton())
+    port = await server.start()
+
+    # each connection takes two descriptors in this process (client + server)
+    idle = max(0, min(idle, raise_file_limit() // 2 - senders - 64))
+    idle_clients = []
+    for i in range(idle):
+        client = ChatClient()
+        await client.connect("127.0.0.1", port)
+        idle_clients.append(client)
+    print(f"{len(server.connections)} idle connections open")
+
+    clients = []
+    for i in range(senders):
+        client = ChatClient()
+        await client.connect("127.0.0.1", port)
+        await client.call(Op.Login, f"user{i}")
+        clients.append(client)
+    await clients[0].call(Op.CreateChat, "lobby")
+    await asyncio.gather(*(c.call(Op.Join, "lobby") for c in clients[1:]))
+    # joins, then stays offline while the others talk
+    late = ChatClient()
+    await late.connect("127.0.0.1", port)
+    await late.call(Op.Login, "late")
+    await late.call(Op.Join, "lobby")
+    await late.close()
+
+    # every sender pipelines all of its messages before awaiting any answer
+    start = time.perf_counter()
+    futures = [
+        client.request(Op.Send, "lobby", f"message {n} from user{i}")
+        for n in range(messages)
+        for i, client in enumerate(clients)
+    ]
+    await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+    total = messages * senders
+    await clients[0].call(Op.Ping)
+    print(
+        f"{total / elapsed:,.0f} messages/s, "
+        f"{(senders - 1) * total / elapsed:,.0f} notifications pushed/s"
+    )
+    print(f"user0 received {len(clients[0].events)} events, e.g. {clients[0].events[0]}")
+    print("history:", await clients[1].call(Op.History, "lobby", "2"))
+    history = await clients[1].call(Op.History, "lobby", "200")
+    print(f"history of 200 messages: {len(history)} fields")
+    await late.connect("127.0.0.1", port)
+    pending = await late.call(Op.Login, "late")
+    print(f"late logs in with {len(pending):,} pending notifications")
+    try:
+        await clients[1].call(Op.Join, "nowhere")
+    except Exception as e:
+        print("error:", e)
+
+    for client in clients + idle_clients + [late]:
+        await client.close()
+    await server.close()
+
+
+def main():
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Compact, columnar message storage for ChatRoom
+
+ColumnarMessageHistory is a MessageHistory whose segments store messages
+column by column instead of as a list of (User, str) tuples:
+- sender ids in an array of unsigned ints, resolved through a per-room
+  sender table
+- timestamps in an array of doubles
+- message bodies in one contiguous UTF-8 bytearray, with start offsets and
+  lengths in arrays
+
+Short messages seen more than once ("ok", "lol", "+1") are interned: they
+are stored once per room and segments only keep their id (as a negative
+length), which also skips the UTF-8 decode on read.
+"""
+
+from __future__ import annotations
+import contextlib
+import gc
+import io
+import itertools
+import random
+import time
+import tracemalloc
+from array import array
+from typing import Any, Dict, Iterator, List, Set, Tuple
+from message_history import MessageHistory, Segment
+from online_chat import ChatRoom, User
+
+
+class SenderTable:
+    """
+    Sender <-> integer id mapping shared by the segments of a history
+    """
+
+    def __init__(self):
+        self.senders: List[Any] = []
+        self.ids: Dict[Any, int] = {}
+
+    def id(self, sender) -> int:
+        sender_id = self.ids.get(sender)
+        if sender_id is None:
+            sender_id = self.ids[sender] = len(self.senders)
+            self.senders.append(sender)
+        return sender_id
+
+
+class InternTable:
+    """
+    Table of frequent short messages. A message is interned the second
+    time it is seen if it is at most `max_bytes` long.
+
+    Messages seen once are only remembered while their segment is in
+    memory: the history calls forget() for every evicted segment.
+    """
+
+    def __init__(self, max_bytes: int = 16, max_entries: int = 4096):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+        # short messages seen once, in the segments still in memory
+        self._seen: Set[str] = set()
+
+    def lookup(self, message: str) -> int:
+        """
+        Intern id of the message, -1 if it is not interned
+        """
+        intern_id = self.ids.get(message)
+        if intern_id is not None:
+            return intern_id
+        if len(message.encode()) > self.max_bytes or len(self.strings) >= self.max_entries:
+            return -1
+        if message not in self._seen:
+            self._seen.add(message)
+            return -1
+        self._seen.remove(message)
+        intern_id = self.ids[message] = len(self.strings)
+        self.strings.append(message)
+        return intern_id
+
+    def forget(self, segment: ColumnarSegment) -> None:
+        """
+        Drop the messages of an evicted segment from the seen-once set
+        """
+        if not self._seen:
+            return
+        for index, length in enumerate(segment.lengths):
+            if 0 <= length <= self.max_bytes:
+                self._seen.discard(segment._body(index))
+
+
+class ColumnarSegment(Segment):
+    def __init__(self, base: int, senders: SenderTable, interned: InternTable):
+        self.base = base
+        self.senders = senders
+        self.interned = interned
+        self.sender_ids = array("I")
+        self.timestamps = array("d")
+        self.starts = array("I")
+        # byte length of the body, or -(intern id + 1) for interned messages
+        self.lengths = array("i")
+        self.bodies = bytearray()
+
+    @property
+    def messages(self) -> List[Tuple[Any, str]]:
+        return self.slice(0, len(self))
+
+    def append(self, sender, message: str, timestamp: float = None) -> None:
+        self.sender_ids.append(self.senders.id(sender))
+        self.timestamps.append(time.time() if timestamp is None else timestamp)
+        intern_id = self.interned.lookup(message)
+        if intern_id >= 0:
+            self.starts.append(len(self.bodies))
+            self.lengths.append(-intern_id - 1)
+            return
+        body = message.encode()
+        self.starts.append(len(self.bodies))
+        self.lengths.append(len(body))
+        self.bodies += body
+
+    def _body(self, index: int) -> str:
+        length = self.lengths[index]
+        if length < 0:
+            return self.interned.strings[-length - 1]
+        start = self.starts[index]
+        return self.bodies[start : start + length].decode()
+
+    def get(self, index: int) -> Tuple[Any, str]:
+        return self.senders.senders[self.sender_ids[index]], self._body(index)
+
+    def timestamp(self, index: int) -> float:
+        return self.timestamps[index]
+
+    def slice(self, start: int, stop: int) -> List[Tuple[Any, str]]:
+        stop = min(stop, len(self))
+        return [self.get(i) for i in range(start, stop)]
+
+    def __len__(self) -> int:
+        return len(self.sender_ids)
+
+    def __iter__(self) -> Iterator[Tuple[Any, str]]:
+        return (self.get(i) for i in range(len(self)))
+
+
+class ColumnarMessageHistory(MessageHistory):
+    def __init__(
+        self,
+        page_size: int = 256,
+        max_segments: int = 64,
+        on_evict=None,
+        intern_max_bytes: int = 16,
+    ):
+        # the segment factory needs the tables, set them up first
+        self.senders = SenderTable()
+        self.interned = InternTable(intern_max_bytes)
+        super().__init__(page_size, max_segments, on_evict)
+
+    def _new_segment(self, base: int) -> ColumnarSegment:
+        return ColumnarSegment(base, self.senders, self.interned)
+
+    def evict(self, count: int) -> None:
+        for segment in itertools.islice(self.segments, min(count, len(self.segments) - 1)):
+            self.interned.forget(segment)
+        super().evict(count)
+
+    def timestamp(self, seq: int) -> float:
+        if not self.first_seq <= seq < self.next_seq:
+            raise IndexError(f"message {seq} is not in memory")
+        segment = self.segments[(seq - self.first_seq) // self.page_size]
+        return segment.timestamp(seq - segment.base)
+
+
+def _measure(build) -> Tuple[int, Any]:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, result
+
+
+def main():
+    rng = random.Random(0)
+    users = [User(f"user{i}") for i in range(50)]
+    frequent = ["ok", "lol", "+1", "thanks!", "yes", "no", "brb", "haha"]
+    words = "the build is green deploy went fine see logs for details please review".split()
+
+    count = 200_000
+    messages = []
+    for _ in range(count):
+        if rng.random() < 0.4:
+            text = rng.choice(frequent)
+        else:
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(3, 12)))
+        messages.append((rng.choice(users), text))
+
+    # both layouts copy each string, as if it had just arrived from a client
+    def tuples():
+        history: List[Tuple[User, str]] = []
+        for user, text in messages:
+            history.append((user, "".join(list(text))))
+        return history
+
+    def columnar():
+        history = ColumnarMessageHistory(max_segments=count)
+        for user, text in messages:
+            history.append(user, "".join(list(text)))
+        return history
+
+    list_size, _ = _measure(tuples)
+    columnar_size, history = _measure(columnar)
+    print(f"list of tuples: {list_size / count:6.1f} bytes/message")
+    print(f"columnar:       {columnar_size / count:6.1f} bytes/message")
+    print(f"interned {len(history.interned.strings)} messages")
+
+    # unique short messages: only the ones still in memory are remembered
+    bounded = ColumnarMessageHistory(max_segments=4)
+    for i in range(count):
+        bounded.append(users[0], f"id {i}")
+    print(
+        f"{count} unique short messages, {len(bounded)} in memory, "
+        f"{len(bounded.interned._seen)} remembered for interning"
+    )
+    print(history.history(limit=3).messages)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        chat = ChatRoom("chat1", users[0], messages=ColumnarMessageHistory())
+        chat.send_message(users[0], "hello")
+    print(chat.history().messages)
+
+
+if __name__ == "__main__":
+    main()
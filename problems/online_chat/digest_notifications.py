@@ -0,0 +1,192 @@
+"""
+Digest (coalesced) notifications for busy chat rooms
+
+NotificationService sends one notification per message per subscriber.
+DigestNotificationService instead buffers a room's messages and sends each
+subscriber a single "N new messages" digest once the window has elapsed or
+enough messages piled up.
+
+Per message no subscriber is touched. Unread counts come from the room
+history's next sequence number and the subscriber's read cursor
+(User.read_cursors, the single source of read state), and reading the room
+(or writing to it) moves that cursor forward, which cancels the pending
+digest.
+"""
+
+from __future__ import annotations
+import contextlib
+import heapq
+import io
+import itertools
+import time
+from functools import partial
+from typing import Callable, Dict, List, Optional
+from online_chat import ChatRoom, NotificationService, User
+
+
+def append_digest(user: User, digest: str) -> None:
+    """
+    Default delivery: store the digest on the user
+    """
+    user.notifications.append(digest)
+
+
+class DigestNotificationService(NotificationService):
+    def __init__(
+        self,
+        chat: ChatRoom,
+        window: float = 60.0,
+        max_messages: int = 50,
+        clock: Callable[[], float] = time.monotonic,
+        deliver: Callable[[User, str], None] = append_digest,
+        scheduler: DigestScheduler = None,
+    ):
+        super().__init__(chat)
+        self.window = window
+        self.max_messages = max_messages
+        self.clock = clock
+        self.deliver = deliver
+        self.scheduler = scheduler
+        # next sequence number of the room history when each subscriber was
+        # last notified, and at the last flush
+        self.notified_seq: Dict[User, int] = {}
+        self.flushed_seq = chat.messages.next_seq
+        # time at which the pending digest is due, None when nothing pending
+        self.due_at: Optional[float] = None
+        self.digests_sent = 0
+
+    @staticmethod
+    def factory(**kwargs) -> Callable[[ChatRoom], DigestNotificationService]:
+        """
+        Factory to pass to ChatRoom(notification_service=...)
+        """
+        return partial(DigestNotificationService, **kwargs)
+
+    @property
+    def seq(self) -> int:
+        return self.chat.messages.next_seq
+
+    def _read_seq(self, user: User) -> int:
+        # subscribers without a cursor have nothing unread
+        return user.read_cursors.get(self.chat, self.seq)
+
+    def notify(self, user: User):
+        # ChatRoom.send_message already moved the sender's read cursor
+        if self.due_at is None:
+            self.due_at = self.clock() + self.window
+            if self.scheduler is not None:
+                self.scheduler.schedule(self)
+        if self.seq - self.flushed_seq >= self.max_messages:
+            self.flush()
+
+    def add_user(self, user: User):
+        if user in self.subscribers:
+            raise Exception(f"{user} already subscribed")
+        self.subscribers.add(user)
+        # only messages from now on are notified to the new subscriber
+        self.notified_seq[user] = self.seq
+
+    def remove_user(self, user: User):
+        if user not in self.subscribers:
+            raise Exception(f"{user} not subscribed")
+        self.subscribers.remove(user)
+        self.notified_seq.pop(user, None)
+
+    def unread_count(self, user: User) -> int:
+        return self.seq - self._read_seq(user)
+
+    def tick(self, now: float = None) -> bool:
+        """
+        Flush if the pending digest is due. Returns True if it flushed.
+        """
+        now = self.clock() if now is None else now
+        if self.due_at is None or now < self.due_at:
+            return False
+        self.flush()
+        return True
+
+    def flush(self) -> None:
+        """
+        Send every subscriber with unseen messages one digest
+        """
+        seq = self.seq
+        for sub in self.subscribers:
+            read = self._read_seq(sub)
+            seen = max(read, self.notified_seq.get(sub, seq))
+            if seen >= seq:
+                continue
+            unread = seq - read
+            self.deliver(
+                sub, f"{seq - seen} new messages in {self.chat.name} ({unread} unread)"
+            )
+            self.notified_seq[sub] = seq
+            self.digests_sent += 1
+        self.flushed_seq = seq
+        self.due_at = None
+
+
+class DigestScheduler:
+    """
+    Flushes the digests of many rooms when they are due.
+
+    Services are kept in a heap by due time, so run_due only looks at the
+    rooms that actually have something to flush.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._heap: List[tuple] = []
+        self._sequence = itertools.count()
+
+    def schedule(self, service: DigestNotificationService) -> None:
+        heapq.heappush(self._heap, (service.due_at, next(self._sequence), service))
+
+    def run_due(self, now: float = None) -> int:
+        """
+        Flush every due room, returns the number of rooms flushed
+        """
+        now = self.clock() if now is None else now
+        flushed = 0
+        while self._heap and self._heap[0][0] <= now:
+            due_at, _, service = heapq.heappop(self._heap)
+            # the room may have flushed early on max_messages
+            if service.due_at == due_at:
+                service.flush()
+                flushed += 1
+        return flushed
+
+
+def main():
+    now = [0.0]
+    scheduler = DigestScheduler(clock=lambda: now[0])
+    factory = DigestNotificationService.factory(
+        window=30, max_messages=100, clock=lambda: now[0], scheduler=scheduler
+    )
+
+    members = 50
+    messages = 2_000
+    users = [User(f"user{i}") for i in range(members)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        chat = ChatRoom("busy", users[0], notification_service=factory)
+        for user in users[1:]:
+            chat.add_member(user)
+
+        for i in range(messages):
+            now[0] += 1
+            chat.send_message(users[i % 10], f"message {i}")
+            scheduler.run_due()
+            # a reader catching up cancels their pending digest
+            if i % 7 == 0:
+                chat.mark_read(users[-1])
+
+    service: DigestNotificationService = chat.notification_service
+    immediate = messages * (members - 1)
+    print(f"immediate notifications: {immediate}")
+    print(f"digests sent:            {service.digests_sent}")
+    print(f"reduction:               {immediate / service.digests_sent:.0f}x")
+    print(f"{users[20]} unread: {service.unread_count(users[20])}")
+    print(users[20].notifications[-1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+Friend-of-friend suggestions
+
+FriendSuggestions snapshots the User.friends graph into a compressed sparse
+row (CSR) adjacency: users get integer ids, `indptr[i]:indptr[i + 1]` is the
+slice of `indices` holding the sorted friend ids of user i.
+
+Mutual friend counts for a user are computed by concatenating the
+neighbour slices of their friends and counting ids with Counter, which runs
+in C instead of a nested Python loop.
+
+Accepted friend requests and removed friendships are applied to a small
+overlay of added / removed edges, so suggestions stay current without a
+rebuild. Once the overlay grows past `rebuild_ratio` of the snapshot the CSR
+is rebuilt.
+"""
+
+from __future__ import annotations
+import contextlib
+import heapq
+import io
+import random
+import time
+from array import array
+from collections import Counter
+from itertools import chain
+from typing import Dict, Iterable, List, Set, Tuple
+from online_chat import OnlineChatSingleton, User
+
+
+class FriendSuggestions:
+    def __init__(self, users: Iterable[User], rebuild_ratio: float = 0.1):
+        self.rebuild_ratio = rebuild_ratio
+        self.users: List[User] = []
+        self.ids: Dict[User, int] = {}
+        self.indptr = array("Q", [0])
+        self.indices = array("I")
+        self._added: Dict[int, Set[int]] = {}
+        self._removed: Dict[int, Set[int]] = {}
+        self._overlay = 0
+        self.build(users)
+
+    def build(self, users: Iterable[User] = None) -> None:
+        """
+        Snapshot the friendship graph of `users` (the current users when None)
+        """
+        users = list(self.users if users is None else users)
+        self.users = users
+        self.ids = {user: i for i, user in enumerate(users)}
+        indptr = array("Q", [0])
+        indices = array("I")
+        for user in users:
+            indices.extend(sorted(self.ids[f] for f in user.friends if f in self.ids))
+            indptr.append(len(indices))
+        self.indptr, self.indices = indptr, indices
+        self._added, self._removed = {}, {}
+        self._overlay = 0
+
+    def _id(self, user: User) -> int:
+        i = self.ids.get(user)
+        if i is None:
+            i = self.ids[user] = len(self.users)
+            self.users.append(user)
+            self.indptr.append(self.indptr[-1])
+        return i
+
+    def neighbors(self, i: int) -> Iterable[int]:
+        base = self.indices[self.indptr[i] : self.indptr[i + 1]]
+        removed = self._removed.get(i)
+        if removed:
+            base = [n for n in base if n not in removed]
+        added = self._added.get(i)
+        return chain(base, added) if added else base
+
+    def friendship_added(self, a: User, b: User) -> None:
+        self._set_edge(self._id(a), self._id(b), True)
+        self._set_edge(self._id(b), self._id(a), True)
+        self._maybe_rebuild()
+
+    def friendship_removed(self, a: User, b: User) -> None:
+        if a not in self.ids or b not in self.ids:
+            return
+        self._set_edge(self.ids[a], self.ids[b], False)
+        self._set_edge(self.ids[b], self.ids[a], False)
+        self._maybe_rebuild()
+
+    def _set_edge(self, i: int, j: int, present: bool) -> None:
+        added = self._added.setdefault(i, set())
+        removed = self._removed.setdefault(i, set())
+        in_snapshot = j in self.indices[self.indptr[i] : self.indptr[i + 1]]
+        if present:
+            removed.discard(j)
+            if not in_snapshot and j not in added:
+                added.add(j)
+                self._overlay += 1
+        else:
+            if j in added:
+                added.discard(j)
+            elif in_snapshot and j not in removed:
+                removed.add(j)
+                self._overlay += 1
+
+    def _maybe_rebuild(self) -> None:
+        if self._overlay > self.rebuild_ratio * max(len(self.indices), 1024):
+            self.build()
+
+    def suggest(self, user: User, k: int = 10) -> List[Tuple[User, int]]:
+        """
+        Top k non-friends of `user` by number of mutual friends
+        """
+        i = self.ids.get(user)
+        if i is None:
+            return []
+        friends = list(self.neighbors(i))
+        counts = Counter(chain.from_iterable(map(self.neighbors, friends)))
+        counts.pop(i, None)
+        for friend in friends:
+            counts.pop(friend, None)
+        top = heapq.nlargest(k, counts.items(), key=lambda item: (item[1], -item[0]))
+        return [(self.users[j], mutual) for j, mutual in top]
+
+    def suggest_all(self, k: int = 10) -> Dict[User, List[Tuple[User, int]]]:
+        """
+        Batch suggestions for every user, e.g. for a nightly job
+        """
+        return {user: self.suggest(user, k) for user in self.users}
+
+
+def main():
+    rng = random.Random(0)
+    chat = OnlineChatSingleton.get_instance()
+    users = [User(f"user{i}") for i in range(20_000)]
+    for user in users:
+        chat.create_user(user)
+
+    # clustered graph: most friends come from the same "community"
+    for i, user in enumerate(users):
+        community = i // 200
+        for _ in range(10):
+            if rng.random() < 0.8:
+                j = community * 200 + rng.randrange(200)
+            else:
+                j = rng.randrange(len(users))
+            if j != i:
+                user.friends.add(users[j])
+                users[j].friends.add(user)
+
+    start = time.perf_counter()
+    engine = FriendSuggestions(users)
+    print(f"CSR snapshot of {len(engine.indices)} edges in {time.perf_counter() - start:.2f}s")
+    chat.add_friendship_listener(engine)
+
+    start = time.perf_counter()
+    everyone = engine.suggest_all(k=5)
+    elapsed = time.perf_counter() - start
+    print(f"suggestions for {len(everyone)} users in {elapsed:.2f}s")
+    print(users[0], "->", everyone[users[0]])
+
+    # accept a suggestion, suggestions update without a rebuild
+    suggested, _ = everyone[users[0]][0]
+    with contextlib.redirect_stdout(io.StringIO()):
+        suggested.send_friend_request(users[0])
+        users[0].accept_friend_request(suggested)
+    print(users[0], "->", engine.suggest(users[0], k=5))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+Load-test harness for the online chat
+
+ChatLoadTest creates N users and M rooms whose sizes follow a Zipf-like
+distribution (a few huge rooms, many small ones), then drives a random mix
+of send, join, leave, mute and unmute operations and reports:
+- messages per second
+- fan-out latency percentiles (time spent in send_message, which includes
+  NotificationService.notify)
+- per-operation latency for membership churn
+- memory growth over the run
+
+Any implementation with the same interface can be tested by passing
+`user_factory` / `room_factory`: rooms need send_message, add_member and
+remove_member, users need mute_notifications and unmute_notifications.
+"""
+
+from __future__ import annotations
+import contextlib
+import gc
+import os
+import random
+import resource
+import time
+from typing import Any, Callable, Dict, List, Set, Tuple
+from columnar_history import ColumnarMessageHistory
+from digest_notifications import DigestNotificationService
+from online_chat import ChatRoom, User
+
+DEFAULT_MIX = {"send": 0.9, "join": 0.03, "leave": 0.03, "mute": 0.02, "unmute": 0.02}
+
+
+def rss_bytes() -> int:
+    """
+    Current resident set size, peak RSS where /proc is not available
+    """
+    with contextlib.suppress(OSError, ValueError):
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class LoadReport:
+    def __init__(
+        self,
+        seconds: float,
+        latencies: Dict[str, List[float]],
+        memory_before: int,
+        memory_after: int,
+        errors: int,
+    ):
+        self.seconds = seconds
+        self.latencies = latencies
+        self.memory_before = memory_before
+        self.memory_after = memory_after
+        self.errors = errors
+
+    @property
+    def messages_per_second(self) -> float:
+        sends = len(self.latencies.get("send", []))
+        return sends / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        lines = [
+            f"{self.messages_per_second:,.0f} messages/s over {self.seconds:.2f}s, "
+            f"{self.errors} failed operations",
+            f"memory growth: {(self.memory_after - self.memory_before) / 1e6:+.1f}MB",
+        ]
+        for op, values in self.latencies.items():
+            lines.append(
+                f"  {op:<7} n={len(values):<7} "
+                + " ".join(
+                    f"p{p}={percentile(values, p) * 1e6:.1f}us" for p in (50, 95, 99)
+                )
+            )
+        return "\n".join(lines)
+
+
+class ChatLoadTest:
+    def __init__(
+        self,
+        users: int = 10_000,
+        rooms: int = 1_000,
+        max_room_size: int = 2_000,
+        zipf: float = 1.1,
+        mix: Dict[str, float] = None,
+        seed: int = 0,
+        user_factory: Callable[[str], Any] = User,
+        room_factory: Callable[[str, Any], Any] = ChatRoom,
+    ):
+        self.rng = random.Random(seed)
+        self.mix = mix or DEFAULT_MIX
+        self.user_factory = user_factory
+        self.room_factory = room_factory
+
+        # ChatRoom and User print on every operation, keep that out of the numbers
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            self.users = [user_factory(f"user{i}") for i in range(users)]
+            self.rooms: List[Any] = []
+            self.members: List[List[Any]] = []
+            self.muted: List[Set[Any]] = []
+            for r in range(rooms):
+                # Zipf-like: the r-th room has about max_room_size / r^zipf members
+                size = max(2, min(users, int(max_room_size / (r + 1) ** zipf)))
+                members = self.rng.sample(self.users, size)
+                room = room_factory(f"room{r}", members[0])
+                for member in members[1:]:
+                    room.add_member(member)
+                self.rooms.append(room)
+                self.members.append(members)
+                self.muted.append(set())
+
+    def _pick_room(self) -> int:
+        # traffic follows room size, like real chats
+        return self.rng.choices(range(len(self.rooms)), weights=self._weights)[0]
+
+    def run(self, operations: int = 100_000) -> LoadReport:
+        self._weights = [len(m) for m in self.members]
+        ops = list(self.mix)
+        op_weights = [self.mix[op] for op in ops]
+        plan: List[Tuple[str, int]] = [
+            (op, self._pick_room())
+            for op in self.rng.choices(ops, weights=op_weights, k=operations)
+        ]
+        latencies: Dict[str, List[float]] = {op: [] for op in ops}
+        errors = 0
+
+        gc.collect()
+        memory_before = rss_bytes()
+        clock = time.perf_counter
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = clock()
+            for i, (op, r) in enumerate(plan):
+                room, members, muted = self.rooms[r], self.members[r], self.muted[r]
+                t0 = clock()
+                try:
+                    if op == "send":
+                        room.send_message(self.rng.choice(members), f"message {i}")
+                    elif op == "join":
+                        user = self.rng.choice(self.users)
+                        if user in room.members:
+                            continue
+                        room.add_member(user)
+                        members.append(user)
+                    elif op == "leave":
+                        if len(members) <= 2:
+                            continue
+                        user = members.pop(self.rng.randrange(len(members)))
+                        room.remove_member(user)
+                        muted.discard(user)
+                    elif op == "mute":
+                        user = self.rng.choice(members)
+                        if user in muted:
+                            continue
+                        user.mute_notifications(room)
+                        muted.add(user)
+                    elif op == "unmute":
+                        if not muted:
+                            continue
+                        user = muted.pop()
+                        user.unmute_notifications(room)
+                except Exception:
+                    errors += 1
+                    continue
+                latencies[op].append(clock() - t0)
+            seconds = clock() - start
+        memory_after = rss_bytes()
+        return LoadReport(seconds, latencies, memory_before, memory_after, errors)
+
+
+def main():
+    implementations = {
+        "ChatRoom": ChatRoom,
+        "ChatRoom + digest notifications": lambda name, owner: ChatRoom(
+            name, owner, notification_service=DigestNotificationService.factory()
+        ),
+        "ChatRoom + columnar history": lambda name, owner: ChatRoom(
+            name, owner, messages=ColumnarMessageHistory()
+        ),
+    }
+    for name, factory in implementations.items():
+        test = ChatLoadTest(
+            users=2_000, rooms=200, max_room_size=500, room_factory=factory
+        )
+        print(f"== {name}")
+        print(test.run(operations=20_000))
+
+
+if __name__ == "__main__":
+    main()
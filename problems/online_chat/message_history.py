@@ -0,0 +1,156 @@
+"""
+Segmented, bounded message history for ChatRoom
+
+Messages are numbered with a per-room sequence number and stored in
+fixed-size segments. Only the newest `max_segments` segments are kept in
+memory; older ones are evicted (and handed to `on_evict`, if given, so they
+can be persisted elsewhere).
+
+Paging is cursor based: a cursor is a sequence number and
+`history(before=cursor, limit=n)` only touches the segments holding the
+requested messages.
+"""
+
+from __future__ import annotations
+from collections import deque
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+# (sequence number, sender, message)
+Message = Tuple[int, Any, str]
+
+
+class Segment:
+    """
+    A fixed-size block of consecutive messages starting at sequence `base`
+    """
+
+    def __init__(self, base: int):
+        self.base = base
+        self.messages: List[Tuple[Any, str]] = []
+
+    def append(self, sender, message: str) -> None:
+        self.messages.append((sender, message))
+
+    def get(self, index: int) -> Tuple[Any, str]:
+        return self.messages[index]
+
+    def slice(self, start: int, stop: int) -> List[Tuple[Any, str]]:
+        return self.messages[start:stop]
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+    def __iter__(self) -> Iterator[Tuple[Any, str]]:
+        return iter(self.messages)
+
+
+class Page:
+    """
+    Result of a history query. Pass `cursor` as `before` to get the previous page.
+    `cursor` is None when there is nothing older left in memory.
+    """
+
+    def __init__(self, messages: List[Message], cursor: Optional[int]):
+        self.messages = messages
+        self.cursor = cursor
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self.messages)
+
+    def __len__(self) -> int:
+        return len(self.messages)
+
+
+class MessageHistory:
+    def __init__(
+        self,
+        page_size: int = 256,
+        max_segments: int = 64,
+        on_evict: Callable[[Segment], None] = None,
+    ):
+        if page_size < 1 or max_segments < 1:
+            raise ValueError("page_size and max_segments must be positive")
+        self.page_size = page_size
+        self.max_segments = max_segments
+        self.on_evict = on_evict
+        self.segments: deque[Segment] = deque([self._new_segment(0)])
+        # sequence number the next message will get
+        self.next_seq = 0
+
+    def _new_segment(self, base: int) -> Segment:
+        """
+        Segment factory, overridden by other storage layouts
+        """
+        return Segment(base)
+
+    @property
+    def first_seq(self) -> int:
+        """
+        Sequence number of the oldest message still in memory
+        """
+        return self.segments[0].base
+
+    def append(self, sender, message: str) -> int:
+        """
+        Store a message and return its sequence number
+        """
+        tail = self.segments[-1]
+        if len(tail) == self.page_size:
+            tail = self._new_segment(self.next_seq)
+            self.segments.append(tail)
+            if len(self.segments) > self.max_segments:
+                self.evict(1)
+        tail.append(sender, message)
+        seq = self.next_seq
+        self.next_seq += 1
+        return seq
+
+    def evict(self, count: int) -> None:
+        """
+        Drop the `count` oldest segments (the newest one is always kept)
+        """
+        for _ in range(min(count, len(self.segments) - 1)):
+            segment = self.segments.popleft()
+            if self.on_evict is not None:
+                self.on_evict(segment)
+
+    def get(self, seq: int) -> Optional[Tuple[Any, str]]:
+        if not self.first_seq <= seq < self.next_seq:
+            return None
+        segment = self.segments[(seq - self.first_seq) // self.page_size]
+        return segment.get(seq - segment.base)
+
+    def history(self, before: int = None, limit: int = 50) -> Page:
+        """
+        Up to `limit` messages older than `before` (newest when None),
+        oldest first
+        """
+        end = self.next_seq if before is None else min(before, self.next_seq)
+        start = max(self.first_seq, end - limit)
+        if start >= end:
+            return Page([], None)
+
+        messages: List[Message] = []
+        index = (start - self.first_seq) // self.page_size
+        seq = start
+        while seq < end:
+            segment = self.segments[index]
+            offset = seq - segment.base
+            chunk = segment.slice(offset, offset + end - seq)
+            for sender, message in chunk:
+                messages.append((seq, sender, message))
+                seq += 1
+            index += 1
+
+        cursor = start if start > self.first_seq else None
+        return Page(messages, cursor)
+
+    def __len__(self) -> int:
+        """
+        Number of messages in memory
+        """
+        return self.next_seq - self.first_seq
+
+    def __iter__(self) -> Iterator[Tuple[Any, str]]:
+        for segment in self.segments:
+            yield from segment
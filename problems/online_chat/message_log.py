@@ -0,0 +1,373 @@
+"""
+Persistent, append-only message log for ChatRoom
+
+One MessageLog per room, stored in a directory of segment files named after
+the sequence number of their first message. Record layout:
+
+    crc32 (I) | seq (Q) | sender length (H) | text length (I) | sender | text
+
+- Writes are buffered and committed in groups (one write + fsync per
+  batch). `commit()` forces a group commit; reads and `close()` commit
+  the pending messages first, so a message is never left unwritten
+  just because no more messages arrive.
+- Each segment keeps a sparse in-memory index (every `index_interval`-th
+  record -> file offset), rebuilt by scanning the segment on open. The scan
+  also truncates a torn tail left by a crash.
+- Reads go through read-only memory maps: a page only decodes the records
+  it returns.
+- `expire()` deletes the oldest sealed segments by count, size or age.
+
+PersistentMessageHistory plugs the log under ChatRoom's in-memory
+MessageHistory: recent pages come from memory, older ones from the log.
+Senders read back from disk are names (str), not User objects.
+"""
+
+from __future__ import annotations
+import contextlib
+import io
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+from typing import List, Optional, Tuple
+from message_history import Message, MessageHistory, Page
+from online_chat import ChatRoom, User
+
+HEADER = struct.Struct("<IQHI")
+SUFFIX = ".log"
+
+
+class LogSegment:
+    def __init__(self, path: str, base: int, index_interval: int):
+        self.path = path
+        self.base = base
+        self.index_interval = index_interval
+        self.index_seqs = array("Q")
+        self.index_offsets = array("Q")
+        # bytes durably written
+        self.size = 0
+        self.next_seq = base
+        self.file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._mapped_size = 0
+        self._recover()
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)
+
+    def _recover(self) -> None:
+        """
+        Rebuild the sparse index and cut off any torn or corrupt tail
+        """
+        if not os.path.exists(self.path):
+            open(self.path, "wb").close()
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            crc, seq, sender_len, text_len = HEADER.unpack_from(data, offset)
+            end = offset + HEADER.size + sender_len + text_len
+            if end > len(data) or seq != self.next_seq:
+                break
+            if zlib.crc32(data[offset + 4 : end]) != crc:
+                break
+            self._index(seq, offset)
+            self.next_seq += 1
+            offset = end
+        if offset != len(data):
+            with open(self.path, "r+b") as f:
+                f.truncate(offset)
+        self.size = offset
+
+    def _index(self, seq: int, offset: int) -> None:
+        if (seq - self.base) % self.index_interval == 0:
+            self.index_seqs.append(seq)
+            self.index_offsets.append(offset)
+
+    def open_for_append(self) -> None:
+        self.file = open(self.path, "ab")
+
+    def write(self, data: bytes, records: List[Tuple[int, int]], fsync: bool) -> None:
+        """
+        Durably append `data`. `records` holds the (seq, offset) of each
+        record in it, relative to the start of `data`
+        """
+        self.file.write(data)
+        self.file.flush()
+        if fsync:
+            os.fsync(self.file.fileno())
+        for seq, offset in records:
+            self._index(seq, self.size + offset)
+        self.size += len(data)
+        self.next_seq = records[-1][0] + 1
+
+    def seal(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _view(self) -> Optional[mmap.mmap]:
+        if self.size == 0:
+            return None
+        if self._mmap is None or self._mapped_size != self.size:
+            if self._mmap is not None:
+                self._mmap.close()
+            with open(self.path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ)
+            self._mapped_size = self.size
+        return self._mmap
+
+    def read(self, start: int, limit: int) -> List[Message]:
+        """
+        Up to `limit` records from sequence number `start`
+        """
+        view = self._view()
+        if view is None or start >= self.next_seq or limit <= 0:
+            return []
+        # start may be below the base after expire()
+        i = max(0, bisect_right(self.index_seqs, start) - 1)
+        seq, offset = self.index_seqs[i], self.index_offsets[i]
+        messages: List[Message] = []
+        while offset < self.size and len(messages) < limit:
+            _, seq, sender_len, text_len = HEADER.unpack_from(view, offset)
+            offset += HEADER.size
+            if seq >= start:
+                sender = view[offset : offset + sender_len].decode()
+                text = view[offset + sender_len : offset + sender_len + text_len]
+                messages.append((seq, sender, text.decode()))
+            offset += sender_len + text_len
+        return messages
+
+    def close(self) -> None:
+        self.seal()
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def delete(self) -> None:
+        self.close()
+        os.remove(self.path)
+
+
+class MessageLog:
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        batch_records: int = 256,
+        batch_bytes: int = 1024 * 1024,
+        index_interval: int = 64,
+        fsync: bool = True,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.batch_records = batch_records
+        self.batch_bytes = batch_bytes
+        self.index_interval = index_interval
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+        bases = sorted(
+            int(name[: -len(SUFFIX)])
+            for name in os.listdir(directory)
+            if name.endswith(SUFFIX)
+        )
+        self.segments: List[LogSegment] = [
+            LogSegment(self._path(base), base, index_interval) for base in bases
+        ]
+        if not self.segments:
+            self.segments.append(LogSegment(self._path(0), 0, index_interval))
+        self.active.open_for_append()
+        self.next_seq = self.active.next_seq
+
+        # group commit buffer
+        self._buffer = bytearray()
+        self._buffered: List[Tuple[int, int]] = []
+
+    def _path(self, base: int) -> str:
+        return os.path.join(self.directory, f"{base:020d}{SUFFIX}")
+
+    @property
+    def active(self) -> LogSegment:
+        return self.segments[-1]
+
+    @property
+    def first_seq(self) -> int:
+        return self.segments[0].base
+
+    def append(self, sender: str, text: str) -> int:
+        """
+        Buffer a message and return its sequence number. The message is
+        durable once the batch it belongs to is committed.
+        """
+        sender_bytes = sender.encode()
+        text_bytes = text.encode()
+        seq = self.next_seq
+        body = HEADER.pack(0, seq, len(sender_bytes), len(text_bytes))[4:]
+        body += sender_bytes + text_bytes
+        self._buffered.append((seq, len(self._buffer)))
+        self._buffer += struct.pack("<I", zlib.crc32(body))
+        self._buffer += body
+        self.next_seq += 1
+
+        if (
+            len(self._buffered) >= self.batch_records
+            or len(self._buffer) >= self.batch_bytes
+        ):
+            self.commit()
+        return seq
+
+    def commit(self) -> None:
+        """
+        Write and fsync every buffered message in a single batch
+        """
+        if not self._buffer:
+            return
+        self.active.write(bytes(self._buffer), self._buffered, self.fsync)
+        self._buffer = bytearray()
+        self._buffered = []
+        if self.active.size >= self.segment_bytes:
+            self._roll()
+
+    def _roll(self) -> None:
+        self.active.seal()
+        segment = LogSegment(self._path(self.next_seq), self.next_seq, self.index_interval)
+        segment.open_for_append()
+        self.segments.append(segment)
+
+    def read(self, start: int, limit: int) -> List[Message]:
+        """
+        Up to `limit` messages from sequence number `start`. Commits the
+        pending messages first.
+        """
+        self.commit()
+        start = max(start, self.first_seq)
+        messages: List[Message] = []
+        i = bisect_right([s.base for s in self.segments], start) - 1
+        for segment in self.segments[i:]:
+            if len(messages) >= limit:
+                break
+            messages.extend(segment.read(start, limit - len(messages)))
+            if messages:
+                start = messages[-1][0] + 1
+        return messages
+
+    def expire(
+        self,
+        max_segments: int = None,
+        max_bytes: int = None,
+        max_age: float = None,
+    ) -> int:
+        """
+        Delete the oldest sealed segments until the log is within the
+        retention policy. The active segment is never deleted.
+        Returns the number of segments deleted.
+        """
+        deleted = 0
+        now = time.time()
+        while len(self.segments) > 1:
+            oldest = self.segments[0]
+            total = sum(s.size for s in self.segments)
+            if (
+                (max_segments is not None and len(self.segments) > max_segments)
+                or (max_bytes is not None and total > max_bytes)
+                or (
+                    max_age is not None
+                    and now - os.path.getmtime(oldest.path) > max_age
+                )
+            ):
+                self.segments.pop(0).delete()
+                deleted += 1
+            else:
+                break
+        return deleted
+
+    def close(self) -> None:
+        self.commit()
+        for segment in self.segments:
+            segment.close()
+
+
+class PersistentMessageHistory(MessageHistory):
+    """
+    MessageHistory backed by a MessageLog. Memory keeps the newest
+    segments, pages older than that are read from the log.
+    """
+
+    def __init__(self, log: MessageLog, page_size: int = 256, max_segments: int = 64):
+        super().__init__(page_size, max_segments)
+        self.log = log
+        self.segments.clear()
+        self.segments.append(self._new_segment(log.next_seq))
+        self.next_seq = log.next_seq
+
+    def append(self, sender, message: str) -> int:
+        seq = self.log.append(str(sender), message)
+        super().append(sender, message)
+        return seq
+
+    def get(self, seq: int):
+        record = super().get(seq)
+        if record is not None:
+            return record
+        found = self.log.read(seq, 1)
+        if found and found[0][0] == seq:
+            return found[0][1], found[0][2]
+        return None
+
+    def history(self, before: int = None, limit: int = 50) -> Page:
+        end = self.next_seq if before is None else min(before, self.next_seq)
+        start = max(self.log.first_seq, end - limit)
+        if start >= self.first_seq:
+            return super().history(before, limit)
+        if start >= end:
+            return Page([], None)
+        messages = self.log.read(start, end - start)
+        cursor = start if start > self.log.first_seq else None
+        return Page(messages, cursor)
+
+
+def main():
+    directory = tempfile.mkdtemp(prefix="chatlog-")
+    user = User("user1")
+
+    log = MessageLog(directory, segment_bytes=64 * 1024)
+    with contextlib.redirect_stdout(io.StringIO()):
+        chat = ChatRoom(
+            "chat1", user, messages=PersistentMessageHistory(log, max_segments=4)
+        )
+        count = 20_000
+        start = time.perf_counter()
+        for i in range(count):
+            chat.send_message(user, f"message number {i}")
+        log.commit()
+        elapsed = time.perf_counter() - start
+    print(f"appended {count} messages in {elapsed:.2f}s over {len(log.segments)} segments")
+    log.close()
+
+    # "restart": reopen the log and page through history from disk
+    log = MessageLog(directory, segment_bytes=64 * 1024)
+    history = PersistentMessageHistory(log, max_segments=4)
+    print(f"recovered next_seq={log.next_seq}")
+    page = history.history(before=10_000, limit=3)
+    print([text for _, _, text in page], "cursor", page.cursor)
+
+    deleted = log.expire(max_segments=5)
+    print(f"expired {deleted} segments, oldest message now {log.first_seq}")
+    print("page before expired range:", history.history(before=100, limit=3).messages)
+
+    # a single message under low traffic is written by the next read
+    seq = log.append("user1", "anyone there?")
+    log.read(seq, 1)
+    print("on disk after a read:", MessageLog(directory).read(seq, 1))
+    log.close()
+
+
+if __name__ == "__main__":
+    main()
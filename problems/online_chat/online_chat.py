@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import Set, List
+from typing import Callable, Dict, Set, List
+from message_history import MessageHistory, Page
 
 
 class User:
@@ -14,10 +15,15 @@ class User:
         self.friends: Set[User] = set()
         self.chats: Set[ChatRoom] = set()
         self.friend_requests: Set[User] = set()
+        # reverse of friend_requests: users this user sent a request to
+        self.sent_friend_requests: Set[User] = set()
         self.chat_invites: Set[ChatRoom] = set()
         self.notifications: List[str] = []
+        # per chat, sequence number of the first message not read yet
+        self.read_cursors: Dict[ChatRoom, int] = {}
 
     def send_friend_request(self, user: User) -> None:
+        self.sent_friend_requests.add(user)
         user.queue_friend_request(self)
 
     def queue_friend_request(self, user: User) -> None:
@@ -38,20 +44,42 @@ class User:
             raise Exception(f"Friend Request Error {user} did not send a request")
         user.friends.add(self)
         self.friends.add(user)
-        self.friend_requests.pop(user)
+        self.friend_requests.remove(user)
+        user.sent_friend_requests.discard(self)
+        OnlineChatSingleton.get_instance().friendship_added(self, user)
 
     def remove_friend(self, user: User) -> None:
         if user not in self.friends:
             raise Exception(f"{user.name} is not a friend of {self.name}")
+        # friendships are symmetric, unfriending removes both sides
         self.friends.remove(user)
+        user.friends.discard(self)
+        OnlineChatSingleton.get_instance().friendship_removed(self, user)
 
     def join_chat(self, chat: ChatRoom):
         self.chats.add(chat)
+        # only messages sent after joining are unread
+        self.read_cursors[chat] = chat.messages.next_seq
 
     def leave_chat(self, chat: ChatRoom):
         if chat not in self.chats:
             raise Exception(f"User is not a member of {chat.name}")
         self.chats.remove(chat)
+        self.read_cursors.pop(chat, None)
+
+    def unread_count(self, chat: ChatRoom) -> int:
+        if chat not in self.chats:
+            raise Exception(f"User {self} not a member of {chat}")
+        return chat.messages.next_seq - self.read_cursors[chat]
+
+    def unread_counts(self) -> Dict[ChatRoom, int]:
+        """
+        Unread badge of every chat of the user, O(number of chats)
+        """
+        return {
+            chat: chat.messages.next_seq - cursor
+            for chat, cursor in self.read_cursors.items()
+        }
 
     def mute_notifications(self, chat: ChatRoom):
         if chat not in self.chats:
@@ -72,11 +100,23 @@ class ChatRoom:
     ChatRoom for chats. IM and Group chats are implemented the same way
     """
 
-    def __init__(self, name: str, user: User):
+    def __init__(
+        self,
+        name: str,
+        user: User,
+        messages: MessageHistory = None,
+        notification_service: Callable[[ChatRoom], NotificationService] = None,
+        search_index=None,
+    ):
         self.name = name
         self.members: Set[User] = set()
-        self.messages: list[tuple[User, str]] = []
-        self.notification_service: NotificationService = NotificationService(self)
+        self.messages: MessageHistory = (
+            messages if messages is not None else MessageHistory()
+        )
+        # optional search_index.SearchIndex updated on every message
+        self.search_index = search_index
+        factory = notification_service or NotificationService
+        self.notification_service: NotificationService = factory(self)
         self.add_member(user)
 
     def invite_friends(self, inviter: User, users: List[User]):
@@ -84,7 +124,12 @@ class ChatRoom:
             user.queue_chat_invite(self)
 
     def send_message(self, user: User, message):
-        self.messages.append((user, message))
+        seq = self.messages.append(user, message)
+        # the sender has read everything up to their own message
+        if self in user.read_cursors:
+            user.read_cursors[self] = seq + 1
+        if self.search_index is not None:
+            self.search_index.add(self, user, seq, message)
         print(f"ChatRoom {self}: {user} sent a message")
         self.notification_service.notify(user)
 
@@ -92,7 +137,9 @@ class ChatRoom:
         if user not in self.members:
             raise Exception(f"{user.name} not in {self.name}")
         self.members.remove(user)
-        self.notification_service.remove(user)
+        if user in self.notification_service.subscribers:
+            self.notification_service.remove_user(user)
+        user.leave_chat(self)
         print(f"ChatRoom {self}: {user} removed")
 
     def add_member(self, user: User):
@@ -103,9 +150,33 @@ class ChatRoom:
         user.join_chat(self)
         print(f"ChatRoom {self}: {user} joined chat")
 
-    def print_chat(self):
+    def mark_read(self, user: User, upto: int = None) -> None:
+        """
+        User has read the room up to message `upto` (inclusive), or up to
+        the latest message when None. Read cursors never move backwards.
+        """
+        if user not in self.members:
+            raise Exception(f"{user.name} not in {self.name}")
+        cursor = self.messages.next_seq if upto is None else upto + 1
+        if cursor > user.read_cursors[self]:
+            user.read_cursors[self] = min(cursor, self.messages.next_seq)
+        self.notification_service.mark_read(user, upto)
+
+    def read_by(self, seq: int) -> Set[User]:
+        """
+        Read receipts: members who have read message `seq`
+        """
+        return {user for user in self.members if user.read_cursors[self] > seq}
+
+    def history(self, before: int = None, limit: int = 50) -> Page:
+        """
+        Page of messages older than the `before` cursor, newest page when None
+        """
+        return self.messages.history(before, limit)
+
+    def print_chat(self, limit: int = 50):
         messages = []
-        for sender, message in self.messages:
+        for _, sender, message in self.history(limit=limit):
             messages.append(f"{sender}: {message}")
         print("\n".join(messages))
 
@@ -122,7 +193,9 @@ class OnlineChatSingleton:
 
     def __init__(self):
         self.users: Set[User] = set()
-        self.chats: Set[User] = set()
+        self.chats: Set[ChatRoom] = set()
+        # observers of the friendship graph, e.g. FriendSuggestions
+        self.friendship_listeners: List = []
 
     @staticmethod
     def get_instance():
@@ -133,14 +206,37 @@ class OnlineChatSingleton:
     def create_user(self, user: User) -> None:
         self.users.add(user)
 
+    def add_friendship_listener(self, listener) -> None:
+        self.friendship_listeners.append(listener)
+
+    def friendship_added(self, a: User, b: User) -> None:
+        for listener in self.friendship_listeners:
+            listener.friendship_added(a, b)
+
+    def friendship_removed(self, a: User, b: User) -> None:
+        for listener in self.friendship_listeners:
+            listener.friendship_removed(a, b)
+
     def remove_user(self, user: User) -> None:
         if user not in self.users:
             raise Exception(f"User {user.name} not in the system")
         self.users.remove(user)
 
-        for friend in self.users:
-            if user in friend.friends:
-                friend.remove_friend(user)
+        # friendships are symmetric and User keeps the reverse indexes
+        # (sent requests, chats), so this is O(degree + rooms)
+        for friend in list(user.friends):
+            friend.remove_friend(user)
+
+        for receiver in user.sent_friend_requests:
+            receiver.friend_requests.discard(user)
+        for sender in user.friend_requests:
+            sender.sent_friend_requests.discard(user)
+        user.sent_friend_requests.clear()
+        user.friend_requests.clear()
+
+        for chat in list(user.chats):
+            chat.remove_member(user)
+        user.chat_invites.clear()
 
     def create_chat(self, chat: ChatRoom):
         self.chats.add(chat)
@@ -184,6 +280,14 @@ class NotificationService:
         self.subscribers.remove(user)
         print(f"NotificationService: {user} removed {self.chat} Notifications")
 
+    def mark_read(self, user: User, upto: int = None) -> None:
+        """
+        `user` read the room up to message `upto` (latest when None), the
+        read cursor is already moved. Notifications are sent right away so
+        there is nothing to cancel.
+        """
+        pass
+
 
 def main():
     # create chat singleton
@@ -228,6 +332,28 @@ def main():
     # print chat
     chat1.print_chat()
 
+    # unread badges and read receipts
+    print(user2.unread_counts())
+    chat1.mark_read(user2)
+    print(user2.unread_counts(), chat1.read_by(chat1.messages.next_seq - 1))
+
+    # friends, then user3 leaves the system
+    for user in (user1, user2, user3):
+        online_chat.create_user(user)
+    user3.send_friend_request(user1)
+    user1.accept_friend_request(user3)
+    user3.send_friend_request(user2)
+    online_chat.remove_user(user3)
+    print(user1.friends, user2.friend_requests, chat1.members)
+
+    # page through the history, two messages at a time
+    page = chat1.history(limit=2)
+    while page.messages:
+        print([message for _, _, message in page])
+        if page.cursor is None:
+            break
+        page = chat1.history(before=page.cursor, limit=2)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,352 @@
+"""
+Incremental full-text search over chat messages
+
+Every message sent in a ChatRoom with a SearchIndex is tokenized and added
+to an inverted index: term -> posting list of (document, positions).
+Document ids increase with time, so newer messages have larger ids.
+
+Posting lists are compressed in blocks of `BLOCK_SIZE` documents with delta
++ varint encoding. The first document of each block is kept uncompressed as
+a skip index, which gives:
+- newest-first iteration that stops after k hits (top-k by recency)
+- membership tests that decode a single block (intersection, phrases)
+
+Room and sender of each document live in flat integer arrays, and each
+room / sender also keeps the ascending list of its documents. A query is
+driven by its most selective list, a term's postings or the documents of
+the room or sender it is filtered on, and the other lists are lookups.
+"""
+
+from __future__ import annotations
+import contextlib
+import io
+import random
+import re
+import time
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterator, List, Optional, Tuple
+from online_chat import ChatRoom, User
+
+TOKEN = re.compile(r"\w+")
+
+# (document id, positions of the term in the message)
+Posting = Tuple[int, List[int]]
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.lower())
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, i: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[i]
+        i += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, i
+        shift += 7
+
+
+class PostingList:
+    BLOCK_SIZE = 128
+
+    def __init__(self):
+        # sealed blocks and the first document id of each
+        self.blocks: List[bytes] = []
+        self.block_first = array("Q")
+        # open block, not compressed yet
+        self.tail: List[Posting] = []
+        self.count = 0
+        # last block decoded by find(), queries walk documents in order so
+        # consecutive lookups usually land in the same block
+        self._cached_index = -1
+        self._cached: List[Posting] = []
+
+    def add(self, doc: int, positions: List[int]) -> None:
+        self.tail.append((doc, positions))
+        self.count += 1
+        if len(self.tail) == self.BLOCK_SIZE:
+            self._seal()
+
+    def _seal(self) -> None:
+        out = bytearray()
+        prev = self.tail[0][0]
+        for doc, positions in self.tail:
+            _write_varint(out, doc - prev)
+            prev = doc
+            _write_varint(out, len(positions))
+            last = 0
+            for position in positions:
+                _write_varint(out, position - last)
+                last = position
+        self.blocks.append(bytes(out))
+        self.block_first.append(self.tail[0][0])
+        self.tail = []
+
+    def _decode(self, index: int) -> List[Posting]:
+        data = self.blocks[index]
+        doc = self.block_first[index]
+        postings = []
+        i = 0
+        while i < len(data):
+            delta, i = _read_varint(data, i)
+            doc += delta
+            n, i = _read_varint(data, i)
+            positions = []
+            position = 0
+            for _ in range(n):
+                step, i = _read_varint(data, i)
+                position += step
+                positions.append(position)
+            postings.append((doc, positions))
+        return postings
+
+    def newest_first(self) -> Iterator[Posting]:
+        yield from reversed(self.tail)
+        for index in range(len(self.blocks) - 1, -1, -1):
+            yield from reversed(self._decode(index))
+
+    def find(self, doc: int) -> Optional[List[int]]:
+        """
+        Positions of the term in `doc`, None if the term is not in it
+        """
+        if self.tail and doc >= self.tail[0][0]:
+            postings = self.tail
+        else:
+            index = bisect_right(self.block_first, doc) - 1
+            if index < 0:
+                return None
+            if index != self._cached_index:
+                self._cached = self._decode(index)
+                self._cached_index = index
+            postings = self._cached
+        lo, hi = 0, len(postings)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if postings[mid][0] < doc:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(postings) and postings[lo][0] == doc:
+            return postings[lo][1]
+        return None
+
+    def size_in_bytes(self) -> int:
+        return sum(len(block) for block in self.blocks)
+
+
+class SearchHit:
+    def __init__(self, chat: ChatRoom, sender: User, seq: int):
+        self.chat = chat
+        self.sender = sender
+        self.seq = seq
+
+    @property
+    def message(self) -> Optional[str]:
+        """
+        Text of the message, None once it left the room's in-memory history
+        """
+        record = self.chat.messages.get(self.seq)
+        return None if record is None else record[1]
+
+    def __repr__(self) -> str:
+        return f"SearchHit({self.chat}#{self.seq} {self.sender}: {self.message!r})"
+
+
+class SearchIndex:
+    def __init__(self):
+        self.terms: Dict[str, PostingList] = {}
+        self.rooms: List[ChatRoom] = []
+        self.senders: List[User] = []
+        self._room_ids: Dict[ChatRoom, int] = {}
+        self._sender_ids: Dict[User, int] = {}
+        # per document
+        self.doc_room = array("I")
+        self.doc_sender = array("I")
+        self.doc_seq = array("Q")
+        # per room / sender id, its documents in ascending order
+        self.room_docs: List[array] = []
+        self.sender_docs: List[array] = []
+
+    def _room_id(self, chat: ChatRoom) -> int:
+        room_id = self._room_ids.get(chat)
+        if room_id is None:
+            room_id = self._room_ids[chat] = len(self.rooms)
+            self.rooms.append(chat)
+            self.room_docs.append(array("Q"))
+        return room_id
+
+    def _sender_id(self, user: User) -> int:
+        sender_id = self._sender_ids.get(user)
+        if sender_id is None:
+            sender_id = self._sender_ids[user] = len(self.senders)
+            self.senders.append(user)
+            self.sender_docs.append(array("Q"))
+        return sender_id
+
+    def __len__(self) -> int:
+        return len(self.doc_seq)
+
+    def add(self, chat: ChatRoom, sender: User, seq: int, text: str) -> None:
+        doc = len(self.doc_seq)
+        room_id = self._room_id(chat)
+        sender_id = self._sender_id(sender)
+        self.doc_room.append(room_id)
+        self.doc_sender.append(sender_id)
+        self.doc_seq.append(seq)
+        self.room_docs[room_id].append(doc)
+        self.sender_docs[sender_id].append(doc)
+
+        positions: Dict[str, List[int]] = {}
+        for position, term in enumerate(tokenize(text)):
+            positions.setdefault(term, []).append(position)
+        for term, term_positions in positions.items():
+            postings = self.terms.get(term)
+            if postings is None:
+                postings = self.terms[term] = PostingList()
+            postings.add(doc, term_positions)
+
+    def search(
+        self,
+        query: str,
+        chat: ChatRoom = None,
+        sender: User = None,
+        k: int = 10,
+        phrase: bool = False,
+    ) -> List[SearchHit]:
+        """
+        Newest `k` messages containing every term of `query` (in order and
+        adjacent when `phrase` is True), optionally in one room / by one sender
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        postings = [self.terms.get(term) for term in terms]
+        if any(p is None for p in postings):
+            return []
+
+        room_id = sender_id = None
+        if chat is not None:
+            room_id = self._room_ids.get(chat)
+            if room_id is None:
+                return []
+        if sender is not None:
+            sender_id = self._sender_ids.get(sender)
+            if sender_id is None:
+                return []
+
+        # drive the query with the most selective list, the rarest term or
+        # the documents of the room / sender filtered on
+        driver = min(range(len(terms)), key=lambda i: postings[i].count)
+        candidates: Iterator[Tuple[int, Optional[List[int]]]]
+        candidates = postings[driver].newest_first()
+        selective = postings[driver].count
+        for docs in (
+            self.room_docs[room_id] if room_id is not None else None,
+            self.sender_docs[sender_id] if sender_id is not None else None,
+        ):
+            if docs is not None and len(docs) < selective:
+                candidates = ((doc, None) for doc in reversed(docs))
+                selective = len(docs)
+                driver = -1
+        hits: List[SearchHit] = []
+        for doc, positions in candidates:
+            if room_id is not None and self.doc_room[doc] != room_id:
+                continue
+            if sender_id is not None and self.doc_sender[doc] != sender_id:
+                continue
+            if not self._matches(doc, terms, postings, driver, positions, phrase):
+                continue
+            hits.append(
+                SearchHit(
+                    self.rooms[self.doc_room[doc]],
+                    self.senders[self.doc_sender[doc]],
+                    self.doc_seq[doc],
+                )
+            )
+            if len(hits) == k:
+                break
+        return hits
+
+    @staticmethod
+    def _matches(
+        doc: int,
+        terms: List[str],
+        postings: List[PostingList],
+        driver: int,
+        driver_positions: List[int],
+        phrase: bool,
+    ) -> bool:
+        # phrase start candidates, from the driver term's offset in the
+        # phrase; driver is -1 when a room / sender list drives the query
+        starts = None
+        if phrase and driver >= 0:
+            starts = {p - driver for p in driver_positions}
+        for i, posting_list in enumerate(postings):
+            if i == driver:
+                continue
+            positions = posting_list.find(doc)
+            if positions is None:
+                return False
+            if phrase:
+                offsets = {p - i for p in positions}
+                starts = offsets if starts is None else starts & offsets
+                if not starts:
+                    return False
+        return True
+
+
+def main():
+    index = SearchIndex()
+    words = (
+        "deploy release build test failed passed merge review coffee lunch "
+        "meeting tomorrow today the a is on at please check logs server"
+    ).split()
+    rng = random.Random(0)
+
+    users = [User(f"user{i}") for i in range(20)]
+    # sends one message in a thousand
+    rare = User("rare")
+    with contextlib.redirect_stdout(io.StringIO()):
+        rooms = [ChatRoom(f"room{i}", users[i], search_index=index) for i in range(10)]
+        count = 200_000
+        start = time.perf_counter()
+        for i in range(count):
+            text = " ".join(rng.choice(words) for _ in range(rng.randint(3, 12)))
+            sender = rare if rng.random() < 0.001 else users[rng.randrange(20)]
+            rooms[i % 10].send_message(sender, text)
+        indexing = time.perf_counter() - start
+
+    compressed = sum(p.size_in_bytes() for p in index.terms.values())
+    print(f"indexed {count} messages in {indexing:.1f}s, postings {compressed / 1e6:.1f}MB")
+
+    queries = [
+        ("deploy failed", {}),
+        ("deploy failed", {"chat": rooms[3]}),
+        ("deploy failed", {"chat": rooms[3], "sender": users[7]}),
+        ("the", {"chat": rooms[3], "sender": rare}),
+        ("check the server logs", {"phrase": False}),
+        ("check the logs", {"phrase": True}),
+        ("check the logs", {"phrase": True, "chat": rooms[3], "sender": rare}),
+    ]
+    for query, kwargs in queries:
+        start = time.perf_counter()
+        hits = index.search(query, k=5, **kwargs)
+        elapsed = (time.perf_counter() - start) * 1e3
+        filters = {k: str(v) for k, v in kwargs.items()}
+        print(f"{query!r} {filters}: {len(hits)} hits in {elapsed:.2f}ms")
+        if hits:
+            print(f"  newest: {hits[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Process-sharded chat rooms
+
+ShardedChat hash-partitions rooms over a pool of worker processes, each one
+running its own rooms with the regular ChatRoom / User classes. Users are
+identified by name across processes and also have a home shard (by the
+same hash), which keeps their notifications.
+
+The router in the parent process:
+- buffers commands per shard and sends them in batches over a Pipe, so
+  many commands share one round trip (pipelining)
+- forwards the notifications each shard produced, again in batches, to the
+  home shards of the recipients (cross-shard delivery)
+
+A room's shard groups each message's fan-out by target shard: one entry
+(sender, text, recipient names) per target shard, and the target shard
+expands it to the recipients. The names tuple of a room is cached, so
+pickle sends it once per batch, and the router never touches individual
+recipients.
+
+Only `sync()` and calls that need an answer wait for the shards. Commands
+are fire-and-forget unless their Reply is read: `close()` raises if any
+command failed and its Reply was never read, so those errors are not lost.
+"""
+
+from __future__ import annotations
+import contextlib
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+import zlib
+from multiprocessing.connection import Connection
+from typing import Any, Dict, List, Tuple
+from online_chat import ChatRoom, NotificationService, User
+
+Command = Tuple[Any, ...]
+# (sender, text, names of the recipients on the target shard)
+Fanout = Tuple[str, str, Tuple[str, ...]]
+
+
+def shard_for(name: str, num_shards: int) -> int:
+    # crc32 is stable across processes, unlike hash() on str
+    return zlib.crc32(name.encode()) % num_shards
+
+
+class ShardNotificationService(NotificationService):
+    """
+    Collects notifications in the shard's outbox, one entry per target
+    shard, instead of printing them
+    """
+
+    def __init__(self, chat: ChatRoom, outbox: Dict[int, List[Fanout]], num_shards: int):
+        super().__init__(chat)
+        self.outbox = outbox
+        self.num_shards = num_shards
+        # target shard -> subscriber names, rebuilt when subscribers change
+        self._targets: Dict[int, Tuple[str, ...]] = None
+
+    def notify(self, user: User):
+        if self._targets is None:
+            targets: Dict[int, List[str]] = {}
+            for sub in self.subscribers:
+                targets.setdefault(shard_for(sub.name, self.num_shards), []).append(sub.name)
+            self._targets = {shard: tuple(names) for shard, names in targets.items()}
+        text = f"{user.name} sent a message in {self.chat.name}"
+        for shard, names in self._targets.items():
+            if len(names) > 1 or names[0] != user.name:
+                self.outbox.setdefault(shard, []).append((user.name, text, names))
+
+    def add_user(self, user: User):
+        if user in self.subscribers:
+            raise Exception(f"{user} already subscribed")
+        self.subscribers.add(user)
+        self._targets = None
+
+    def remove_user(self, user: User):
+        if user not in self.subscribers:
+            raise Exception(f"{user} not subscribed")
+        self.subscribers.remove(user)
+        self._targets = None
+
+
+class Shard:
+    """
+    State of one worker process
+    """
+
+    def __init__(self, num_shards: int):
+        self.num_shards = num_shards
+        self.rooms: Dict[str, ChatRoom] = {}
+        self.users: Dict[str, User] = {}
+        self.outbox: Dict[int, List[Fanout]] = {}
+        self.messages = 0
+
+    def user(self, name: str) -> User:
+        user = self.users.get(name)
+        if user is None:
+            user = self.users[name] = User(name)
+        return user
+
+    def handle(self, command: Command):
+        op, *args = command
+        if op == "send":
+            room, sender, text = args
+            self.rooms[room].send_message(self.user(sender), text)
+            self.messages += 1
+        elif op == "create_room":
+            room, owner = args
+            if room in self.rooms:
+                raise Exception(f"{room} already exists")
+            self.rooms[room] = ChatRoom(
+                room,
+                self.user(owner),
+                notification_service=lambda chat: ShardNotificationService(
+                    chat, self.outbox, self.num_shards
+                ),
+            )
+        elif op == "join":
+            room, name = args
+            self.rooms[room].add_member(self.user(name))
+        elif op == "leave":
+            room, name = args
+            self.rooms[room].remove_member(self.user(name))
+        elif op == "mute":
+            room, name = args
+            self.user(name).mute_notifications(self.rooms[room])
+        elif op == "unmute":
+            room, name = args
+            self.user(name).unmute_notifications(self.rooms[room])
+        elif op == "deliver":
+            for sender, text, names in args[0]:
+                for name in names:
+                    if name != sender:
+                        self.user(name).notifications.append(text)
+        elif op == "notifications":
+            return list(self.user(args[0]).notifications)
+        elif op == "history":
+            room, limit = args
+            return [(s.name, m) for _, s, m in self.rooms[room].history(limit=limit)]
+        elif op == "stats":
+            return {"pid": os.getpid(), "rooms": len(self.rooms), "messages": self.messages}
+        else:
+            raise Exception(f"Unknown command {op}")
+
+
+def _shard_main(conn: Connection, num_shards: int) -> None:
+    # ChatRoom and User print on every change, silence the workers
+    sys.stdout = open(os.devnull, "w")
+    shard = Shard(num_shards)
+    while True:
+        batch: List[Command] = conn.recv()
+        if batch is None:
+            break
+        results = []
+        for command in batch:
+            try:
+                results.append(shard.handle(command))
+            except Exception as e:
+                results.append(e)
+        conn.send((results, shard.outbox))
+        shard.outbox.clear()
+    conn.close()
+
+
+class Reply:
+    """
+    Result of a routed command, filled in when the shard answers
+    """
+
+    _EMPTY = object()
+
+    def __init__(self):
+        self._value = Reply._EMPTY
+        self.read = False
+
+    @property
+    def ready(self) -> bool:
+        return self._value is not Reply._EMPTY
+
+    def result(self):
+        if not self.ready:
+            raise Exception("reply not received yet, call ShardedChat.sync()")
+        self.read = True
+        if isinstance(self._value, Exception):
+            raise self._value
+        return self._value
+
+
+class ShardedChat:
+    def __init__(self, num_shards: int = None, batch_size: int = 512):
+        self.num_shards = num_shards or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self._conns: List[Connection] = []
+        self._processes: List[multiprocessing.Process] = []
+        # answers are drained by one reader thread per shard, so a shard
+        # never blocks on a full pipe while the router is sending to it
+        self._answers: List[queue.Queue] = []
+        self._readers: List[threading.Thread] = []
+        for _ in range(self.num_shards):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_shard_main, args=(child, self.num_shards), daemon=True
+            )
+            process.start()
+            child.close()
+            self._conns.append(parent)
+            self._processes.append(process)
+        for conn in self._conns:
+            answers = queue.Queue()
+            reader = threading.Thread(target=self._read, args=(conn, answers), daemon=True)
+            reader.start()
+            self._answers.append(answers)
+            self._readers.append(reader)
+        self._buffers: List[List[Command]] = [[] for _ in range(self.num_shards)]
+        self._buffer_replies: List[List[Reply]] = [[] for _ in range(self.num_shards)]
+        # replies of batches sent but not answered yet, per shard
+        self._in_flight: List[List[List[Reply]]] = [[] for _ in range(self.num_shards)]
+        # replies holding an exception, reported by close() unless read
+        self._failed: List[Reply] = []
+
+    def shard_for(self, name: str) -> int:
+        return shard_for(name, self.num_shards)
+
+    @staticmethod
+    def _read(conn: Connection, answers: queue.Queue) -> None:
+        with contextlib.suppress(EOFError, OSError):
+            while True:
+                answers.put(conn.recv())
+
+    def _route(self, shard: int, command: Command) -> Reply:
+        reply = Reply()
+        self._buffers[shard].append(command)
+        self._buffer_replies[shard].append(reply)
+        if len(self._buffers[shard]) >= self.batch_size:
+            self._send(shard)
+        return reply
+
+    def _send(self, shard: int) -> None:
+        if not self._buffers[shard]:
+            return
+        self._conns[shard].send(self._buffers[shard])
+        self._in_flight[shard].append(self._buffer_replies[shard])
+        self._buffers[shard] = []
+        self._buffer_replies[shard] = []
+        # forward notifications of answers that already arrived
+        while self._in_flight[shard] and not self._answers[shard].empty():
+            self._receive(shard)
+
+    def _receive(self, shard: int) -> None:
+        results, outbox = self._answers[shard].get()
+        for reply, result in zip(self._in_flight[shard].pop(0), results):
+            reply._value = result
+            if isinstance(result, Exception):
+                self._failed.append(reply)
+        self._forward(outbox)
+
+    def _forward(self, outbox: Dict[int, List[Fanout]]) -> None:
+        for shard, fanouts in outbox.items():
+            self._route(shard, ("deliver", fanouts))
+
+    def sync(self) -> None:
+        """
+        Send every buffered command and wait until all of them, and the
+        notifications they caused, are processed
+        """
+        while True:
+            for shard in range(self.num_shards):
+                self._send(shard)
+            pending = [s for s in range(self.num_shards) if self._in_flight[s]]
+            if not pending:
+                return
+            for shard in pending:
+                while self._in_flight[shard]:
+                    self._receive(shard)
+
+    def create_chat(self, room: str, owner: str) -> Reply:
+        return self._route(self.shard_for(room), ("create_room", room, owner))
+
+    def add_member(self, room: str, user: str) -> Reply:
+        return self._route(self.shard_for(room), ("join", room, user))
+
+    def remove_member(self, room: str, user: str) -> Reply:
+        return self._route(self.shard_for(room), ("leave", room, user))
+
+    def mute_notifications(self, room: str, user: str) -> Reply:
+        return self._route(self.shard_for(room), ("mute", room, user))
+
+    def unmute_notifications(self, room: str, user: str) -> Reply:
+        return self._route(self.shard_for(room), ("unmute", room, user))
+
+    def send_message(self, room: str, user: str, message: str) -> Reply:
+        return self._route(self.shard_for(room), ("send", room, user, message))
+
+    def _call(self, shard: int, command: Command):
+        reply = self._route(shard, command)
+        self.sync()
+        return reply.result()
+
+    def notifications(self, user: str) -> List[str]:
+        return self._call(self.shard_for(user), ("notifications", user))
+
+    def history(self, room: str, limit: int = 50) -> List[Tuple[str, str]]:
+        return self._call(self.shard_for(room), ("history", room, limit))
+
+    def stats(self) -> List[dict]:
+        replies = [self._route(s, ("stats",)) for s in range(self.num_shards)]
+        self.sync()
+        return [reply.result() for reply in replies]
+
+    def close(self) -> None:
+        self.sync()
+        for conn in self._conns:
+            conn.send(None)
+        for process in self._processes:
+            process.join()
+        # the readers stop on EOF, close the pipes once they are done with them
+        for reader in self._readers:
+            reader.join()
+        for conn in self._conns:
+            conn.close()
+        unread = [reply._value for reply in self._failed if not reply.read]
+        self._failed = []
+        if unread:
+            raise Exception(
+                f"{len(unread)} command(s) failed without their reply being read, "
+                f"first: {unread[0]!r}"
+            )
+
+
+def run(num_shards: int, rooms: int = 64, members: int = 10, messages: int = 100_000) -> None:
+    chat = ShardedChat(num_shards)
+    for r in range(rooms):
+        chat.create_chat(f"room{r}", f"user{r}")
+        for m in range(1, members):
+            chat.add_member(f"room{r}", f"user{(r + m * 7) % (rooms * 4)}")
+    chat.sync()
+
+    start = time.perf_counter()
+    for i in range(messages):
+        r = i % rooms
+        chat.send_message(f"room{r}", f"user{r}", f"message {i}")
+    chat.sync()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{num_shards} shard(s): {messages / elapsed:,.0f} messages/s, "
+        f"user7 has {len(chat.notifications('user7'))} notifications"
+    )
+    chat.close()
+
+
+def main():
+    print(f"{os.cpu_count()} cores")
+    for num_shards in sorted({1, 2, os.cpu_count() or 1}):
+        run(num_shards)
+
+    # a fire-and-forget command fails in its shard, close() reports it
+    chat = ShardedChat(1)
+    chat.send_message("missing room", "user0", "hello")
+    try:
+        chat.close()
+    except Exception as e:
+        print(e)
+
+
+if __name__ == "__main__":
+    with contextlib.suppress(KeyboardInterrupt):
+        main()
@@ -0,0 +1,194 @@
+"""
+Metrics for ParkingLot events
+
+ParkingLotMetrics is a ParkingLotListener that keeps counters and latency
+histograms of park, reject and vacate events per floor and vehicle type.
+Detaching it (or never attaching it) turns everything off: ParkingLot does
+not even read the clock while it has no listeners.
+
+PeriodicExporter pushes snapshots to a sink from a background thread.
+"""
+
+from __future__ import annotations
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+from parking_lot import (
+    Bus,
+    Floor,
+    LargeCar,
+    Motorcycle,
+    ParkingLot,
+    ParkingLotListener,
+    Vehicle,
+)
+
+# (event, floor, vehicle type), floor is None for rejections
+MetricKey = Tuple[str, Optional[int], str]
+
+
+class LatencyHistogram:
+    """
+    Histogram with exponential buckets from 1us to ~1s (upper bounds in seconds)
+    """
+
+    BOUNDS: List[float] = [1e-6 * 2**i for i in range(21)]
+
+    def __init__(self):
+        self.buckets: List[int] = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.buckets[bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile(self, pct: float) -> float:
+        """
+        Upper bound of the bucket holding the given percentile, in seconds
+        """
+        if not self.count:
+            return 0.0
+        rank = self.count * pct / 100
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else float("inf")
+        return float("inf")
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class ParkingLotMetrics(ParkingLotListener):
+    def __init__(self):
+        # recording takes no lock: readers copy the dict, which is atomic
+        # under the GIL, and tolerate a count being one event behind
+        self.histograms: Dict[MetricKey, LatencyHistogram] = {}
+
+    def _record(self, key: MetricKey, seconds: float) -> None:
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def on_park(self, floor: int, vehicle: Vehicle, seconds: float) -> None:
+        self._record(("park", floor, type(vehicle).__name__), seconds)
+
+    def on_reject(self, vehicle: Vehicle, seconds: float) -> None:
+        self._record(("reject", None, type(vehicle).__name__), seconds)
+
+    def on_vacate(self, floor: int, vehicle: Vehicle, seconds: float) -> None:
+        self._record(("vacate", floor, type(vehicle).__name__), seconds)
+
+    def counter(self, event: str, floor: int = None, vehicle_type: str = None) -> int:
+        """
+        Sum of the counters matching the given filters
+        """
+        total = 0
+        for (e, f, v), histogram in list(self.histograms.items()):
+            if e != event:
+                continue
+            if floor is not None and f != floor:
+                continue
+            if vehicle_type is not None and v != vehicle_type:
+                continue
+            total += histogram.count
+        return total
+
+    def snapshot(self) -> Dict[MetricKey, dict]:
+        """
+        Counters and latency summary (microseconds) of every key
+        """
+        items = list(self.histograms.items())
+        return {
+            key: {
+                "count": h.count,
+                "mean_us": h.mean() * 1e6,
+                "p50_us": h.percentile(50) * 1e6,
+                "p99_us": h.percentile(99) * 1e6,
+            }
+            for key, h in items
+        }
+
+    def reset(self) -> None:
+        self.histograms = {}
+
+
+def print_snapshot(snapshot: Dict[MetricKey, dict]) -> None:
+    for (event, floor, vehicle_type), stats in sorted(
+        snapshot.items(), key=lambda item: (item[0][0], -1 if item[0][1] is None else item[0][1], item[0][2])
+    ):
+        where = "-" if floor is None else floor
+        print(
+            f"{event:<7} floor={where} {vehicle_type:<10} count={stats['count']:<6} "
+            f"mean={stats['mean_us']:.1f}us p50<={stats['p50_us']:.0f}us "
+            f"p99<={stats['p99_us']:.0f}us"
+        )
+
+
+class PeriodicExporter:
+    """
+    Calls `sink` with a metrics snapshot every `interval` seconds
+    """
+
+    def __init__(
+        self,
+        metrics: ParkingLotMetrics,
+        interval: float = 10.0,
+        sink: Callable[[Dict[MetricKey, dict]], None] = print_snapshot,
+    ):
+        self.metrics = metrics
+        self.interval = interval
+        self.sink = sink
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None:
+            raise Exception("exporter already started")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        # flush what happened since the last export
+        self.sink(self.metrics.snapshot())
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.sink(self.metrics.snapshot())
+
+
+def main():
+    floors = [
+        Floor.build().add_motorcycle_spots(5).add_large_spots(5).finalize(),
+        Floor.build().add_large_spots(10).add_bus_spots(1).finalize(),
+    ]
+    lot = ParkingLot(floors)
+    metrics = ParkingLotMetrics()
+    lot.add_listener(metrics)
+
+    exporter = PeriodicExporter(metrics, interval=0.5)
+    exporter.start()
+
+    vehicles = [LargeCar("owner", f"L{i}") for i in range(18)]
+    vehicles += [Motorcycle("owner", f"M{i}") for i in range(3)]
+    vehicles += [Bus("owner", f"B{i}") for i in range(2)]
+    parked = [v for v in vehicles if lot.park_vehicle(v)]
+    for vehicle in parked[::2]:
+        lot.vacate_spot(vehicle)
+
+    exporter.stop()
+    print("rejected large cars:", metrics.counter("reject", vehicle_type="LargeCar"))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,7 +22,8 @@ Does the parking lot have multiple levels
 from __future__ import annotations
 from abc import ABC, abstractmethod
 from enum import Enum
-from typing import List, Self
+from time import perf_counter
+from typing import List, Optional, Self
 
 
 class SpotSize(Enum):
@@ -63,7 +64,7 @@ class Spot:
         self.status = SpotStatus.Taken
 
     def reserve_spot(self, name: str) -> None:
-        self.status = SpotStatus.Taken
+        self.status = SpotStatus.Reserved
         self.reserved_by = name
 
     def clear_spot(self) -> None:
@@ -82,11 +83,20 @@ class Vehicle(ABC):
         self.plate = plate
         self.spots_needed = spots_needed
         self.spots: List[Spot] = []
+        # index of the floor the vehicle is parked on
+        self.floor: Optional[int] = None
 
     @abstractmethod
     def can_fit_in_spot(self, spot: Spot):
         pass
 
+    @abstractmethod
+    def fits_size(self, spot: Spot) -> bool:
+        """
+        True if the vehicle fits the size of the spot, taken or not
+        """
+        pass
+
     def clear_spots(self) -> None:
         for spot in self.spots:
             spot.clear_spot()
@@ -103,6 +113,9 @@ class Motorcycle(Vehicle):
     def can_fit_in_spot(self, spot: Spot):
         return spot.is_available()
 
+    def fits_size(self, spot: Spot) -> bool:
+        return True
+
 
 class Compact(Vehicle):
     def __init__(self, owner: str, plate: str):
@@ -110,10 +123,11 @@ class Compact(Vehicle):
 
     def can_fit_in_spot(self, spot: Spot):
         return (
-            spot.spot_size == SpotSize.Compact
-            or spot.spot_size == SpotSize.Large
-            and spot.is_available()
-        )
+            spot.spot_size == SpotSize.Compact or spot.spot_size == SpotSize.Large
+        ) and spot.is_available()
+
+    def fits_size(self, spot: Spot) -> bool:
+        return spot.spot_size == SpotSize.Compact or spot.spot_size == SpotSize.Large
 
 
 class LargeCar(Vehicle):
@@ -123,6 +137,9 @@ class LargeCar(Vehicle):
     def can_fit_in_spot(self, spot: Spot):
         return spot.spot_size == SpotSize.Large and spot.is_available()
 
+    def fits_size(self, spot: Spot) -> bool:
+        return spot.spot_size == SpotSize.Large
+
 
 class Bus(Vehicle):
     def __init__(self, owner: str, plate: str):
@@ -131,6 +148,9 @@ class Bus(Vehicle):
     def can_fit_in_spot(self, spot: Spot):
         return spot.spot_size == SpotSize.Large and spot.is_available()
 
+    def fits_size(self, spot: Spot) -> bool:
+        return spot.spot_size == SpotSize.Large
+
 
 class FloorBuilder:
     def __init__(self):
@@ -196,23 +216,85 @@ class Floor:
         return False
 
 
+class ParkingLotListener:
+    """
+    Subscriber interface for ParkingLot events.
+
+    Every hook is a no-op by default so listeners only override the events
+    they care about. `seconds` is the time the operation took.
+    """
+
+    def on_park(self, floor: int, vehicle: Vehicle, seconds: float) -> None:
+        pass
+
+    def on_reject(self, vehicle: Vehicle, seconds: float) -> None:
+        pass
+
+    def on_vacate(self, floor: int, vehicle: Vehicle, seconds: float) -> None:
+        pass
+
+
+class PrintListener(ParkingLotListener):
+    """
+    Prints park and reject events like ParkingLot always did, for demos
+    """
+
+    def on_park(self, floor: int, vehicle: Vehicle, seconds: float) -> None:
+        print(f"vehicle: {vehicle.spot_size}-{vehicle.plate} parked")
+
+    def on_reject(self, vehicle: Vehicle, seconds: float) -> None:
+        print(f"No spots available for vehicle: {vehicle.spot_size}-{vehicle.plate}")
+
+
 class ParkingLot:
     def __init__(self, floors: List[Floor] = None):
         self.floors: List[Floor] = floors
+        # optional ReservationBook, registers itself
+        self.reservations = None
+        # nothing is timed or reported while there are no listeners
+        self.listeners: List[ParkingLotListener] = []
 
     def add_floor(self, floor: Floor) -> None:
         self.floors.append(floor)
+        if self.reservations is not None:
+            self.reservations.add_floor(floor)
+
+    def add_listener(self, listener: ParkingLotListener) -> None:
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener: ParkingLotListener) -> None:
+        self.listeners.remove(listener)
 
     def park_vehicle(self, vehicle: Vehicle):
-        for floor in self.floors:
+        listeners = self.listeners
+        start = perf_counter() if listeners else 0.0
+        if self.reservations is not None:
+            # hold spots of upcoming reservations so they are not given away
+            self.reservations.hold_upcoming()
+        for index, floor in enumerate(self.floors):
             if floor.park_vehicle(vehicle) is True:
-                print(f"vehicle: {vehicle.spot_size}-{vehicle.plate} parked")
+                vehicle.floor = index
+                if listeners:
+                    elapsed = perf_counter() - start
+                    for listener in listeners:
+                        listener.on_park(index, vehicle, elapsed)
                 return True
-        print(f"No spots available for vehicle: {vehicle.spot_size}-{vehicle.plate}")
+        if listeners:
+            elapsed = perf_counter() - start
+            for listener in listeners:
+                listener.on_reject(vehicle, elapsed)
         return False
 
     def vacate_spot(self, vehicle: Vehicle):
+        listeners = self.listeners
+        start = perf_counter() if listeners else 0.0
+        floor = vehicle.floor
         vehicle.clear_spots()
+        vehicle.floor = None
+        if listeners:
+            elapsed = perf_counter() - start
+            for listener in listeners:
+                listener.on_vacate(floor, vehicle, elapsed)
 
 
 def main():
@@ -235,6 +317,7 @@ def main():
     )
 
     lot = ParkingLot([floor1, floor2])
+    lot.add_listener(PrintListener())
 
     car1 = LargeCar("owner1", "AB123")
     bus1 = Bus("busowner", "busplate")
@@ -0,0 +1,381 @@
+"""
+Time-windowed reservations for ParkingLot spots
+
+A reservation books one spot for a window [start, end). Each floor keeps an
+interval index:
+- per spot, the sorted non-overlapping reservation windows, so a conflict
+  check on a spot is a binary search
+- per spot size, the sorted start and end times of every reservation, so
+  the number of reservations overlapping a window is two binary searches
+
+Spots whose reservation starts within `lead_time` are held (SpotStatus.Reserved)
+so ParkingLot.park_vehicle does not give them away. Expired reservations
+are swept in bulk.
+
+Times are plain numbers in the unit of `clock` (seconds by default).
+"""
+
+from __future__ import annotations
+import heapq
+import itertools
+import time
+from bisect import bisect_left, bisect_right, insort
+from enum import Enum
+from typing import Callable, Dict, List, Optional
+from parking_lot import (
+    Bus,
+    Compact,
+    Floor,
+    LargeCar,
+    Motorcycle,
+    ParkingLot,
+    PrintListener,
+    Spot,
+    SpotSize,
+    SpotStatus,
+    Vehicle,
+)
+
+
+class ReservationStatus(Enum):
+    """
+    Enumeration of the reservation status
+    """
+
+    Pending = 0
+    Held = 1
+    CheckedIn = 2
+    Cancelled = 3
+    Expired = 4
+
+
+class Reservation:
+    def __init__(self, spot: Spot, name: str, start: float, end: float):
+        if end <= start:
+            raise ValueError("reservation must end after it starts")
+        self.spot = spot
+        self.name = name
+        self.start = start
+        self.end = end
+        self.status = ReservationStatus.Pending
+
+    def __repr__(self) -> str:
+        return f"Reservation({self.name}, {self.spot.spot_size}, {self.start}-{self.end})"
+
+
+class SpotSchedule:
+    """
+    Sorted, non-overlapping reservation windows of a single spot
+    """
+
+    def __init__(self):
+        self.starts: List[float] = []
+        self.ends: List[float] = []
+        self.reservations: List[Reservation] = []
+
+    def conflicts(self, start: float, end: float) -> bool:
+        # windows never overlap so ends are sorted as well as starts
+        i = bisect_right(self.ends, start)
+        return i < len(self.starts) and self.starts[i] < end
+
+    def add(self, reservation: Reservation) -> None:
+        if self.conflicts(reservation.start, reservation.end):
+            raise Exception(f"{reservation} conflicts with an existing reservation")
+        i = bisect_left(self.starts, reservation.start)
+        self.starts.insert(i, reservation.start)
+        self.ends.insert(i, reservation.end)
+        self.reservations.insert(i, reservation)
+
+    def remove(self, reservation: Reservation) -> None:
+        i = self.reservations.index(reservation)
+        del self.starts[i], self.ends[i], self.reservations[i]
+
+    def expire(self, now: float) -> List[Reservation]:
+        """
+        Drop and return every reservation ended by `now`
+        """
+        i = bisect_right(self.ends, now)
+        expired = self.reservations[:i]
+        del self.starts[:i], self.ends[:i], self.reservations[:i]
+        return expired
+
+
+class FloorReservations:
+    """
+    Interval index of the reservations of one floor
+    """
+
+    def __init__(self, floor: Floor):
+        self.floor = floor
+        self.schedules: Dict[Spot, SpotSchedule] = {}
+        self.spots_by_size: Dict[SpotSize, List[Spot]] = {}
+        self._starts: Dict[SpotSize, List[float]] = {}
+        self._ends: Dict[SpotSize, List[float]] = {}
+        for spot in floor.spots:
+            self.schedules[spot] = SpotSchedule()
+            self.spots_by_size.setdefault(spot.spot_size, []).append(spot)
+            self._starts.setdefault(spot.spot_size, [])
+            self._ends.setdefault(spot.spot_size, [])
+
+    def overlapping(self, size: SpotSize, start: float, end: float) -> int:
+        """
+        Number of reservations of a spot size overlapping [start, end)
+        """
+        if size not in self._starts:
+            return 0
+        return bisect_left(self._starts[size], end) - bisect_right(
+            self._ends[size], start
+        )
+
+    def find_spot(self, size: SpotSize, start: float, end: float) -> Optional[Spot]:
+        """
+        Returns a spot of the given size free during [start, end), if any
+        """
+        for spot in self.spots_by_size.get(size, []):
+            if not self.schedules[spot].conflicts(start, end):
+                return spot
+        return None
+
+    def add(self, reservation: Reservation) -> None:
+        size = reservation.spot.spot_size
+        self.schedules[reservation.spot].add(reservation)
+        insort(self._starts[size], reservation.start)
+        insort(self._ends[size], reservation.end)
+
+    def remove(self, reservation: Reservation) -> None:
+        size = reservation.spot.spot_size
+        self.schedules[reservation.spot].remove(reservation)
+        starts, ends = self._starts[size], self._ends[size]
+        del starts[bisect_left(starts, reservation.start)]
+        del ends[bisect_left(ends, reservation.end)]
+
+    def sweep(self, now: float) -> List[Reservation]:
+        """
+        Remove every reservation ended by `now` in one pass
+        """
+        expired = []
+        for size, ends in self._ends.items():
+            count = bisect_right(ends, now)
+            if not count:
+                continue
+            del ends[:count]
+            for spot in self.spots_by_size[size]:
+                expired.extend(self.schedules[spot].expire(now))
+            self._starts[size] = sorted(
+                s for spot in self.spots_by_size[size] for s in self.schedules[spot].starts
+            )
+        return expired
+
+
+class ReservationBook:
+    """
+    Reservation subsystem of a ParkingLot.
+
+    Registers itself on the lot so ParkingLot.park_vehicle holds upcoming
+    reservations before looking for a spot.
+    """
+
+    def __init__(
+        self,
+        lot: ParkingLot,
+        lead_time: float = 15 * 60,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.lot = lot
+        self.lead_time = lead_time
+        self.clock = clock
+        self.floors: Dict[Floor, FloorReservations] = {
+            floor: FloorReservations(floor) for floor in lot.floors
+        }
+        self._spot_floor: Dict[Spot, FloorReservations] = {
+            spot: index for index in self.floors.values() for spot in index.floor.spots
+        }
+        # reservations not held yet, ordered by start time
+        self._pending: List[tuple] = []
+        self._sequence = itertools.count()
+        lot.reservations = self
+
+    def add_floor(self, floor: Floor) -> None:
+        index = FloorReservations(floor)
+        self.floors[floor] = index
+        for spot in floor.spots:
+            self._spot_floor[spot] = index
+
+    def is_available(self, size: SpotSize, start: float, end: float) -> bool:
+        """
+        True if some spot of the given size is free during [start, end).
+
+        Each reservation blocks at most one spot, so a floor with fewer
+        overlapping reservations than spots answers in O(log n). Only fully
+        booked floors fall back to checking spot by spot.
+        """
+        for index in self.floors.values():
+            if len(index.spots_by_size.get(size, [])) > index.overlapping(
+                size, start, end
+            ):
+                return True
+        return self.find_spot(size, start, end) is not None
+
+    def find_spot(self, size: SpotSize, start: float, end: float) -> Optional[Spot]:
+        for index in self.floors.values():
+            spot = index.find_spot(size, start, end)
+            if spot is not None:
+                return spot
+        return None
+
+    def conflicts(self, spot: Spot, start: float, end: float) -> bool:
+        return self._spot_floor[spot].schedules[spot].conflicts(start, end)
+
+    def reserve_spot(self, spot: Spot, name: str, start: float, end: float) -> Reservation:
+        """
+        Reserve a specific spot. Raises if the window conflicts
+        """
+        reservation = Reservation(spot, name, start, end)
+        self._spot_floor[spot].add(reservation)
+        heapq.heappush(self._pending, (start, next(self._sequence), reservation))
+        return reservation
+
+    def reserve(self, size: SpotSize, name: str, start: float, end: float) -> Reservation:
+        """
+        Reserve any spot of the given size
+        """
+        spot = self.find_spot(size, start, end)
+        if spot is None:
+            raise Exception(f"No {size} spot available between {start} and {end}")
+        return self.reserve_spot(spot, name, start, end)
+
+    def cancel(self, reservation: Reservation) -> None:
+        if reservation.status in (ReservationStatus.Cancelled, ReservationStatus.Expired):
+            return
+        self._spot_floor[reservation.spot].remove(reservation)
+        self._release(reservation)
+        reservation.status = ReservationStatus.Cancelled
+
+    def hold_upcoming(self, now: float = None) -> None:
+        """
+        Mark vacant spots whose reservation starts within lead_time as Reserved.
+        Spots still taken are retried on the next call.
+        """
+        now = self.clock() if now is None else now
+        self.sweep(now)
+        horizon = now + self.lead_time
+        retry = []
+        while self._pending and self._pending[0][0] <= horizon:
+            entry = heapq.heappop(self._pending)
+            reservation: Reservation = entry[2]
+            if reservation.status != ReservationStatus.Pending:
+                continue
+            if reservation.spot.is_available():
+                reservation.spot.reserve_spot(reservation.name)
+                reservation.status = ReservationStatus.Held
+            else:
+                retry.append(entry)
+        for entry in retry:
+            heapq.heappush(self._pending, entry)
+
+    def sweep(self, now: float = None) -> List[Reservation]:
+        """
+        Expire every reservation that ended by `now` and release held spots
+        """
+        now = self.clock() if now is None else now
+        expired = []
+        for index in self.floors.values():
+            expired.extend(index.sweep(now))
+        for reservation in expired:
+            if reservation.status != ReservationStatus.CheckedIn:
+                self._release(reservation)
+                reservation.status = ReservationStatus.Expired
+        return expired
+
+    def check_in(self, reservation: Reservation, vehicle: Vehicle) -> None:
+        """
+        Park the vehicle of the reservation holder in the reserved spot.
+        A reservation books a single spot, so vehicles needing several
+        spots (buses) cannot check in.
+        """
+        if reservation.status not in (ReservationStatus.Pending, ReservationStatus.Held):
+            raise Exception(f"{reservation} is {reservation.status}")
+        spot = reservation.spot
+        if vehicle.spots_needed > 1 or not vehicle.fits_size(spot):
+            raise Exception(f"{vehicle.plate} does not fit in {reservation}")
+        if not spot.is_available() and not self._holds(reservation):
+            raise Exception(f"{vehicle.plate} cannot park in {reservation}, spot is taken")
+        spot.clear_spot()
+        vehicle.take_spot(spot)
+        vehicle.floor = self.lot.floors.index(self._spot_floor[spot].floor)
+        reservation.status = ReservationStatus.CheckedIn
+
+    @staticmethod
+    def _holds(reservation: Reservation) -> bool:
+        spot = reservation.spot
+        return spot.status == SpotStatus.Reserved and spot.reserved_by == reservation.name
+
+    def _release(self, reservation: Reservation) -> None:
+        if reservation.status == ReservationStatus.Held and self._holds(reservation):
+            reservation.spot.clear_spot()
+
+
+def main():
+    floor = Floor.build().add_compact_spots(2).add_large_spots(2).finalize()
+    lot = ParkingLot([floor])
+    lot.add_listener(PrintListener())
+
+    now = [0.0]
+    book = ReservationBook(lot, lead_time=30, clock=lambda: now[0])
+
+    res1 = book.reserve(SpotSize.Large, "alice", 60, 180)
+    res2 = book.reserve(SpotSize.Large, "bob", 100, 200)
+    print(res1, res2)
+    print("large spot free 120-150:", book.is_available(SpotSize.Large, 120, 150))
+    print("large spot free 200-260:", book.is_available(SpotSize.Large, 200, 260))
+
+    # alice's spot is held 30 minutes ahead, walk-ins get the other one
+    now[0] = 45
+    lot.park_vehicle(LargeCar("walkin", "W1"))
+    print([spot.status for spot in floor.spots])
+    lot.park_vehicle(LargeCar("walkin", "W2"))
+
+    now[0] = 60
+    alice = LargeCar("alice", "A1")
+    book.check_in(res1, alice)
+    print([spot.status for spot in floor.spots])
+
+    now[0] = 300
+    print("expired:", book.sweep())
+
+    # held spots of every size turn away walk-ins of every size
+    floor = (
+        Floor.build()
+        .add_motorcycle_spots(1)
+        .add_compact_spots(1)
+        .add_large_spots(5)
+        .finalize()
+    )
+    lot = ParkingLot([floor])
+    book = ReservationBook(lot, lead_time=30, clock=lambda: 0)
+    reservations = [
+        book.reserve_spot(spot, f"holder{i}", 10, 100) for i, spot in enumerate(floor.spots)
+    ]
+    walkins = [
+        Motorcycle("walkin", "M1"),
+        Compact("walkin", "C1"),
+        LargeCar("walkin", "L1"),
+        Bus("walkin", "B1"),
+    ]
+    parked = [lot.park_vehicle(vehicle) for vehicle in walkins]
+    held = all(spot.status == SpotStatus.Reserved for spot in floor.spots)
+    print("held spots rejected every walk-in:", not any(parked) and held)
+
+    # the size is checked even though the motorcycle spot is held
+    for vehicle in (Bus("holder0", "B2"), LargeCar("holder0", "L2")):
+        try:
+            book.check_in(reservations[0], vehicle)
+        except Exception as e:
+            print(e)
+    motorcycle = Motorcycle("holder0", "M2")
+    book.check_in(reservations[0], motorcycle)
+    print("checked in on floor", motorcycle.floor)
+
+
+if __name__ == "__main__":
+    main()
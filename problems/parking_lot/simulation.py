@@ -0,0 +1,300 @@
+"""
+Discrete-event simulation of a ParkingLot
+
+Vehicles of each type arrive following a configurable inter-arrival
+distribution and stay for a configurable dwell time. Every arrival is an
+attempt to park, every departure vacates the vehicle's spots.
+
+The simulator only relies on ParkingLot.park_vehicle / vacate_spot and on
+Floor.spots, so any Floor implementation (allocation strategy) can be
+plugged in and compared against the default first-fit Floor.
+
+Time is measured in simulated minutes.
+"""
+
+from __future__ import annotations
+import heapq
+import itertools
+import math
+import random
+import time
+from typing import Callable, Dict, List, Type
+from parking_lot import (
+    Bus,
+    Compact,
+    Floor,
+    LargeCar,
+    Motorcycle,
+    ParkingLot,
+    SpotStatus,
+    Vehicle,
+)
+
+# A distribution draws a positive number of minutes from a random generator
+Distribution = Callable[[random.Random], float]
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def exponential(mean: float) -> Distribution:
+    """
+    Exponential distribution (Poisson arrivals) with the given mean
+    """
+    return lambda rng: rng.expovariate(1 / mean)
+
+
+def uniform(low: float, high: float) -> Distribution:
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal(mean: float, sigma: float) -> Distribution:
+    """
+    Log-normal distribution parameterized by its median `mean`, useful
+    for dwell times with a long tail
+    """
+    mu = math.log(mean)
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+class VehicleTraffic:
+    """
+    Traffic profile of a vehicle type: how often it arrives and how long it stays
+    """
+
+    def __init__(
+        self,
+        vehicle_type: Type[Vehicle],
+        arrival: Distribution,
+        dwell: Distribution,
+    ):
+        self.vehicle_type = vehicle_type
+        self.arrival = arrival
+        self.dwell = dwell
+
+    @property
+    def name(self) -> str:
+        return self.vehicle_type.__name__
+
+
+class SimulationReport:
+    """
+    Results of a simulation run
+    """
+
+    def __init__(
+        self,
+        simulated_minutes: float,
+        wall_seconds: float,
+        arrivals: Dict[str, int],
+        rejections: Dict[str, int],
+        latencies: List[float],
+        fragmentation: List[float],
+    ):
+        self.simulated_minutes = simulated_minutes
+        self.wall_seconds = wall_seconds
+        self.arrivals = arrivals
+        self.rejections = rejections
+        self.latencies = sorted(latencies)
+        self.fragmentation = fragmentation
+
+    def rejection_rate(self, name: str = None) -> float:
+        """
+        Fraction of arrivals that could not park. Overall when name is None,
+        otherwise for the given vehicle type name
+        """
+        if name is None:
+            arrivals = sum(self.arrivals.values())
+            rejections = sum(self.rejections.values())
+        else:
+            arrivals = self.arrivals.get(name, 0)
+            rejections = self.rejections.get(name, 0)
+        return rejections / arrivals if arrivals else 0.0
+
+    def latency_percentile(self, pct: float) -> float:
+        """
+        Allocation latency percentile in microseconds
+        """
+        if not self.latencies:
+            return 0.0
+        index = min(len(self.latencies) - 1, int(len(self.latencies) * pct / 100))
+        return self.latencies[index] * 1e6
+
+    def mean_fragmentation(self) -> float:
+        if not self.fragmentation:
+            return 0.0
+        return sum(self.fragmentation) / len(self.fragmentation)
+
+    def throughput(self) -> float:
+        """
+        Allocation attempts per wall-clock second
+        """
+        attempts = sum(self.arrivals.values())
+        return attempts / self.wall_seconds if self.wall_seconds else 0.0
+
+    def __str__(self) -> str:
+        lines = [
+            f"simulated {self.simulated_minutes / MINUTES_PER_DAY:.1f} days "
+            f"in {self.wall_seconds:.2f}s",
+            f"throughput: {self.throughput():,.0f} allocations/s",
+            f"rejection rate: {self.rejection_rate():.2%}",
+        ]
+        for name in self.arrivals:
+            lines.append(
+                f"  {name}: {self.arrivals[name]} arrivals, "
+                f"{self.rejection_rate(name):.2%} rejected"
+            )
+        lines.append(
+            "allocation latency (us): "
+            + ", ".join(
+                f"p{p}={self.latency_percentile(p):.1f}" for p in (50, 90, 99)
+            )
+        )
+        lines.append(f"mean fragmentation: {self.mean_fragmentation():.2%}")
+        return "\n".join(lines)
+
+
+def floor_fragmentation(floor: Floor) -> float:
+    """
+    1 - (longest run of vacant spots / vacant spots).
+
+    0 means all vacant spots are contiguous, values close to 1 mean vacant
+    spots are scattered and large vehicles cannot use them.
+    """
+    vacant = longest = run = 0
+    for spot in floor.spots:
+        if spot.status == SpotStatus.Vacant:
+            vacant += 1
+            run += 1
+            longest = max(longest, run)
+        else:
+            run = 0
+    if not vacant:
+        return 0.0
+    return 1 - longest / vacant
+
+
+class ParkingLotSimulator:
+    """
+    Discrete-event simulator driving a ParkingLot.
+
+    Events are kept in a heap ordered by simulated time. Each vehicle type
+    has a single pending arrival event at any time, which schedules the next
+    one when it fires.
+    """
+
+    _ARRIVAL = 0
+    _DEPARTURE = 1
+
+    def __init__(
+        self,
+        lot: ParkingLot,
+        traffic: List[VehicleTraffic],
+        seed: int = 0,
+        sample_every: float = 60,
+    ):
+        self.lot = lot
+        self.traffic = traffic
+        self.rng = random.Random(seed)
+        self.sample_every = sample_every
+        self._events: List[tuple] = []
+        self._sequence = itertools.count()
+
+    def _schedule(self, at: float, kind: int, payload) -> None:
+        # the sequence number breaks ties so payloads are never compared
+        heapq.heappush(self._events, (at, next(self._sequence), kind, payload))
+
+    def run(self, days: float = 1) -> SimulationReport:
+        horizon = days * MINUTES_PER_DAY
+        arrivals = {t.name: 0 for t in self.traffic}
+        rejections = {t.name: 0 for t in self.traffic}
+        latencies: List[float] = []
+        fragmentation: List[float] = []
+        plates = itertools.count()
+        next_sample = 0.0
+
+        for profile in self.traffic:
+            self._schedule(profile.arrival(self.rng), self._ARRIVAL, profile)
+
+        clock = time.perf_counter
+        start = clock()
+        while self._events:
+            now, _, kind, payload = heapq.heappop(self._events)
+            if now > horizon:
+                break
+
+            while next_sample <= now:
+                fragmentation.append(
+                    sum(map(floor_fragmentation, self.lot.floors))
+                    / len(self.lot.floors)
+                )
+                next_sample += self.sample_every
+
+            if kind == self._DEPARTURE:
+                self.lot.vacate_spot(payload)
+                continue
+
+            profile: VehicleTraffic = payload
+            arrivals[profile.name] += 1
+            vehicle = profile.vehicle_type("sim", f"P{next(plates)}")
+            t0 = clock()
+            parked = self.lot.park_vehicle(vehicle)
+            latencies.append(clock() - t0)
+            if parked:
+                self._schedule(
+                    now + profile.dwell(self.rng), self._DEPARTURE, vehicle
+                )
+            else:
+                rejections[profile.name] += 1
+            self._schedule(now + profile.arrival(self.rng), self._ARRIVAL, profile)
+        wall = clock() - start
+        self._events = []
+
+        return SimulationReport(
+            horizon, wall, arrivals, rejections, latencies, fragmentation
+        )
+
+
+def compare(
+    floor_factories: Dict[str, Callable[[], List[Floor]]],
+    traffic: List[VehicleTraffic],
+    days: float = 1,
+    seed: int = 0,
+) -> Dict[str, SimulationReport]:
+    """
+    Run the same traffic (same seed) against several floor layouts or Floor
+    implementations and return a report for each
+    """
+    reports = {}
+    for name, factory in floor_factories.items():
+        simulator = ParkingLotSimulator(ParkingLot(factory()), traffic, seed)
+        reports[name] = simulator.run(days)
+    return reports
+
+
+def main():
+    def default_floors() -> List[Floor]:
+        return [
+            Floor.build()
+            .add_motorcycle_spots(20)
+            .add_compact_spots(40)
+            .add_large_spots(30)
+            .add_bus_spots(4)
+            .finalize()
+            for _ in range(3)
+        ]
+
+    traffic = [
+        VehicleTraffic(Motorcycle, exponential(6), lognormal(90, 0.6)),
+        VehicleTraffic(Compact, exponential(0.8), lognormal(120, 0.7)),
+        VehicleTraffic(LargeCar, exponential(1.5), lognormal(120, 0.7)),
+        VehicleTraffic(Bus, exponential(45), uniform(30, 240)),
+    ]
+
+    reports = compare({"first-fit": default_floors}, traffic, days=7)
+    for name, report in reports.items():
+        print(f"== {name}")
+        print(report)
+
+
+if __name__ == "__main__":
+    main()